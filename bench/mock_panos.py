@@ -0,0 +1,294 @@
+# This file is a local mock of the PAN-OS XML API endpoints the downloader uses, for benchmarks.
+# It serves keygen, "show system info", packet-capture op commands and filters-pcap exports of
+# synthetic captures over HTTPS (self-signed certificate, generated with the openssl command).
+#
+#   python bench/mock_panos.py --firewalls 10 --base-port 18443 --pcap-size 2000000 --latency 0.2
+#
+# Each simulated firewall listens on its own port; connect to it as 127.0.0.1:<port>.
+import argparse
+import os
+import random
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CAPTURE_FILES = ["rx.pcap", "tx.pcap", "drp.pcap", "fw.pcap"]
+PACKET_SIZE = 512
+SEND_CHUNK_SIZE = 64 * 1024
+
+SYSTEM_INFO = (
+    "<response status=\"success\"><result><system>"
+    "<hostname>mock-fw-{port}</hostname><ip-address>127.0.0.1</ip-address>"
+    "<model>PA-VM</model><serial>MOCK{port:08d}</serial><sw-version>10.2.4</sw-version>"
+    "<app-version>8700-8000</app-version><multi-vsys>off</multi-vsys>"
+    "</system></result></response>"
+)
+
+
+def xml_response(status, body=""):
+    return f"<response status=\"{status}\">{body}</response>".encode("utf-8")
+
+
+def error_response(message):
+    return xml_response("error", f"<msg><line>{message}</line></msg>")
+
+
+def build_pcap(packets, first_packet=0, seed=0):
+    """
+    Returns a classic pcap (Ethernet, microsecond timestamps) of packets UDP packets of PACKET_SIZE bytes.
+    Packet i always has the same timestamp and content, so a capture that grows between exports
+    keeps its earlier records byte-identical, like a real filter-pcap file being appended to.
+    """
+    out = bytearray(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+    payload = bytes(random.Random(seed).getrandbits(8) for _ in range(PACKET_SIZE - 42))
+    base = 1_700_000_000
+    for i in range(first_packet, first_packet + packets):
+        src = struct.pack('>I', 0x0A000000 | (i % 250 + 1))
+        dst = struct.pack('>I', 0x0A010000 | (seed % 250 + 1))
+        ip = (b"\x45\x00" + struct.pack('>H', PACKET_SIZE - 14) + b"\x00\x00\x40\x00\x40\x11\x00\x00" + src + dst)
+        udp = struct.pack('>HHHH', 1024 + i % 60000, 443, PACKET_SIZE - 34, 0)
+        frame = b"\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb\x08\x00" + ip + udp + payload
+        out += struct.pack('<IIII', base + i // 1000, (i % 1000) * 1000, len(frame), len(frame))
+        out += frame
+    return bytes(out)
+
+
+class MockFirewall:
+    """
+    State and behaviour of one simulated firewall.
+    """
+
+    def __init__(self, port, options):
+        self.port = port
+        self.options = options
+        self.random = random.Random(port)
+        self.lock = threading.Lock()
+        self.exports = {name: 0 for name in CAPTURE_FILES}
+        self.exporting = 0  # exports in progress, for --load-latency
+        self.capturing = False
+        self.keys = {}  # API key -> time issued
+
+    def issue_key(self):
+        with self.lock:
+            key = f"LUFRPT1tb2NrLWtleS0{self.port}-{len(self.keys)}"
+            self.keys[key] = time.monotonic()
+        return key
+
+    def key_valid(self, key):
+        with self.lock:
+            issued = self.keys.get(key)
+        if issued is None:
+            return False
+        return not self.options.key_lifetime or time.monotonic() - issued < self.options.key_lifetime
+
+    def capture(self, name):
+        """
+        Returns the current contents of a capture file. With --append-packets the file grows on every export.
+        """
+        with self.lock:
+            exports = self.exports[name]
+            self.exports[name] += 1
+        packets = max(self.options.pcap_size // (PACKET_SIZE + 16), 1) + exports * self.options.append_packets
+        return _cached_pcap(packets, CAPTURE_FILES.index(name))
+
+    def clear(self):
+        # Cleared captures start over from their initial size
+        with self.lock:
+            self.exports = {name: 0 for name in CAPTURE_FILES}
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+
+_pcap_cache = {}
+_pcap_cache_lock = threading.Lock()
+
+
+def _cached_pcap(packets, seed):
+    key = (packets, seed)
+    with _pcap_cache_lock:
+        data = _pcap_cache.get(key)
+    if data is None:
+        data = build_pcap(packets, seed=seed)
+        with _pcap_cache_lock:
+            if len(_pcap_cache) > 64:
+                _pcap_cache.clear()
+            _pcap_cache[key] = data
+    return data
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real management plane
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            sys.stderr.write("%s - %s\n" % (self.server.firewall.port, format % args))
+
+    def do_GET(self):
+        self._handle(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        params = parse_qs(urlparse(self.path).query)
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(parse_qs(self.rfile.read(length).decode("utf-8", "replace")))
+        self._handle(params)
+
+    def _handle(self, params):
+        firewall = self.server.firewall
+        options = self.server.options
+        param = {k: v[0] for k, v in params.items()}
+        request_type = param.get("type")
+        if request_type == "keygen":
+            if param.get("user") and param.get("password") == options.password:
+                return self._send_xml(xml_response("success", f"<result><key>{firewall.issue_key()}</key></result>"))
+            return self._send_xml(error_response("Invalid credentials."), status=403)
+        if not firewall.key_valid(param.get("key")):
+            return self._send_xml(error_response("Invalid Credential"), status=403)
+        if request_type == "op":
+            cmd = param.get("cmd", "")
+            if "<system><info>" in cmd:
+                return self._send_xml(SYSTEM_INFO.format(port=firewall.port).encode("utf-8"))
+            if "<packet-capture>" in cmd or "<filter-pcap>" in cmd:
+                firewall.capturing = "<start>" in cmd or (firewall.capturing and "<stop" not in cmd)
+                if "<clear>" in cmd:
+                    firewall.clear()
+                return self._send_xml(xml_response("success", "<result>ok</result>"))
+            return self._send_xml(error_response(f"Unsupported command {cmd}"))
+        if request_type == "export" and param.get("category") == "filters-pcap":
+            name = param.get("from")
+            with firewall.lock:
+                busy = firewall.exporting
+                firewall.exporting += 1
+            try:
+                delay = options.latency * firewall.random.uniform(0.5, 1.5) if options.latency_jitter else options.latency
+                # A small management plane slows down sharply with every concurrent export
+                delay += options.load_latency * busy * busy
+                if delay:
+                    time.sleep(delay)
+            finally:
+                with firewall.lock:
+                    firewall.exporting -= 1
+            if name not in CAPTURE_FILES or firewall.roll(options.missing_rate):
+                return self._send_xml(error_response(f"No such file or directory: {name}"))
+            if firewall.roll(options.error_rate):
+                return self._send_xml(error_response("Export failed: management server busy"), status=500)
+            return self._send_capture(firewall.capture(name))
+        return self._send_xml(error_response(f"Unsupported request type {request_type}"), status=400)
+
+    def _send_xml(self, body, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_capture(self, data):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        bandwidth = self.server.options.bandwidth * 1e6 if self.server.options.bandwidth else None
+        started = time.monotonic()
+        view = memoryview(data)
+        for offset in range(0, len(data), SEND_CHUNK_SIZE):
+            self.wfile.write(view[offset:offset + SEND_CHUNK_SIZE])
+            if bandwidth:
+                # Throttle to the configured per-download bandwidth
+                delay = (offset + SEND_CHUNK_SIZE) / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port, options, ssl_context):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.options = options
+        self.firewall = MockFirewall(self.server_address[1], options)
+        self.ssl_context = ssl_context
+
+    def finish_request(self, request, client_address):
+        # The TLS handshake runs in the per-connection thread, not in the accept loop
+        try:
+            request = self.ssl_context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(request, client_address)
+
+
+def create_certificate(directory):
+    """
+    Creates a throwaway self-signed certificate with the openssl command. Returns (cert path, key path).
+    """
+    cert = os.path.join(directory, "mock.crt")
+    key = os.path.join(directory, "mock.key")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-subj", "/CN=localhost",
+                    "-days", "1", "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+def start_servers(options):
+    """
+    Starts one mock firewall per port in background threads. Returns the list of servers.
+    """
+    directory = tempfile.mkdtemp(prefix="mock-panos-")
+    cert, key = create_certificate(directory)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    servers = []
+    for i in range(options.firewalls):
+        server = MockServer(options.base_port + i if options.base_port else 0, options, context)
+        threading.Thread(target=server.serve_forever, name=f"mock-fw-{server.firewall.port}", daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Mock PAN-OS XML API server for benchmarks.")
+    parser.add_argument("--firewalls", type=int, default=1, help="number of simulated firewalls (one port each)")
+    parser.add_argument("--base-port", dest="base_port", type=int, default=0, help="first port (default: pick free ports)")
+    parser.add_argument("--password", default="admin", help="password accepted by keygen (any user name)")
+    parser.add_argument("--pcap-size", dest="pcap_size", type=int, default=1000000, help="bytes per capture file")
+    parser.add_argument("--append-packets", dest="append_packets", type=int, default=0,
+                        help="packets added to each capture file per export (to exercise delta mode)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before an export starts sending")
+    parser.add_argument("--load-latency", dest="load_latency", type=float, default=0.0,
+                        help="extra export latency in seconds times the square of the exports already running on the firewall")
+    parser.add_argument("--latency-jitter", dest="latency_jitter", action="store_true", help="vary latency 0.5x-1.5x")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="per-download bandwidth limit in MB/s (0 = unlimited)")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0, help="fraction of exports that fail")
+    parser.add_argument("--missing-rate", dest="missing_rate", type=float, default=0.0,
+                        help="fraction of exports answered with \"No such file or directory\"")
+    parser.add_argument("--key-lifetime", dest="key_lifetime", type=float, default=0.0,
+                        help="seconds until an API key expires (0 = never), to exercise reconnects")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    servers = start_servers(options)
+    # The benchmark harness reads this line to learn the ports
+    print("READY " + " ".join(str(s.firewall.port) for s in servers), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
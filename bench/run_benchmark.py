@@ -0,0 +1,193 @@
+# This file benchmarks the continuous download core against simulated firewalls (see mock_panos.py).
+#
+#   python bench/run_benchmark.py --firewalls 50 --cycles 5 --interval 2 --pcap-size 2000000 --latency 0.2
+#
+# It starts the mock server in a separate process (so its threads and memory are not measured),
+# runs download_engine.DownloadEngine against every simulated firewall and reports files/s, MB/s,
+# p50/p99 cycle time, the peak thread count and the peak RSS of the downloader process.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+from compression import COMPRESSION_MODES  # noqa: E402
+from download_engine import DownloadEngine, DEFAULT_MAX_CONCURRENCY, DEFAULT_PER_FIREWALL_CONCURRENCY  # noqa: E402
+from scheduler import FleetScheduler  # noqa: E402
+from retry import DEFAULT_RETRIES  # noqa: E402
+
+SAMPLE_INTERVAL = 0.05
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, or None where the resource module is missing (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def start_mock(args):
+    """
+    Starts mock_panos.py and returns (process, list of ports).
+    """
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_panos.py"),
+               "--firewalls", str(args.firewalls), "--pcap-size", str(args.pcap_size),
+               "--append-packets", str(args.append_packets), "--latency", str(args.latency),
+               "--load-latency", str(args.load_latency), "--bandwidth", str(args.bandwidth), "--error-rate", str(args.error_rate),
+               "--missing-rate", str(args.missing_rate), "--key-lifetime", str(args.key_lifetime),
+               "--password", "benchmark"]
+    if args.latency_jitter:
+        command.append("--latency-jitter")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("READY"):
+        process.kill()
+        raise RuntimeError(f"Mock server failed to start: {line.strip()}")
+    return process, [int(port) for port in line.split()[1:]]
+
+
+def run(args):
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    mock, ports = start_mock(args)
+    save_dir = args.save_dir or tempfile.mkdtemp(prefix="pcap-bench-")
+    cycle_times = []
+    totals = {"files": 0, "errors": 0, "bytes_received": 0}
+    peak_threads = [threading.active_count()]
+    done = threading.Event()
+
+    def on_event(event):
+        if event["type"] == "cycle":
+            cycle_times.append(event["seconds"])
+        elif event["type"] == "file":
+            if event["success"]:
+                totals["files"] += 1
+                totals["bytes_received"] += (event.get("stats") or {}).get("bytes_received", 0)
+            else:
+                totals["errors"] += 1
+        elif event["type"] == "connect" and not event["success"]:
+            totals["errors"] += 1
+            print(event["message"], file=sys.stderr)
+
+    def sample_threads():
+        while not done.wait(SAMPLE_INTERVAL):
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    engine = DownloadEngine(args.max_concurrency, args.per_firewall_concurrency,
+                            FleetScheduler(stagger=args.stagger))
+    engine.subscribe(on_event)
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+    started = time.monotonic()
+    try:
+        futures = [engine.submit({
+            "firewall": f"127.0.0.1:{port}",
+            "username": "benchmark",
+            "password": "benchmark",
+            "project_name": "Bench",
+            "save_dir": save_dir,
+            "count": args.cycles,
+            "interval": args.interval,
+            "delta": args.delta,
+            "index": args.index,
+            "merge": args.merge,
+            "rotate": args.rotate,
+            "compression": args.compression,
+            "retries": args.retries,
+            "retry_backoff": 0.1,
+            "max_rate": args.max_rate,
+            "adaptive": not args.no_adaptive,
+        }) for port in ports]
+        for future in futures:
+            future.result()
+        elapsed = time.monotonic() - started
+        engine.shutdown()
+    finally:
+        done.set()
+        mock.terminate()
+        mock.wait()
+        if not args.save_dir:
+            shutil.rmtree(save_dir, ignore_errors=True)
+
+    p50 = percentile(cycle_times, 0.5)
+    p99 = percentile(cycle_times, 0.99)
+    return {
+        "firewalls": args.firewalls,
+        "cycles": args.cycles,
+        "seconds": round(elapsed, 3),
+        "files": totals["files"],
+        "errors": totals["errors"],
+        "files_per_second": round(totals["files"] / elapsed, 2),
+        "mb_per_second": round(totals["bytes_received"] / elapsed / 1e6, 2),
+        "cycle_p50_seconds": round(p50, 3) if p50 is not None else None,
+        "cycle_p99_seconds": round(p99, 3) if p99 is not None else None,
+        "peak_threads": peak_threads[0],
+        "peak_rss_mb": round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the download engine against mock firewalls.")
+    parser.add_argument("--firewalls", type=int, default=10, help="number of simulated firewalls")
+    parser.add_argument("--cycles", type=int, default=3, help="download cycles per firewall")
+    parser.add_argument("--interval", type=int, default=0, help="seconds between cycles (0 = back to back)")
+    parser.add_argument("--stagger", type=float, default=0.0, help="seconds to spread firewall start times over")
+    parser.add_argument("--pcap-size", dest="pcap_size", type=int, default=1000000, help="bytes per capture file")
+    parser.add_argument("--append-packets", dest="append_packets", type=int, default=0, help="packets added per export")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock export latency in seconds")
+    parser.add_argument("--load-latency", dest="load_latency", type=float, default=0.0,
+                        help="mock latency added per concurrent export squared (simulates a small management plane)")
+    parser.add_argument("--latency-jitter", dest="latency_jitter", action="store_true", help="vary latency 0.5x-1.5x")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="mock per-download bandwidth in MB/s (0 = unlimited)")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0, help="fraction of failed exports")
+    parser.add_argument("--missing-rate", dest="missing_rate", type=float, default=0.0, help="fraction of missing files")
+    parser.add_argument("--key-lifetime", dest="key_lifetime", type=float, default=0.0, help="mock API key lifetime in seconds")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="retries of failed connects/downloads")
+    parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--per-firewall-concurrency", dest="per_firewall_concurrency", type=int,
+                        default=DEFAULT_PER_FIREWALL_CONCURRENCY)
+    parser.add_argument("--max-rate", dest="max_rate", type=float, help="maximum exports per second per firewall")
+    parser.add_argument("--no-adaptive", dest="no_adaptive", action="store_true", help="fixed per-firewall concurrency")
+    parser.add_argument("--delta", action="store_true", help="run in delta mode")
+    parser.add_argument("--index", action="store_true", help="write packet indexes")
+    parser.add_argument("--merge", action="store_true", help="merge every cycle into a pcapng")
+    parser.add_argument("--rotate", action="store_true", help="stop, download, clear and restart the capture every cycle")
+    parser.add_argument("--compression", choices=COMPRESSION_MODES, default="none")
+    parser.add_argument("--save-dir", dest="save_dir", help="keep the downloaded files here (default: temporary, deleted)")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
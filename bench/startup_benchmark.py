@@ -0,0 +1,158 @@
+# This file benchmarks application startup: module import times and the time until the GUI window is drawn.
+#
+#   python bench/startup_benchmark.py --repeat 10
+#
+# Every measurement runs in a fresh interpreter, so nothing is served from an already warm
+# sys.modules. It reports the median import time of the entry modules (from python -X importtime),
+# the slowest imports pulled in by the GUI, and the time from process start until the first frame
+# of the window is drawn (needs a display; skipped without one). A PyInstaller --onefile build pays
+# these imports on every launch, on top of unpacking itself.
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+ENTRY_MODULES = ["gui", "cli", "download_engine", "api_handler"]
+
+# Child script for the first frame: builds the window, draws it once and reports
+FIRST_FRAME_SCRIPT = """
+import sys
+from gui import App
+app = App()
+app.update()
+sys.stdout.write("FRAME\\n")
+sys.stdout.flush()
+app.destroy()
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+
+
+def import_times(module):
+    """
+    Imports module in a fresh interpreter. Returns a list of (name, cumulative microseconds, depth).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=SRC_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            times.append((match.group(4), int(match.group(2)), (len(match.group(3)) - 1) // 2))
+    return times
+
+
+def module_time(module):
+    """
+    Returns the seconds module took to import, including everything it imported.
+    """
+    for name, cumulative, depth in import_times(module):
+        if name == module and depth == 0:
+            return cumulative / 1e6
+    return None
+
+
+def interpreter_time():
+    """
+    Returns the seconds a bare interpreter takes to start and exit, the floor under every other number.
+    """
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - started
+
+
+def first_frame_time():
+    """
+    Returns the seconds from starting a process until the GUI window has been drawn, or None without a display.
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", FIRST_FRAME_SCRIPT], cwd=SRC_DIR,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    elapsed = time.perf_counter() - started
+    _, stderr = process.communicate()
+    if line.strip() != "FRAME":
+        if "display" in stderr.lower():
+            return None
+        raise RuntimeError(f"GUI failed to start: {stderr.strip().splitlines()[-1] if stderr.strip() else 'no output'}")
+    return elapsed
+
+
+def slowest_imports(module, top):
+    """
+    Returns the top direct imports of module as (name, milliseconds) by cumulative import time.
+    """
+    # importtime lists imports before the module that triggered them, so the imports of module are the
+    # lines between the previous top-level entry (site and its startup imports) and its own
+    children = []
+    for name, cumulative, depth in import_times(module):
+        if depth == 0:
+            if name == module:
+                break
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative / 1000))
+    return sorted(children, key=lambda t: t[1], reverse=True)[:top]
+
+
+def median_ms(measure, repeat):
+    values = [measure() for _ in range(repeat)]
+    if any(v is None for v in values):
+        return None
+    return round(statistics.median(values) * 1000, 1)
+
+
+def run(args):
+    result = {"python": sys.version.split()[0], "repeat": args.repeat,
+              "interpreter_ms": median_ms(interpreter_time, args.repeat), "import_ms": {}}
+    for module in args.modules:
+        result["import_ms"][module] = median_ms(lambda: module_time(module), args.repeat)
+    result["gui_slowest_imports_ms"] = {name: round(ms, 1) for name, ms in slowest_imports("gui", args.top)}
+    if not args.no_gui:
+        result["first_frame_ms"] = median_ms(first_frame_time, args.repeat)
+    return result
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark application import time and time to first frame.")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement, the median is reported (default 5)")
+    parser.add_argument("--modules", nargs="+", default=ENTRY_MODULES, help=f"modules to time (default {' '.join(ENTRY_MODULES)})")
+    parser.add_argument("--top", type=int, default=8, help="number of slowest GUI imports to list (default 8)")
+    parser.add_argument("--no-gui", action="store_true", help="skip the time-to-first-frame measurement")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print(f"{'python':>24}: {result['python']} (median of {args.repeat} runs)")
+    print(f"{'interpreter startup':>24}: {result['interpreter_ms']} ms")
+    for module, ms in result["import_ms"].items():
+        print(f"{'import ' + module:>24}: {ms} ms")
+    if "first_frame_ms" in result:
+        frame = "n/a (no display)" if result["first_frame_ms"] is None else f"{result['first_frame_ms']} ms"
+        print(f"{'first frame':>24}: {frame}")
+    print("Slowest imports of gui:")
+    for name, ms in result["gui_slowest_imports_ms"].items():
+        print(f"{name:>24}: {ms} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
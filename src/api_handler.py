@@ -1,119 +1,281 @@
 # This file will handle the communication with the Palo Alto Networks firewall API.
-from panos.firewall import Firewall
-import requests
+# requests is imported where it is first used: it takes longer to import than the GUI takes to
+# draw its window, and it is not needed before the first connection.
+import time
+import xml.etree.ElementTree as ET
+
+from download_writer import AtomicWriter, DEFAULT_WRITE_OPTIONS, iter_body, read_error_body
+
+# Keep-alive connections held open per firewall. rx/tx/drp/fw exports run in parallel,
+# so four connections let a full download cycle run without opening new sockets.
+DEFAULT_POOL_SIZE = 4
+
+# (connect, read) timeouts in seconds for every API call. The read timeout is the longest gap
+# between bytes, not the whole transfer, so large exports are not cut off.
+DEFAULT_TIMEOUT = (10, 120)
+
+# Kinds of failed API calls, stored as stats["failure"] by download_filtered_pcap
+FAILURE_AUTH = "auth"            # API key rejected (expired or revoked): reconnect and retry
+FAILURE_MISSING = "missing"      # the capture file does not exist: nothing to retry
+FAILURE_TRANSIENT = "transient"  # busy/unavailable management plane or network error: retry with backoff
+FAILURE_ERROR = "error"          # anything else: do not retry
+
+def classify_failure(status_code, text):
+    """
+    Returns the FAILURE_* kind of a failed API response.
+    """
+    if status_code in (401, 403) or "Invalid Credential" in text or "Invalid credential" in text:
+        return FAILURE_AUTH
+    if "No such file" in text:
+        return FAILURE_MISSING
+    if status_code == 429 or status_code >= 500:
+        return FAILURE_TRANSIENT
+    return FAILURE_ERROR
+
+def is_transient_error(error):
+    """
+    Returns True for exceptions worth retrying: timeouts, refused/reset connections and broken transfers.
+    """
+    import requests
+    return isinstance(error, (requests.RequestException, ConnectionError, TimeoutError))
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Returns a requests.Session backed by a keep-alive connection pool of pool_size connections.
+    The pool blocks instead of opening throwaway connections when all connections are busy,
+    so every request after the first few reuses an existing TCP+TLS connection.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def session_stats(session):
+    """
+    Returns a dict with the number of HTTP requests sent, connections opened and connections reused by a session.
+    """
+    requests_sent = 0
+    connections_opened = 0
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+    return {
+        "requests": requests_sent,
+        "connections_opened": connections_opened,
+        "connections_reused": max(requests_sent - connections_opened, 0),
+    }
+
+def capture_filter_string(filters):
+    """
+    Returns the packet capture match expression for a filters dict (see PaloAltoAPI.start_packet_capture).
+    """
+    filter_parts = []
+    if filters.get("src_ip"):
+        filter_parts.append(f"source {filters['src_ip']}")
+    if filters.get("dest_ip"):
+        filter_parts.append(f"destination {filters['dest_ip']}")
+    if filters.get("src_port"):
+        filter_parts.append(f"sport {filters['src_port']}")
+    if filters.get("dest_port"):
+        filter_parts.append(f"dport {filters['dest_port']}")
+    if filters.get("protocol"):
+        filter_parts.append(f"protocol {filters['protocol']}")
+    return ' '.join(filter_parts)
+
+def _api_error(response):
+    """
+    Returns the error text of a PAN-OS XML API response.
+    """
+    try:
+        root = ET.fromstring(response.text)
+        lines = [element.text.strip() for element in root.iter() if element.tag in ("msg", "line") and element.text and element.text.strip()]
+        if lines:
+            return "; ".join(lines)
+    except ET.ParseError:
+        pass
+    return f"HTTP {response.status_code}"
 
 class PaloAltoAPI:
-    def __init__(self, hostname, username, password):
+    def __init__(self, hostname, username, password, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, key_cache=None, write_options=None):
         self.hostname = hostname
         self.username = username
         self.password = password
-        self.fw = None
+        self.timeout = timeout
+        self.key_cache = key_cache
+        # buffer_size, fsync and preallocate, see download_writer.DEFAULT_WRITE_OPTIONS
+        self.write_options = {**DEFAULT_WRITE_OPTIONS, **(write_options or {})}
+        self._api_key = None
+        self.session = create_session(pool_size)
 
-    def connect(self):
+    @property
+    def api_key(self):
+        return self._api_key
+
+    def connect(self, stats=None):
         """
         Connects to the firewall and returns True on success, False on failure.
+
+        A key from the key cache is used without contacting the firewall; it is only replaced once
+        the firewall rejects it (see invalidate_key). Otherwise a key is generated with a single
+        type=keygen request.
+        If a stats dict is given it is filled with the connect time in seconds and, on failure,
+        the FAILURE_* kind (FAILURE_AUTH for rejected credentials, FAILURE_TRANSIENT for network errors).
         """
+        started = time.monotonic()
         try:
-            self.fw = Firewall(self.hostname, self.username, self.password)
-            # The Firewall object handles API key generation automatically.
-            # A simple command like fetching the hostname will test the connection.
-            self.fw.refresh_system_info()
-            print("API KEY:", self.fw.api_key)
-            return True, f"Successfully connected to {self.hostname}."
+            cached = self.key_cache.get(self.hostname, self.username, self.password) if self.key_cache else None
+            if cached:
+                self._api_key = cached
+                message = f"Connected to {self.hostname} (cached API key)."
+            else:
+                success, message = self._keygen(stats)
+                if not success:
+                    return False, message
+            return True, message
         except Exception as e:
-            self.fw = None
+            if stats is not None:
+                stats["failure"] = _connect_failure(e)
             return False, f"Failed to connect to {self.hostname}: {e}"
+        finally:
+            if stats is not None:
+                stats["seconds"] = time.monotonic() - started
 
-    def start_packet_capture(self, stage_name, filters):
+    def _keygen(self, stats=None):
+        # POST keeps the password out of URLs and proxy/server access logs
+        url = f"https://{self.hostname}/api/"
+        data = {"type": "keygen", "user": self.username, "password": self.password}
+        response = self.session.post(url, data=data, verify=False, timeout=self.timeout)
+        key = None
+        if response.status_code == 200:
+            try:
+                root = ET.fromstring(response.text)
+                element = root.find("./result/key")
+                if root.get("status") == "success" and element is not None and element.text:
+                    key = element.text.strip()
+            except ET.ParseError:
+                pass
+        if key is None:
+            error = _api_error(response)
+            if stats is not None:
+                stats["failure"] = classify_failure(response.status_code, error)
+                if response.status_code == 200 and stats["failure"] == FAILURE_ERROR:
+                    # keygen answers bad credentials with status="error" and HTTP 200 on some releases
+                    stats["failure"] = FAILURE_AUTH
+            return False, f"Failed to connect to {self.hostname}: {error}"
+        self._api_key = key
+        if self.key_cache:
+            warning = self.key_cache.put(self.hostname, self.username, self.password, key)
+            if warning:
+                return True, f"Successfully connected to {self.hostname}. {warning}"
+        return True, f"Successfully connected to {self.hostname}."
+
+    def invalidate_key(self, stale_key):
         """
-        Starts a filter-based packet capture using the canonical operational commands.
-        Filters is a dict with keys: src_ip, dest_ip, src_port, dest_port, protocol, max_packets
+        Drops an API key the firewall rejected, so the next connect() generates a new one.
+        Does nothing if the key was already replaced.
         """
-        if not self.fw:
+        if self._api_key == stale_key:
+            self._api_key = None
+        if self.key_cache:
+            self.key_cache.discard(self.hostname, self.username, stale_key)
+
+    def _op(self, cmd, stats=None):
+        """
+        Sends an operational command and checks the status of the XML response.
+        Returns (success, error message or None). If a stats dict is given it is filled with the
+        wall-clock time the request was sent ("sent_at"), the round trip in seconds and, on
+        failure, the FAILURE_* kind. Network errors and timeouts are raised.
+        """
+        url = f"https://{self.hostname}/api/"
+        params = {"type": "op", "cmd": cmd, "key": self._api_key}
+        sent_at = time.time()
+        started = time.monotonic()
+        response = self.session.get(url, params=params, verify=False, timeout=self.timeout)
+        if stats is not None:
+            stats["sent_at"] = sent_at
+            stats["seconds"] = time.monotonic() - started
+        try:
+            ok = response.status_code == 200 and ET.fromstring(response.text).get("status") == "success"
+        except ET.ParseError:
+            ok = False
+        if ok:
+            return True, None
+        error = _api_error(response)
+        if stats is not None:
+            stats["failure"] = classify_failure(response.status_code, error)
+        return False, error
+
+    def _op_action(self, cmd, done_message, error_prefix, stats=None):
+        if not self._api_key:
+            if stats is not None:
+                stats["failure"] = FAILURE_AUTH
             return False, "Not connected to firewall."
         try:
-            api_key = self.fw.api_key
-            url = f"https://{self.hostname}/api/"
-            # Build the filter string
-            filter_parts = []
-            if filters.get("src_ip"):
-                filter_parts.append(f"source {filters['src_ip']}")
-            if filters.get("dest_ip"):
-                filter_parts.append(f"destination {filters['dest_ip']}")
-            if filters.get("src_port"):
-                filter_parts.append(f"sport {filters['src_port']}")
-            if filters.get("dest_port"):
-                filter_parts.append(f"dport {filters['dest_port']}")
-            if filters.get("protocol"):
-                filter_parts.append(f"protocol {filters['protocol']}")
-            filter_str = ' '.join(filter_parts)
-
-            # Set the filter using <match>
-            if filter_str:
-                params = {
-                    "type": "op",
-                    "cmd": f"<request><packet-capture><filter><match>{filter_str}</match></filter></packet-capture></request>",
-                    "key": api_key
-                }
-                requests.get(url, params=params, verify=False)
-            # Start the capture at the firewall stage
-            params = {
-                "type": "op",
-                "cmd": "<request><packet-capture><start><stage><firewall/></stage></start></packet-capture></request>",
-                "key": api_key
-            }
-            requests.get(url, params=params, verify=False)
-            return True, f"Packet capture started with filter: {filter_str}"
+            success, error = self._op(cmd, stats)
         except Exception as e:
-            return False, f"Error starting capture: {e}"
+            if stats is not None:
+                stats["failure"] = FAILURE_TRANSIENT if is_transient_error(e) else FAILURE_ERROR
+            return False, f"{error_prefix}: {e}"
+        if not success:
+            return False, f"{error_prefix}: {error}"
+        return True, done_message
+
+    def set_capture_filter(self, filters, stats=None):
+        """
+        Sets the packet capture filter without starting a capture. Filters is a dict as for start_packet_capture.
+        """
+        filter_str = capture_filter_string(filters)
+        if not filter_str:
+            return True, "No capture filter given."
+        cmd = f"<request><packet-capture><filter><match>{filter_str}</match></filter></packet-capture></request>"
+        return self._op_action(cmd, f"Capture filter set: {filter_str}", "Error setting capture filter", stats)
 
-    def stop_packet_capture(self, stage_name):
+    def start_packet_capture(self, stage_name, filters, stats=None):
+        """
+        Starts a filter-based packet capture using the canonical operational commands.
+        Filters is a dict with keys: src_ip, dest_ip, src_port, dest_port, protocol, max_packets
+        If a stats dict is given it describes the start command (see _op).
+        """
+        success, message = self.set_capture_filter(filters, stats)
+        if not success:
+            return False, message
+        filter_str = capture_filter_string(filters)
+        cmd = "<request><packet-capture><start><stage><firewall/></stage></start></packet-capture></request>"
+        return self._op_action(cmd, f"Packet capture started with filter: {filter_str}", "Error starting capture", stats)
+
+    def stop_packet_capture(self, stage_name, stats=None):
         """
         Stops the filter-based packet capture using the canonical operational command.
         """
-        if not self.fw:
-            return False, "Not connected to firewall."
-        try:
-            api_key = self.fw.api_key
-            url = f"https://{self.hostname}/api/"
-            params = {
-                "type": "op",
-                "cmd": "<request><packet-capture><stop/></packet-capture></request>",
-                "key": api_key
-            }
-            requests.get(url, params=params, verify=False)
-            return True, "Packet capture stopped."
-        except Exception as e:
-            return False, f"Error stopping capture: {e}"
+        cmd = "<request><packet-capture><stop/></packet-capture></request>"
+        return self._op_action(cmd, "Packet capture stopped.", "Error stopping capture", stats)
 
-    def clear_packet_capture(self, stage_name):
+    def clear_packet_capture(self, stage_name, stats=None):
         """
         Clears the filter-based packet capture files using the operational command API.
         """
-        if not self.fw:
-            return False, "Not connected to firewall."
-        try:
-            api_key = self.fw.api_key
-            url = f"https://{self.hostname}/api/"
-            params = {
-                "type": "op",
-                "cmd": "<clear><filter-pcap>all</filter-pcap></clear>",
-                "key": api_key
-            }
-            requests.get(url, params=params, verify=False)
-            return True, "Packet capture cleared."
-        except Exception as e:
-            return False, f"Error clearing capture: {e}"
+        cmd = "<clear><filter-pcap>all</filter-pcap></clear>"
+        return self._op_action(cmd, "Packet capture cleared.", "Error clearing capture", stats)
 
     def download_packet_capture(self, stage_name, save_path):
         """
         Downloads all available filtered packet capture files (rx, tx, drp, fw) using the correct API for your PAN-OS version.
         Uses POST, category=filters-pcap, and from=<filename>.
         """
-        if not self.fw:
+        if not self._api_key:
             return False, "Not connected to firewall."
         try:
-            api_key = self.fw.api_key
+            api_key = self._api_key
             url = f"https://{self.hostname}/api/"
             files_downloaded = []
             errors = []
@@ -124,18 +286,19 @@ class PaloAltoAPI:
                     'from': fname,
                     'key': api_key
                 }
-                response = requests.post(url, params=params, verify=False, stream=True)
+                response = self.session.post(url, params=params, verify=False, stream=True, timeout=self.timeout)
                 if response.status_code == 200 and response.headers.get('content-type', '').startswith('application/octet-stream'):
                     out_path = f"{stage_name}_{fname}"
-                    with open(out_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
+                    options = self.write_options
+                    with AtomicWriter(out_path, fsync=options["fsync"]) as f:
+                        for chunk in iter_body(response, options["buffer_size"]):
+                            f.write(chunk)
                     files_downloaded.append(out_path)
-                elif 'No such file or directory' in response.text or 'No such file' in response.text:
-                    continue  # File doesn't exist, skip
                 else:
-                    errors.append(f"{fname}: {response.text}")
+                    text = read_error_body(response)
+                    if 'No such file' in text:
+                        continue  # File doesn't exist, skip
+                    errors.append(f"{fname}: {text}")
             if files_downloaded:
                 return True, f"Downloaded: {', '.join(files_downloaded)}"
             else:
@@ -143,7 +306,67 @@ class PaloAltoAPI:
         except Exception as e:
             return False, f"Error downloading capture: {e}"
 
-def download_filtered_pcap(hostname, api_key, filename, save_path):
+    def download_filtered_pcap(self, filename, save_path, transform=None, compression=None, compression_level=None, stats=None):
+        """
+        Downloads a single filter-pcap file (e.g. rx.pcap) over this firewall's pooled session.
+        """
+        api_key = self._api_key
+        if not api_key:
+            if stats is not None:
+                stats["failure"] = FAILURE_AUTH
+            return False, "Not connected to firewall."
+        return download_filtered_pcap(self.hostname, api_key, filename, save_path, session=self.session,
+                                      transform=transform, compression=compression, compression_level=compression_level,
+                                      stats=stats, timeout=self.timeout, write_options=self.write_options)
+
+    def connection_stats(self):
+        """
+        Returns request and connection reuse counters for this firewall's session.
+        """
+        return session_stats(self.session)
+
+    def close(self):
+        """
+        Closes all pooled connections to the firewall.
+        """
+        self.session.close()
+
+def _connect_failure(error):
+    """
+    Returns the FAILURE_* kind of an exception raised while connecting (failed keygen responses are classified by _keygen).
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        return classify_failure(response.status_code, str(error))
+    return FAILURE_TRANSIENT if is_transient_error(error) else FAILURE_ERROR
+
+def download_filtered_pcap(hostname, api_key, filename, save_path, session=None, transform=None, compression=None, compression_level=None, stats=None, timeout=DEFAULT_TIMEOUT, write_options=None):
+    """
+    Downloads a filter-pcap file. Pass a session from create_session() to reuse keep-alive connections.
+    An optional transform (an object with feed(chunk) and finish() methods returning the bytes to
+    store, and optionally publish(), called once save_path is in place, and close(), e.g.
+    pcap_stream.DeltaExtractor or pcap_index.IndexBuilder) rewrites the stream while it is
+    written. save_path is only created if the transform produces any output; with save_path None
+    nothing is stored and the transform is the only consumer of the stream (e.g.
+    live_stream.LiveExtractor). compression ("gzip" or "zstd", at compression_level) compresses
+    the file in the shared compression pool while it is written; save_path should carry the
+    matching suffix (see compression.compressed_path).
+    The body is read in write_options["buffer_size"] blocks into one reused buffer and written to
+    save_path + ".part", which is renamed to save_path only once the download is complete
+    (download_writer.AtomicWriter, with the write_options fsync and preallocate policies).
+    If a stats dict is given it is filled with bytes_received, bytes_written (before compression),
+    bytes_stored (on disk) and the per-phase timings ttfb_seconds (request sent until response
+    headers, including connection setup and the firewall's export time), transfer_seconds (waiting
+    for body data), write_seconds (transform, compression and disk writes) and seconds (total).
+    On a failed response it also gets the FAILURE_* kind as "failure"; at most
+    download_writer.ERROR_BODY_LIMIT bytes of an error body are read. Network errors and
+    timeouts (see is_transient_error) are raised.
+    """
+    options = {**DEFAULT_WRITE_OPTIONS, **(write_options or {})}
+    http = session
+    if http is None:
+        import requests
+        http = requests
     url = f"https://{hostname}/api/"
     params = {
         "type": "export",
@@ -151,12 +374,68 @@ def download_filtered_pcap(hostname, api_key, filename, save_path):
         "from": filename,
         "key": api_key
     }
-    response = requests.post(url, params=params, verify=False, stream=True)
+    started = time.monotonic()
+    response = http.post(url, params=params, verify=False, stream=True, timeout=timeout)
+    first_byte = time.monotonic()
+    if stats is not None:
+        stats["ttfb_seconds"] = first_byte - started
     if response.status_code == 200 and response.headers.get('content-type', '').startswith('application/octet-stream'):
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        received = 0
+        written = 0
+        write_time = 0.0
+
+        def open_file():
+            # Only an unmodified, uncompressed download has a known final size to preallocate
+            size = int(response.headers.get('content-length') or 0) if options["preallocate"] and transform is None else 0
+            return AtomicWriter(save_path, compression, compression_level, options["fsync"], preallocate=size or None)
+
+        # Without a transform the file is always created, even for an empty capture
+        f = open_file() if transform is None else None
+        try:
+            for chunk in iter_body(response, options["buffer_size"]):
+                write_started = time.monotonic()
+                received += len(chunk)
+                data = transform.feed(chunk) if transform is not None else chunk
+                if data and save_path is not None:
+                    if f is None:
+                        f = open_file()
+                    f.write(data)
+                    written += len(data)
+                write_time += time.monotonic() - write_started
+            write_started = time.monotonic()
+            data = transform.finish() if transform is not None else b""
+            if data and save_path is not None:
+                if f is None:
+                    f = open_file()
+                f.write(data)
+                written += len(data)
+            if f is not None:
+                f.commit()
+                if hasattr(transform, 'publish'):
+                    transform.publish()
+        except BaseException:
+            if f is not None:
+                f.abort()
+            raise
+        finally:
+            response.close()
+            if hasattr(transform, 'close'):
+                transform.close()
+        finished = time.monotonic()
+        write_time += finished - write_started
+        if stats is not None:
+            stats["bytes_received"] = received
+            stats["bytes_written"] = written
+            stats["bytes_stored"] = f.bytes_out if f is not None else 0
+            stats["write_seconds"] = write_time
+            stats["transfer_seconds"] = max(finished - first_byte - write_time, 0.0)
+            stats["seconds"] = finished - started
+        if f is None:
+            return True, f"No new data in {filename}, nothing written"
         return True, f"Downloaded {filename} to {save_path}"
     else:
-        return False, f"Failed to download: {response.text}" 
\ No newline at end of file
+        text = read_error_body(response)
+        if stats is not None:
+            stats["seconds"] = time.monotonic() - started
+            stats["failure"] = classify_failure(response.status_code, text)
+        return False, f"Failed to download: {text}"
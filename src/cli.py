@@ -0,0 +1,399 @@
+# This file is the headless (no GUI) entry point, for collector boxes, systemd services and containers.
+# It must not import the GUI stack (customtkinter/tkinter).
+import argparse
+import concurrent.futures
+import getpass
+import json
+import os
+import signal
+import sys
+
+from api_handler import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+from compression import COMPRESSION_MODES, check_compression
+from scheduler import FleetScheduler, OVERRUN_POLICIES
+from download_engine import DownloadEngine, DEFAULT_MAX_CONCURRENCY, DEFAULT_PER_FIREWALL_CONCURRENCY, ROTATION_FILE_TYPES
+from log_sink import LogSink, LOG_FORMATS, DEFAULT_FLUSH_INTERVAL
+from metrics import MetricsRegistry, DEFAULT_EXPORT_INTERVAL
+from key_cache import KeyCache, check_key_cache
+from retention import RetentionManager, parse_size
+from traffic_summary import TrafficSummary, DEFAULT_WORKERS, check_traffic_summary, format_summary
+from live_stream import LIVE_FIFO, LIVE_MODES, DEFAULT_LIVE_INTERVAL, DEFAULT_CONSUMER_BUFFER, check_live
+from download_writer import READ_BUFFER_SIZE, FSYNC_NONE, FSYNC_POLICIES
+from retry import DEFAULT_RETRIES, DEFAULT_BACKOFF_BASE, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_COOLDOWN
+
+# Exit status codes
+EXIT_OK = 0
+EXIT_DOWNLOAD_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_CONNECT_FAILED = 3
+EXIT_INTERRUPTED = 130
+
+PASSWORD_ENV = "PCAP_PASSWORD"
+
+DEFAULTS = {
+    "firewalls": None,
+    "username": None,
+    "password": None,
+    "interval": 10,
+    "count": None,
+    "project_name": "Project",
+    "save_dir": None,
+    "pool_size": DEFAULT_POOL_SIZE,
+    "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+    "per_firewall_concurrency": DEFAULT_PER_FIREWALL_CONCURRENCY,
+    "max_rate": None,
+    "adaptive": True,
+    "delta": False,
+    "merge": False,
+    "merge_rolling": False,
+    "index": False,
+    "rotate": False,
+    "compression": "none",
+    "compression_level": None,
+    "stagger": None,
+    "jitter": 0,
+    "overrun_policy": OVERRUN_POLICIES[0],
+    "log_format": LOG_FORMATS[0],
+    "log_flush_interval": DEFAULT_FLUSH_INTERVAL,
+    "metrics_textfile": None,
+    "metrics_json": None,
+    "metrics_interval": DEFAULT_EXPORT_INTERVAL,
+    "timeout": DEFAULT_TIMEOUT[1],
+    "retries": DEFAULT_RETRIES,
+    "retry_backoff": DEFAULT_BACKOFF_BASE,
+    "breaker_threshold": DEFAULT_BREAKER_THRESHOLD,
+    "breaker_cooldown": DEFAULT_BREAKER_COOLDOWN,
+    "key_cache": None,
+    "buffer_size": READ_BUFFER_SIZE,
+    "fsync": FSYNC_NONE,
+    "preallocate": False,
+    "max_bytes": None,
+    "max_age": None,
+    "min_free": None,
+    "retention_compress": None,
+    "traffic_summary": False,
+    "summary_workers": DEFAULT_WORKERS,
+    "live_dir": None,
+    "live_mode": LIVE_FIFO,
+    "live_interval": DEFAULT_LIVE_INTERVAL,
+    "live_stages": None,
+    "live_buffer": DEFAULT_CONSUMER_BUFFER,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pcap-downloader",
+        description="Continuously download filter-pcap files (rx, tx, drp) from one or more Palo Alto firewalls.",
+        epilog=f"The password is read from --password, the config file, ${PASSWORD_ENV} or an interactive prompt, in that order.",
+    )
+    parser.add_argument("-c", "--config", help="JSON config file; keys match the long option names with underscores")
+    parser.add_argument("-f", "--firewalls", help="comma-separated firewall IPs/hostnames")
+    parser.add_argument("-u", "--username", help="API username")
+    parser.add_argument("-p", "--password", help="API password (prefer the config file or environment)")
+    parser.add_argument("-i", "--interval", type=int, help="seconds between downloads (default 10)")
+    parser.add_argument("-n", "--count", type=int, help="downloads per firewall; 0 runs until stopped")
+    parser.add_argument("--project-name", dest="project_name", help="prefix for saved file names (default Project)")
+    parser.add_argument("-d", "--save-dir", dest="save_dir", help="directory for pcaps and logs (default current directory)")
+    parser.add_argument("--pool-size", dest="pool_size", type=int, help="keep-alive connections per firewall")
+    parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help="concurrent API calls across all firewalls")
+    parser.add_argument("--per-firewall-concurrency", dest="per_firewall_concurrency", type=int,
+                        help=f"maximum concurrent exports per firewall (default {DEFAULT_PER_FIREWALL_CONCURRENCY})")
+    parser.add_argument("--max-rate", dest="max_rate", type=float, help="maximum exports per second per firewall (default unlimited)")
+    parser.add_argument("--no-adaptive", dest="adaptive", action="store_false", default=None,
+                        help="always use the maximum concurrency and rate instead of backing off when a firewall slows down")
+    parser.add_argument("--delta", action="store_true", default=None, help="only save packets that are new since the previous download")
+    parser.add_argument("--merge", action="store_true", default=None, help="also merge rx/tx/drp into one time-ordered pcapng per download")
+    parser.add_argument("--merge-rolling", dest="merge_rolling", action="store_true", default=None, help="also append every download to one pcapng per firewall")
+    parser.add_argument("--index", action="store_true", default=None, help="write a .idx packet index next to every pcap (see: main.py query --help)")
+    parser.add_argument("--rotate", action="store_true", default=None,
+                        help="every interval stop the capture, download rx/tx/drp/fw, clear them and restart the capture")
+    parser.add_argument("--compression", choices=COMPRESSION_MODES, help="compress pcaps while downloading (default none)")
+    parser.add_argument("--compression-level", dest="compression_level", type=int, help="gzip 1-9 (default 6) or zstd 1-22 (default 3)")
+    parser.add_argument("--stagger", type=float, help="seconds to spread firewall start times over (default: the interval)")
+    parser.add_argument("--jitter", type=float, help="random delay of up to this many seconds added to each download (default 0)")
+    parser.add_argument("--overrun-policy", dest="overrun_policy", choices=OVERRUN_POLICIES,
+                        help="when a download runs past the next start time: skip missed downloads or catch up (default skip)")
+    parser.add_argument("--log-format", dest="log_format", choices=LOG_FORMATS,
+                        help="per-firewall log format: text (.log) or JSON lines (.jsonl) (default text)")
+    parser.add_argument("--log-flush-interval", dest="log_flush_interval", type=float,
+                        help=f"seconds between log file flushes (default {DEFAULT_FLUSH_INTERVAL})")
+    parser.add_argument("--metrics-textfile", dest="metrics_textfile",
+                        help="write Prometheus metrics to this .prom file (for node_exporter's textfile collector)")
+    parser.add_argument("--metrics-json", dest="metrics_json", help="write the same metrics as JSON to this file")
+    parser.add_argument("--metrics-interval", dest="metrics_interval", type=float,
+                        help=f"seconds between metrics file updates (default {DEFAULT_EXPORT_INTERVAL})")
+    parser.add_argument("--timeout", type=float, help=f"seconds without data before an API call fails (default {DEFAULT_TIMEOUT[1]})")
+    parser.add_argument("--retries", type=int, help=f"retries of a failed connect or download (default {DEFAULT_RETRIES})")
+    parser.add_argument("--retry-backoff", dest="retry_backoff", type=float,
+                        help=f"base of the exponential retry backoff in seconds (default {DEFAULT_BACKOFF_BASE})")
+    parser.add_argument("--breaker-threshold", dest="breaker_threshold", type=int,
+                        help=f"consecutive failures before a firewall is skipped (default {DEFAULT_BREAKER_THRESHOLD})")
+    parser.add_argument("--breaker-cooldown", dest="breaker_cooldown", type=float,
+                        help=f"seconds before a skipped firewall is probed again (default {DEFAULT_BREAKER_COOLDOWN})")
+    parser.add_argument("--key-cache", dest="key_cache",
+                        help="reuse API keys across runs, stored encrypted with the password in this file (needs cryptography)")
+    parser.add_argument("--max-bytes", dest="max_bytes",
+                        help="keep the project's captures under this size (e.g. 50G), deleting the oldest downloads")
+    parser.add_argument("--max-age", dest="max_age", type=float, help="delete downloads older than this many hours")
+    parser.add_argument("--min-free", dest="min_free",
+                        help="keep this much disk space free (e.g. 2G); downloads pause if pruning cannot free it")
+    parser.add_argument("--retention-compress", dest="retention_compress", choices=["gzip", "zstd"],
+                        help="compress the oldest downloads before deleting any to stay within --max-bytes/--min-free")
+    parser.add_argument("--traffic-summary", dest="traffic_summary", action="store_true", default=None,
+                        help="analyze every download (packets, rates, top talkers and ports) into <project>_traffic_summary.json (needs numpy)")
+    parser.add_argument("--summary-workers", dest="summary_workers", type=int,
+                        help=f"processes analyzing downloads for --traffic-summary (default {DEFAULT_WORKERS})")
+    parser.add_argument("--live", dest="live_dir", metavar="DIR",
+                        help="stream new packets of every firewall to <project>_<firewall>_live.pcap in DIR as they are captured "
+                             "(e.g. wireshark -k -i <pipe>; POSIX only)")
+    parser.add_argument("--live-mode", dest="live_mode", choices=LIVE_MODES,
+                        help="named pipe for one reader, or unix socket for any number of readers (default fifo)")
+    parser.add_argument("--live-interval", dest="live_interval", type=float,
+                        help=f"seconds between polls of the live captures (default {DEFAULT_LIVE_INTERVAL})")
+    parser.add_argument("--live-stages", dest="live_stages",
+                        help="comma separated capture stages to stream (default all downloaded stages)")
+    parser.add_argument("--live-buffer", dest="live_buffer",
+                        help="data queued per live reader (e.g. 16M) before packets are dropped for it")
+    parser.add_argument("--buffer-size", dest="buffer_size", type=int,
+                        help=f"download read buffer in bytes (default {READ_BUFFER_SIZE})")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES,
+                        help="flush each finished file (file) and its directory entry (full) to disk before it is renamed into place (default none)")
+    parser.add_argument("--preallocate", action="store_true", default=None,
+                        help="reserve disk space for uncompressed downloads up front to reduce fragmentation")
+    return parser
+
+
+def load_config(args):
+    """
+    Merges defaults, the optional config file and command line arguments (highest priority).
+    Returns (config, error message or None).
+    """
+    config = dict(DEFAULTS)
+    if args.config:
+        try:
+            with open(args.config, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            return None, f"Could not read config file {args.config}: {e}"
+        unknown = set(data) - set(DEFAULTS)
+        if unknown:
+            return None, f"Unknown config keys: {', '.join(sorted(unknown))}"
+        config.update({k: v for k, v in data.items() if v is not None})
+    config.update({k: v for k, v in vars(args).items() if k in DEFAULTS and v is not None})
+
+    firewalls = config["firewalls"]
+    if isinstance(firewalls, str):
+        firewalls = [ip.strip() for ip in firewalls.split(',') if ip.strip()]
+    if not firewalls:
+        return None, "No firewalls given."
+    config["firewalls"] = firewalls
+    if not config["username"]:
+        return None, "No username given."
+    if config["count"] is None:
+        return None, "No download count given (use 0 to run until stopped)."
+    for key in ("interval", "count"):
+        if not isinstance(config[key], int) or config[key] < 0:
+            return None, f"{key} must be a non-negative integer."
+    if not isinstance(config["retries"], int) or config["retries"] < 0:
+        return None, "retries must be a non-negative integer."
+    for key in ("pool_size", "max_concurrency", "per_firewall_concurrency", "breaker_threshold", "buffer_size"):
+        if not isinstance(config[key], int) or config[key] < 1:
+            return None, f"{key} must be a positive integer."
+    for key in ("delta", "merge", "merge_rolling", "index", "rotate", "preallocate", "adaptive"):
+        if not isinstance(config[key], bool):
+            return None, f"{key} must be true or false."
+    for key in ("stagger", "jitter", "log_flush_interval", "metrics_interval", "retry_backoff", "breaker_cooldown"):
+        if config[key] is not None and (not isinstance(config[key], (int, float)) or config[key] < 0):
+            return None, f"{key} must be a non-negative number of seconds."
+    if not isinstance(config["timeout"], (int, float)) or config["timeout"] <= 0:
+        return None, "timeout must be a positive number of seconds."
+    if config["log_format"] not in LOG_FORMATS:
+        return None, f"log_format must be one of: {', '.join(LOG_FORMATS)}."
+    for key in ("max_bytes", "min_free"):
+        if config[key] is not None:
+            try:
+                config[key] = parse_size(config[key])
+            except ValueError as e:
+                return None, f"{key}: {e}"
+    if config["max_rate"] is not None and (not isinstance(config["max_rate"], (int, float)) or config["max_rate"] <= 0):
+        return None, "max_rate must be a positive number of exports per second."
+    if config["max_age"] is not None and (not isinstance(config["max_age"], (int, float)) or config["max_age"] <= 0):
+        return None, "max_age must be a positive number of hours."
+    if config["retention_compress"]:
+        error = check_compression(config["retention_compress"])
+        if error:
+            return None, error
+    if config["traffic_summary"]:
+        error = check_traffic_summary()
+        if error:
+            return None, error
+        if not isinstance(config["summary_workers"], int) or config["summary_workers"] < 1:
+            return None, "summary_workers must be a positive integer."
+    if config["live_dir"]:
+        error = check_live(config["live_mode"])
+        if error:
+            return None, error
+        if not os.path.isdir(config["live_dir"]):
+            return None, f"Live directory does not exist: {config['live_dir']}"
+        if not isinstance(config["live_interval"], (int, float)) or config["live_interval"] <= 0:
+            return None, "live_interval must be a positive number of seconds."
+        stages = config["live_stages"]
+        if isinstance(stages, str):
+            stages = [stage.strip() for stage in stages.split(',') if stage.strip()]
+        if stages is not None and (not stages or set(stages) - set(ROTATION_FILE_TYPES)):
+            return None, f"live_stages must be a list of: {', '.join(ROTATION_FILE_TYPES)}."
+        config["live_stages"] = stages
+        try:
+            config["live_buffer"] = parse_size(config["live_buffer"])
+        except ValueError as e:
+            return None, f"live_buffer: {e}"
+        if not config["live_buffer"]:
+            return None, "live_buffer must be greater than 0."
+    if config["rotate"] and config["delta"]:
+        return None, "rotate and delta cannot be combined: rotation already downloads only new packets."
+    if config["fsync"] not in FSYNC_POLICIES:
+        return None, f"fsync must be one of: {', '.join(FSYNC_POLICIES)}."
+    if config["overrun_policy"] not in OVERRUN_POLICIES:
+        return None, f"overrun_policy must be one of: {', '.join(OVERRUN_POLICIES)}."
+    error = check_compression(config["compression"], config["compression_level"])
+    if error:
+        return None, error
+    if config["key_cache"]:
+        error = check_key_cache()
+        if error:
+            return None, error
+    config["save_dir"] = config["save_dir"] or os.getcwd()
+    if not os.path.isdir(config["save_dir"]):
+        return None, f"Save directory does not exist: {config['save_dir']}"
+    if not config["password"]:
+        config["password"] = os.environ.get(PASSWORD_ENV)
+    if not config["password"]:
+        if not sys.stdin.isatty():
+            return None, f"No password given and no terminal to prompt on (set ${PASSWORD_ENV})."
+        config["password"] = getpass.getpass(f"Password for {config['username']}: ")
+    return config, None
+
+
+def run(config):
+    """
+    Runs the continuous download for every configured firewall and returns an exit status code.
+    """
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    scheduler = FleetScheduler(config["stagger"], config["jitter"], config["overrun_policy"])
+    log_sink = LogSink(config["log_format"], flush_interval=config["log_flush_interval"])
+    metrics = MetricsRegistry(config["metrics_textfile"], config["metrics_json"], config["metrics_interval"])
+    key_cache = KeyCache(config["key_cache"])
+    retention = None
+    if config["max_bytes"] or config["max_age"] or config["min_free"]:
+        retention = RetentionManager(config["save_dir"], config["project_name"], config["max_bytes"],
+                                     config["max_age"] * 3600 if config["max_age"] else None,
+                                     config["min_free"], config["retention_compress"])
+    traffic_summary = None
+    if config["traffic_summary"]:
+        traffic_summary = TrafficSummary(config["save_dir"], config["project_name"], config["summary_workers"])
+    engine = DownloadEngine(config["max_concurrency"], config["per_firewall_concurrency"], scheduler, log_sink, metrics, key_cache,
+                            retention, traffic_summary)
+    interrupted = []
+
+    def on_event(event):
+        if event["type"] in ("log", "connect", "file", "merged", "rotation"):
+            print(event["message"], flush=True)
+
+    def on_signal(signum, frame):
+        if signum == signal.SIGINT:
+            interrupted.append(signum)
+        print("Stopping continuous download...", flush=True)
+        engine.stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    totals = {}
+
+    def on_transfer(event):
+        if event["type"] == "file" and event["success"]:
+            for key, value in (event.get("stats") or {}).items():
+                totals[key] = totals.get(key, 0) + value
+
+    engine.subscribe(on_event)
+    engine.subscribe(on_transfer)
+    futures = []
+    for fw_ip in config["firewalls"]:
+        futures.append(engine.submit({
+            "firewall": fw_ip,
+            "username": config["username"],
+            "password": config["password"],
+            "project_name": config["project_name"],
+            "save_dir": config["save_dir"],
+            # 0 from the command line means run until stopped
+            "count": config["count"] or None,
+            "interval": config["interval"],
+            "pool_size": config["pool_size"],
+            "delta": config["delta"],
+            "merge": config["merge"],
+            "merge_rolling": config["merge_rolling"],
+            "index": config["index"],
+            "rotate": config["rotate"],
+            "max_rate": config["max_rate"],
+            "adaptive": config["adaptive"],
+            "compression": config["compression"],
+            "compression_level": config["compression_level"],
+            "timeout": (DEFAULT_TIMEOUT[0], config["timeout"]),
+            "retries": config["retries"],
+            "retry_backoff": config["retry_backoff"],
+            "breaker_threshold": config["breaker_threshold"],
+            "breaker_cooldown": config["breaker_cooldown"],
+            "write_options": {key: config[key] for key in ("buffer_size", "fsync", "preallocate")},
+            "live_dir": config["live_dir"],
+            "live_mode": config["live_mode"],
+            "live_interval": config["live_interval"],
+            "live_stages": config["live_stages"],
+            "live_buffer": config["live_buffer"],
+        }))
+    # Wait in short slices so signal handlers run promptly on the main thread
+    while concurrent.futures.wait(futures, timeout=0.5).not_done:
+        pass
+    engine.shutdown()
+
+    results = [f.result() for f in futures]
+    downloaded = sum(r["downloaded"] for r in results)
+    errors = [e for r in results for e in r["errors"]]
+    print("\n--- SUMMARY ---", flush=True)
+    print(f"Total files downloaded: {downloaded}", flush=True)
+    print(f"Errors encountered: {len(errors)}", flush=True)
+    if totals.get("seconds"):
+        print(f"Download throughput: {totals['bytes_received'] / totals['seconds'] / 1e6:.1f} MB/s", flush=True)
+    if totals.get("bytes_stored") and totals["bytes_stored"] != totals["bytes_written"]:
+        print(f"Compression: {totals['bytes_written'] / totals['bytes_stored']:.1f}x "
+              f"({totals['bytes_written'] / 1e6:.1f} MB -> {totals['bytes_stored'] / 1e6:.1f} MB)", flush=True)
+    for line in metrics.latency_summary():
+        print(f"Latency {line}", flush=True)
+    if traffic_summary is not None and traffic_summary.files_analyzed:
+        for line in format_summary(traffic_summary.snapshot()):
+            print(line, flush=True)
+        print(f"Traffic summary saved to {traffic_summary.path}", flush=True)
+
+    if interrupted:
+        return EXIT_INTERRUPTED
+    if not any(r["connected"] for r in results):
+        return EXIT_CONNECT_FAILED
+    if errors:
+        return EXIT_DOWNLOAD_ERRORS
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    config, error = load_config(args)
+    if error:
+        print(f"Error: {error}", file=sys.stderr)
+        return EXIT_USAGE
+    return run(config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
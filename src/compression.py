@@ -0,0 +1,150 @@
+# This file handles on-the-fly compression of downloaded captures (.pcap.gz / .pcap.zst).
+import gzip
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSION_MODES = ["none", "gzip", "zstd"]
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+LEVEL_RANGES = {"gzip": (1, 9), "zstd": (1, 22)}
+
+# Data is handed to the compression pool in blocks of this size
+BLOCK_SIZE = 1024 * 1024
+
+_pool = None
+
+
+def compression_pool():
+    """
+    Returns the shared thread pool that compresses downloads. zlib and zstandard release the GIL while
+    compressing, so threads run in parallel with each other and with the network threads.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="pcap-compress")
+    return _pool
+
+
+def check_compression(mode, level=None):
+    """
+    Returns None if the compression mode (and level, if given) can be used, or an error message.
+    """
+    if mode not in COMPRESSION_MODES:
+        return f"Unknown compression mode {mode!r} (choose from {', '.join(COMPRESSION_MODES)})."
+    if level is not None and mode in LEVEL_RANGES:
+        low, high = LEVEL_RANGES[mode]
+        if not isinstance(level, int) or isinstance(level, bool) or not low <= level <= high:
+            return f"{mode} compression level must be an integer from {low} to {high}."
+    if mode == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return "zstd compression requires the zstandard package (pip install zstandard)."
+    return None
+
+
+def compressed_path(path, mode):
+    return path + COMPRESSION_SUFFIXES.get(mode or "none", "")
+
+
+def _compressor(mode, level):
+    if mode == "gzip":
+        # wbits=31 writes a gzip header and trailer
+        return zlib.compressobj(DEFAULT_LEVELS["gzip"] if level is None else level, zlib.DEFLATED, 31)
+    if mode == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=DEFAULT_LEVELS["zstd"] if level is None else level).compressobj()
+    raise ValueError(f"Unknown compression mode {mode!r}")
+
+
+class CompressingWriter:
+    """
+    File-like writer that compresses in the shared compression pool while the caller keeps downloading.
+
+    Writes are collected into blocks; each full block is compressed and written by a pool thread.
+    At most one block per file is in flight, which keeps output in order and bounds memory use to
+    about two blocks per file.
+    """
+
+    def __init__(self, path, mode, level=None, block_size=BLOCK_SIZE):
+        self.path = path
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._compressor = _compressor(mode, level)
+        self._file = open(path, 'wb')
+        self._buffer = bytearray()
+        self._block_size = block_size
+        self._pending = None
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        if len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer), final=False)
+            self._buffer.clear()
+        return len(data)
+
+    def _submit(self, block, final):
+        if self._pending is not None:
+            self._pending.result()
+        self._pending = compression_pool().submit(self._compress, block, final)
+
+    def _compress(self, block, final):
+        out = self._compressor.compress(block)
+        if final:
+            out += self._compressor.flush()
+        if out:
+            self._file.write(out)
+            self.bytes_out += len(out)
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), final=True)
+            self._buffer.clear()
+            self._pending.result()
+        finally:
+            self._file.close()
+
+    def abort(self):
+        """
+        Closes the file without finishing the compressed stream (after a failed download).
+        """
+        try:
+            if self._pending is not None:
+                self._pending.result()
+        except Exception:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_output(path, mode=None, level=None):
+    """
+    Opens a capture file for writing, compressing it when mode is gzip or zstd.
+    """
+    if not mode or mode == "none":
+        return open(path, 'wb')
+    return CompressingWriter(path, mode, level)
+
+
+def open_capture(path):
+    """
+    Opens a (possibly compressed) capture for reading. Compressed captures support forward seeks only.
+    """
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, 'rb')
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
@@ -0,0 +1,731 @@
+# This file drives the continuous download cycle (connect -> export -> write) for the whole firewall fleet
+# from a single asyncio event loop, instead of one thread per firewall plus one thread per file.
+import asyncio
+import contextlib
+import functools
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from api_handler import (PaloAltoAPI, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, FAILURE_AUTH, FAILURE_ERROR, FAILURE_MISSING,
+                         FAILURE_TRANSIENT, is_transient_error)
+from pcap_stream import DeltaState, DeltaExtractor
+from pcap_merge import merge_pcaps
+from pcap_index import IndexBuilder, index_path_for
+from compression import compressed_path
+from scheduler import FleetScheduler
+from log_sink import LogSink
+from metrics import MetricsRegistry
+from key_cache import KeyCache
+from rate_limit import AdaptiveLimiter
+from live_stream import LiveStream, LiveExtractor, live_path_for, LIVE_FIFO, DEFAULT_LIVE_INTERVAL, DEFAULT_CONSUMER_BUFFER
+from retry import (CircuitBreaker, backoff_delay, DEFAULT_RETRIES, DEFAULT_BACKOFF_BASE, DEFAULT_BREAKER_THRESHOLD,
+                   DEFAULT_BREAKER_COOLDOWN)
+
+FILE_TYPES = ["rx", "tx", "drp"]
+# Rotation also collects the firewall-stage capture, since it is cleared along with the others
+ROTATION_FILE_TYPES = FILE_TYPES + ["fw"]
+
+# Upper bound on blocking API calls in flight across all firewalls; this is also the worker thread count.
+DEFAULT_MAX_CONCURRENCY = 32
+# Upper bound on concurrent exports against a single firewall's management plane. Within it the
+# actual limit adapts to the firewall's export latency and errors (see rate_limit.AdaptiveLimiter).
+DEFAULT_PER_FIREWALL_CONCURRENCY = 3
+
+
+def file_types_for(job):
+    """
+    Returns the capture files downloaded every cycle of a job.
+    """
+    return ROTATION_FILE_TYPES if job.get("rotate") else FILE_TYPES
+
+
+class DownloadEngine:
+    """
+    Runs download jobs for many firewalls on one event loop in a background thread.
+
+    Blocking requests calls are pushed to a fixed-size thread pool, gated by a global semaphore
+    and a per-firewall semaphore. Cycle start times come from a scheduler.FleetScheduler,
+    per-firewall log files are written by a log_sink.LogSink and connect/download timings are
+    collected in a metrics.MetricsRegistry. API keys are shared through a key_cache.KeyCache. An
+    optional retention.RetentionManager is told about every file written and pauses downloads
+    while the disk budget is exhausted; an optional traffic_summary.TrafficSummary analyzes every
+    saved capture and its updates are published as "traffic" events. Jobs with a live_dir also
+    stream new packets to a live_stream.LiveStream per firewall between cycles. Callers submit
+    jobs with submit() and receive progress as event dicts through callbacks registered with
+    subscribe(). Callbacks run on the engine thread and must not block.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, per_firewall_concurrency=DEFAULT_PER_FIREWALL_CONCURRENCY, scheduler=None, log_sink=None, metrics=None, key_cache=None, retention=None,
+                 traffic_summary=None):
+        self.max_concurrency = max_concurrency
+        self.per_firewall_concurrency = per_firewall_concurrency
+        self.scheduler = scheduler or FleetScheduler()
+        self.log_sink = log_sink or LogSink()
+        if self.log_sink.on_error is None:
+            # The sink reports errors from its writer thread; events are handed to the engine thread
+            self.log_sink.on_error = lambda message: self._publish_threadsafe({"type": "log", "firewall": None, "message": message})
+        self.metrics = metrics or MetricsRegistry()
+        self.key_cache = key_cache or KeyCache()
+        self.retention = retention
+        if retention is not None and retention.on_log is None:
+            # Retention logs from its own thread; events are handed to the engine thread
+            retention.on_log = lambda message: self._publish_threadsafe({"type": "log", "firewall": None, "message": message})
+        self.traffic_summary = traffic_summary
+        if traffic_summary is not None:
+            # The summary calls back from its process pool's thread; events are handed to the engine thread
+            if traffic_summary.on_log is None:
+                traffic_summary.on_log = lambda message: self._publish_threadsafe({"type": "log", "firewall": None, "message": message})
+            if traffic_summary.on_update is None:
+                traffic_summary.on_update = lambda summary: self._publish_threadsafe({"type": "traffic", "summary": summary})
+        self._subscribers = []
+        self._futures = []
+        self._outstanding = 0  # jobs not done yet, plus one per open submitting() block
+        self._outstanding_lock = threading.Lock()
+        self._loop = None
+        self._events_loop = None  # the loop of the last start(), kept after shutdown() for late events
+        self._thread = None
+        self._executor = None
+        self._global_limit = None
+        self._stop_event = None
+        self._reconnect_locks = {}
+        self.limiters = {}  # firewall -> rate_limit.AdaptiveLimiter of its running job
+
+    # --- LIFECYCLE ---
+    def start(self):
+        if self._loop is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="pcap-io")
+        self._loop = self._events_loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), name="pcap-engine", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        self._global_limit = asyncio.Semaphore(self.max_concurrency)
+        self._stop_event = asyncio.Event()
+        loop.call_soon(ready.set)
+        loop.run_forever()
+        loop.close()
+
+    def stop(self):
+        """
+        Asks every running job to finish after its current download cycle.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until all submitted jobs have finished.
+        """
+        for future in list(self._futures):
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def shutdown(self):
+        """
+        Stops all jobs, the event loop and the worker threads. Safe to call from an event callback.
+        """
+        if self._loop is None:
+            return
+        loop, self._loop = self._loop, None
+        loop.call_soon_threadsafe(self._stop_event.set)
+        if threading.current_thread() is self._thread:
+            loop.stop()
+            self._executor.shutdown(wait=False)
+        else:
+            self.wait()
+            if self.traffic_summary is not None:
+                # Queued analyses publish their results through the loop, so it runs until they are done
+                self.traffic_summary.close()
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join()
+            self._executor.shutdown(wait=True)
+        self.log_sink.close()
+        if self.retention is not None:
+            self.retention.close()
+        if self.traffic_summary is not None:
+            self.traffic_summary.close()
+        if self.metrics.textfile_path or self.metrics.json_path:
+            error = self.metrics.export()
+            if error:
+                self._log(None, error)
+
+    def now(self):
+        return self.scheduler.clock()
+
+    @property
+    def next_run(self):
+        """
+        firewall -> (previous deadline, next deadline) in scheduler clock (time.monotonic()) seconds.
+        """
+        return self.scheduler.next_run
+
+    # --- JOBS AND EVENTS ---
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def submit(self, job):
+        """
+        Schedules a continuous download job. job is a dict with keys: firewall, username, password,
+        project_name, save_dir, count (None runs until stopped), interval and optionally pool_size
+        and delta (store only packets that are new since the previous snapshot), merge (also write
+        one time-ordered pcapng per interval), merge_rolling (also append every interval to one
+        pcapng per firewall), index (write a .idx sidecar index next to every pcap) and compression
+        ("gzip" or "zstd", with optional compression_level), timeout ((connect, read) seconds),
+        retries and retry_backoff (retries of failed exports/connects, exponential backoff base in
+        seconds) and breaker_threshold and breaker_cooldown (consecutive failures before the
+        firewall is skipped, seconds before it is probed again), write_options (read buffer size,
+        fsync policy and preallocation, see download_writer.DEFAULT_WRITE_OPTIONS), max_rate and
+        adaptive (per-firewall export rate cap in requests per second, and whether concurrency and
+        rate adapt to the firewall's load; see rate_limit.AdaptiveLimiter) and rotate
+        (every cycle stops the capture, downloads rx/tx/drp/fw, clears them and restarts the
+        capture, so exports stay small; see _rotate).
+        Returns a concurrent.futures.Future that resolves to a per-firewall result dict.
+        """
+        self.start()
+        self._hold()
+        future = asyncio.run_coroutine_threadsafe(self._run_firewall(job), self._loop)
+        self._futures.append(future)
+        future.add_done_callback(self._job_done)
+        return future
+
+    @contextlib.contextmanager
+    def submitting(self):
+        """
+        Holds back the "finished" event while a batch of jobs is submitted, so a job that is done
+        before the others have been submitted does not finish the batch early.
+        """
+        self.start()
+        self._hold()
+        try:
+            yield self
+        finally:
+            self._release()
+
+    def _hold(self):
+        with self._outstanding_lock:
+            self._outstanding += 1
+
+    def _release(self):
+        with self._outstanding_lock:
+            self._outstanding -= 1
+            finished = self._outstanding == 0
+        if finished:
+            self._publish_threadsafe({"type": "finished"})
+
+    def _job_done(self, future):
+        # Runs on the engine thread, or on the submitting thread if the job was already done
+        self._release()
+
+    def _publish(self, event):
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception:
+                pass
+
+    def _publish_threadsafe(self, event):
+        """
+        Publishes an event from a thread other than the engine thread. Dropped once the engine has shut down.
+        """
+        loop = self._events_loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._publish, event)
+        except RuntimeError:
+            # The loop is closed
+            pass
+
+    def _log(self, firewall, message):
+        self._publish({"type": "log", "firewall": firewall, "message": message})
+
+    async def _call(self, func, *args):
+        async with self._global_limit:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _sleep(self, seconds):
+        """
+        Sleeps for up to seconds, returning early (True) if the engine is stopped.
+        """
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=max(seconds, 0))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _report_limits(self, firewall_ip, fw_limit, change):
+        self._log(firewall_ip, f"{firewall_ip}: {change}")
+        self._publish({"type": "limits", "firewall": firewall_ip, "concurrency": fw_limit.concurrency,
+                       "rate": fw_limit.rate, "latency": fw_limit.latency})
+
+    # --- LIVE STREAMING ---
+    async def _run_live(self, api_handler, fw_limit, job, breaker):
+        """
+        Polls the capture files of one firewall every live_interval seconds and pushes the packets
+        that are new since the previous poll, ordered by time, to its live stream. Runs until
+        cancelled or stopped. Polls share the firewall's AdaptiveLimiter with the downloads, are
+        not retried (the next poll is the retry) and leave an open circuit breaker to the
+        download cycles to probe.
+        """
+        firewall_ip = job["firewall"]
+        mode = job.get("live_mode") or LIVE_FIFO
+        path = live_path_for(job["live_dir"], job["project_name"], firewall_ip, mode)
+        try:
+            # The stream also logs from its consumer thread, so its messages are handed to the engine thread
+            stream = LiveStream(path, mode, job.get("live_buffer") or DEFAULT_CONSUMER_BUFFER,
+                                on_log=lambda message: self._publish_threadsafe(
+                                    {"type": "log", "firewall": firewall_ip, "message": f"{firewall_ip}: {message}"}))
+        except (OSError, ValueError) as e:
+            self._log(firewall_ip, f"{firewall_ip}: Could not create live stream {path}: {e}")
+            return
+        self._log(firewall_ip, f"{firewall_ip}: Streaming new packets to {path}.")
+        stages = job.get("live_stages") or file_types_for(job)
+        states = {ftype: DeltaState() for ftype in stages}
+        baseline = set()  # stages whose first poll has been taken
+        failing = False
+        try:
+            while True:
+                if api_handler.api_key is not None and not (breaker.is_open or breaker.half_open):
+                    polls = await asyncio.gather(*(self._live_poll(api_handler, fw_limit, job, breaker, ftype, states[ftype],
+                                                                   ftype in baseline) for ftype in stages))
+                    header = None
+                    records = []
+                    errors = []
+                    for ftype, (success, message, extractor) in zip(stages, polls):
+                        if not success:
+                            errors.append(f"{ftype}.pcap: {message}")
+                            continue
+                        if extractor is not None and extractor.mismatch:
+                            # The capture changed under us; streaming all of it again would flood the readers
+                            baseline.discard(ftype)
+                            continue
+                        baseline.add(ftype)
+                        if extractor is not None and extractor.header is not None:
+                            header = header or extractor.header
+                            records += [(extractor.timestamp(record), record) for record in extractor.records]
+                    if header is not None:
+                        records.sort(key=lambda item: item[0])
+                        stream.push(header, [record for _, record in records])
+                    if errors and not failing:
+                        self._log(firewall_ip, f"{firewall_ip}: Live poll failed, will keep polling: {'; '.join(errors)}")
+                    elif failing and not errors:
+                        self._log(firewall_ip, f"{firewall_ip}: Live polling recovered.")
+                    failing = bool(errors)
+                if await self._sleep(job.get("live_interval") or DEFAULT_LIVE_INTERVAL):
+                    break
+        finally:
+            await self._call(stream.close)
+
+    async def _live_poll(self, api_handler, fw_limit, job, breaker, ftype, state, emit):
+        """
+        Exports one capture file without storing it. Returns (success, message, LiveExtractor or None).
+        """
+        firewall_ip = job["firewall"]
+        extractor = LiveExtractor(state, emit)
+        stats = {}
+        api_key = api_handler.api_key
+        delay = await fw_limit.acquire()
+        success = False
+        try:
+            if delay > 0 and await self._sleep(delay):
+                return False, "Stopped by user.", None
+            try:
+                success, message = await self._call(functools.partial(
+                    api_handler.download_filtered_pcap, f"{ftype}.pcap", None, extractor, stats=stats))
+            except Exception as e:
+                success, message = False, str(e)
+                stats["failure"] = FAILURE_TRANSIENT if is_transient_error(e) else FAILURE_ERROR
+        finally:
+            change = await fw_limit.release(stats.get("ttfb_seconds") if success else None,
+                                            not success and stats.get("failure") == FAILURE_TRANSIENT)
+        if change:
+            self._report_limits(firewall_ip, fw_limit, change)
+        if success:
+            extractor.commit()
+            return True, message, extractor
+        if stats.get("failure") == FAILURE_MISSING:
+            # No capture (yet, or it was just cleared): whatever appears next is new
+            state.reset()
+            return True, message, None
+        if stats.get("failure") == FAILURE_AUTH:
+            await self._reconnect(api_handler, job, breaker, api_key)
+        return False, message, None
+
+    # --- PER-FIREWALL CYCLE ---
+    async def _run_firewall(self, job):
+        firewall_ip = job["firewall"]
+        project_name = job["project_name"]
+        save_dir = job["save_dir"]
+        count = job["count"]
+        interval = job["interval"]
+        result = {"firewall": firewall_ip, "downloaded": 0, "errors": [], "connected": False, "stopped": False, "stats": None}
+        log_file = os.path.join(save_dir, f"{project_name}_{firewall_ip}_download.log")
+        write_log = functools.partial(self.log_sink.write, log_file, firewall=firewall_ip)
+
+        # Staggered start: each firewall connects and runs its first cycle at its own offset
+        deadline = self.scheduler.add(firewall_ip, interval)
+        if await self._sleep(deadline - self.now()):
+            self.scheduler.remove(firewall_ip)
+            result["stopped"] = True
+            self._publish({"type": "firewall_done", **result})
+            return result
+
+        # One pooled keep-alive session per firewall, reused by every download in this job
+        api_handler = PaloAltoAPI(firewall_ip, job["username"], job["password"], pool_size=job.get("pool_size", DEFAULT_POOL_SIZE),
+                                  timeout=job.get("timeout", DEFAULT_TIMEOUT), key_cache=self.key_cache,
+                                  write_options=job.get("write_options"))
+        breaker = CircuitBreaker(job.get("breaker_threshold", DEFAULT_BREAKER_THRESHOLD),
+                                 job.get("breaker_cooldown", DEFAULT_BREAKER_COOLDOWN), clock=self.now)
+        self._reconnect_locks[firewall_ip] = asyncio.Lock()
+        self._log(firewall_ip, f"Connecting to {firewall_ip}...")
+        success, message, failure = await self._connect(api_handler, job, breaker)
+        if not success:
+            result["errors"].append(f"{firewall_ip}: {message}")
+            if failure != FAILURE_TRANSIENT:
+                # Rejected credentials or a configuration problem: retrying on a schedule will not help
+                api_handler.close()
+                self.scheduler.remove(firewall_ip)
+                self._reconnect_locks.pop(firewall_ip, None)
+                self._publish({"type": "firewall_done", **result})
+                return result
+            self._log(firewall_ip, f"{firewall_ip}: Unreachable, will keep trying to connect on schedule.")
+        else:
+            result["connected"] = True
+
+        fw_limit = self.limiters[firewall_ip] = AdaptiveLimiter(self.per_firewall_concurrency, job.get("max_rate"),
+                                                                job.get("adaptive", True))
+        delta_states = {ftype: DeltaState() for ftype in file_types_for(job)} if job.get("delta") else None
+        live_task = asyncio.ensure_future(self._run_live(api_handler, fw_limit, job, breaker)) if job.get("live_dir") else None
+        try:
+            for i in (itertools.count() if count is None else range(count)):
+                if self._stop_event.is_set():
+                    result["stopped"] = True
+                    self._log(firewall_ip, f"{firewall_ip}: Download stopped by user.")
+                    write_log("Download stopped by user.", status="stopped")
+                    break
+                cycle_started = self.now()
+                await self._run_cycle(api_handler, fw_limit, job, delta_states, write_log, result, breaker)
+                cycle_seconds = self.now() - cycle_started
+                self.metrics.observe_cycle(firewall_ip, cycle_seconds)
+                self._publish({"type": "cycle", "firewall": firewall_ip, "seconds": cycle_seconds})
+                error = await asyncio.get_running_loop().run_in_executor(self._executor, self.metrics.maybe_export)
+                if error:
+                    self._log(firewall_ip, error)
+                if count is not None and i >= count - 1:
+                    break
+                deadline, skipped = self.scheduler.cycle_finished(firewall_ip)
+                if skipped:
+                    self._log(firewall_ip, f"{firewall_ip}: Download took longer than the interval, skipped {skipped} scheduled download(s).")
+                elif deadline < self.now():
+                    self._log(firewall_ip, f"{firewall_ip}: Download took longer than the interval, catching up.")
+                self._publish({"type": "wait", "firewall": firewall_ip, "deadline": deadline})
+                if await self._sleep(deadline - self.now()):
+                    result["stopped"] = True
+                    self._log(firewall_ip, f"{firewall_ip}: Download stopped by user.")
+                    write_log("Download stopped by user.", status="stopped")
+                    break
+        finally:
+            if live_task is not None:
+                live_task.cancel()
+                await asyncio.gather(live_task, return_exceptions=True)
+            self.scheduler.remove(firewall_ip)
+            self._reconnect_locks.pop(firewall_ip, None)
+            self.limiters.pop(firewall_ip, None)
+            stats = api_handler.connection_stats()
+            api_handler.close()
+        result["stats"] = stats
+        stats_entry = f"HTTP requests: {stats['requests']}, connections opened: {stats['connections_opened']}, reused: {stats['connections_reused']}"
+        self._log(firewall_ip, f"{firewall_ip}: {stats_entry}")
+        write_log(stats_entry, status="connection_stats")
+        self._log(firewall_ip, f"{firewall_ip}: Continuous download finished.")
+        write_log("Continuous download finished.", status="finished")
+        self._publish({"type": "firewall_done", **result})
+        return result
+
+    async def _connect(self, api_handler, job, breaker):
+        """
+        Connects (or reconnects) with retries on network errors. Returns (success, message, FAILURE_* kind or None).
+        """
+        firewall_ip = job["firewall"]
+        retries = job.get("retries", DEFAULT_RETRIES)
+        attempt = 0
+        while True:
+            stats = {}
+            try:
+                success, message = await self._call(api_handler.connect, stats)
+            except Exception as e:
+                success, message = False, f"Failed to connect to {firewall_ip}: {e}"
+                stats["failure"] = FAILURE_TRANSIENT if is_transient_error(e) else FAILURE_ERROR
+            if "seconds" in stats:
+                self.metrics.observe_connect(firewall_ip, stats["seconds"], success)
+            if success:
+                breaker.record_success()
+                self._publish({"type": "connect", "firewall": firewall_ip, "success": True, "message": f"{firewall_ip}: {message}"})
+                return True, message, None
+            failure = stats.get("failure", FAILURE_ERROR)
+            opened = breaker.record_failure()
+            if failure != FAILURE_TRANSIENT or attempt >= retries or opened or breaker.is_open:
+                self._publish({"type": "connect", "firewall": firewall_ip, "success": False, "message": f"{firewall_ip}: {message}"})
+                return False, message, failure
+            delay = backoff_delay(attempt, job.get("retry_backoff", DEFAULT_BACKOFF_BASE))
+            self._log(firewall_ip, f"{firewall_ip}: {message} Retrying in {delay:.1f}s ({attempt + 1}/{retries}).")
+            if await self._sleep(delay):
+                self._publish({"type": "connect", "firewall": firewall_ip, "success": False, "message": f"{firewall_ip}: {message}"})
+                return False, message, failure
+            attempt += 1
+
+    async def _reconnect(self, api_handler, job, breaker, stale_key):
+        """
+        Reconnects after the firewall rejected stale_key. Concurrent downloads that hit the same
+        expired key share one reconnect. Returns True if a fresh key is available.
+        """
+        firewall_ip = job["firewall"]
+        async with self._reconnect_locks[firewall_ip]:
+            if api_handler.api_key is not None and api_handler.api_key != stale_key:
+                return True
+            self._log(firewall_ip, f"{firewall_ip}: API key rejected, reconnecting...")
+            api_handler.invalidate_key(stale_key)
+            success, _, _ = await self._connect(api_handler, job, breaker)
+            return success
+
+    async def _run_cycle(self, api_handler, fw_limit, job, delta_states, write_log, result, breaker):
+        """
+        Downloads rx/tx/drp once (and merges them if requested). Skipped while the firewall's circuit breaker is open.
+        """
+        firewall_ip = job["firewall"]
+        if not breaker.allow():
+            message = f"Firewall unhealthy after {breaker.failures} failures, skipping this download (next probe in {breaker.retry_in():.0f}s)."
+            self._log(firewall_ip, f"{firewall_ip}: {message}")
+            write_log(message, status="skipped")
+            return
+        if self.retention is not None and not await self._call(self.retention.allow):
+            message = "Disk budget exhausted, skipping this download."
+            self._log(firewall_ip, f"{firewall_ip}: {message}")
+            write_log(message, status="skipped")
+            return
+        if api_handler.api_key is None:
+            success, message, _ = await self._connect(api_handler, job, breaker)
+            if not success:
+                result["errors"].append(f"{firewall_ip}: {message}")
+                return
+            result["connected"] = True
+        file_types = file_types_for(job)
+        stop_stats = None
+        if job.get("rotate"):
+            stopped, message, stop_stats = await self._capture_command(api_handler, job, breaker, api_handler.stop_packet_capture, "")
+            if not stopped:
+                stop_stats = None
+                message = f"Could not stop the capture, downloading without rotating: {message}"
+                self._log(firewall_ip, f"{firewall_ip}: {message}")
+                write_log(message, status="error")
+                result["errors"].append(f"{firewall_ip}: {message}")
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        filenames = {ftype: compressed_path(os.path.join(job["save_dir"], f"{job['project_name']}_{timestamp}_{firewall_ip}_{ftype}.pcap"), job.get("compression"))
+                     for ftype in file_types}
+        download = functools.partial(self._download, api_handler, fw_limit, job, delta_states=delta_states, breaker=breaker)
+        outcomes = []
+        remaining = file_types
+        if breaker.half_open:
+            # Probe a recovering firewall with one download before sending it the whole cycle
+            outcomes.append(await download(file_types[0], filenames[file_types[0]]))
+            remaining = file_types[1:] if not breaker.is_open else []
+        outcomes += await asyncio.gather(*(download(ftype, filenames[ftype]) for ftype in remaining))
+        for ftype, (success, msg, path, stats) in zip(file_types, outcomes):
+            log_entry = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {firewall_ip} {ftype.upper()}: {msg}"
+            write_log(log_entry, file_type=ftype, size=stats.get("bytes_stored"), duration=stats.get("seconds"),
+                      status=("ok" if path else "skipped") if success else "error")
+            self.metrics.observe_download(firewall_ip, ftype, stats, success)
+            if success:
+                result["downloaded"] += 1
+            else:
+                result["errors"].append(log_entry)
+            if self.retention is not None and path:
+                self.retention.add(path, index_path_for(path) if job.get("index") else None)
+            if self.traffic_summary is not None and path:
+                # Delta and rotation files hold only new packets, full snapshots repeat earlier ones
+                self.traffic_summary.add(firewall_ip, ftype, path, incremental=bool(job.get("delta") or job.get("rotate")))
+            self._publish({"type": "file", "firewall": firewall_ip, "ftype": ftype, "success": success,
+                           "message": log_entry, "path": path, "stats": stats})
+        # Restart before merging, the capture is stopped until then
+        if stop_stats is not None:
+            # A missing file has nothing to lose; anything else unsaved must stay on the firewall
+            all_saved = len(outcomes) == len(file_types) and all(
+                success or stats.get("failure") == FAILURE_MISSING for success, _, _, stats in outcomes)
+            await self._rotate(api_handler, job, breaker, all_saved, stop_stats, write_log, result)
+        if job.get("merge") or job.get("merge_rolling"):
+            sources = [(ftype, path) for ftype, (_, _, path, _) in zip(file_types, outcomes) if path]
+            if sources:
+                await self._merge(job, firewall_ip, timestamp, sources, write_log, result)
+
+    async def _rotate(self, api_handler, job, breaker, all_saved, stop_stats, write_log, result):
+        """
+        Second half of a rotation cycle, after the capture was stopped and downloaded: clears the
+        capture files on the firewall, but only if every one of them was saved, then restarts the
+        capture at once and logs the capture gap.
+
+        The gap runs from the moment the stop command was applied to the moment the start command
+        was applied, each estimated as halfway through its request's round trip; the uncertainty
+        is half of both round trips together. The capture filter stays set on the firewall.
+        """
+        firewall_ip = job["firewall"]
+        if all_saved:
+            success, message, _ = await self._capture_command(api_handler, job, breaker, api_handler.clear_packet_capture, "")
+            if not success:
+                message = f"Could not clear the capture files, they will be downloaded again: {message}"
+        else:
+            success, message = False, "Not every capture file was saved, keeping the captures on the firewall for the next download."
+        if not success:
+            self._log(firewall_ip, f"{firewall_ip}: {message}")
+            write_log(message, status="error")
+            result["errors"].append(f"{firewall_ip}: {message}")
+        started, message, start_stats = await self._capture_command(api_handler, job, breaker, api_handler.start_packet_capture, "", {})
+        if not started:
+            message = f"Could not restart the capture, it is stopped: {message}"
+            self._log(firewall_ip, f"{firewall_ip}: {message}")
+            write_log(message, status="error")
+            result["errors"].append(f"{firewall_ip}: {message}")
+            self._publish({"type": "rotation", "firewall": firewall_ip, "success": False, "message": f"{firewall_ip}: {message}"})
+            return
+        gap = (start_stats["sent_at"] + start_stats["seconds"] / 2) - (stop_stats["sent_at"] + stop_stats["seconds"] / 2)
+        uncertainty = (start_stats["seconds"] + stop_stats["seconds"]) / 2
+        self.metrics.observe_gap(firewall_ip, gap)
+        message = f"Capture rotated{'' if all_saved and success else ' without clearing'}, gap {gap:.3f}s (+/- {uncertainty:.3f}s)"
+        write_log(message, duration=gap, status="rotated")
+        self._publish({"type": "rotation", "firewall": firewall_ip, "success": True, "message": f"{firewall_ip}: {message}",
+                       "gap": gap, "uncertainty": uncertainty})
+
+    async def _capture_command(self, api_handler, job, breaker, method, *args):
+        """
+        Runs a packet capture op command (a PaloAltoAPI stop/clear/start_packet_capture method),
+        retrying network errors and busy responses with backoff and reconnecting once the API key
+        is rejected. Returns (success, message, stats dict of the last attempt).
+        """
+        firewall_ip = job["firewall"]
+        retries = job.get("retries", DEFAULT_RETRIES)
+        attempt = 0
+        while True:
+            stats = {}
+            api_key = api_handler.api_key
+            success, message = await self._call(method, *args, stats)
+            if success:
+                return True, message, stats
+            failure = stats.get("failure", FAILURE_ERROR)
+            if attempt >= retries or failure not in (FAILURE_AUTH, FAILURE_TRANSIENT):
+                return False, message, stats
+            if failure == FAILURE_AUTH:
+                if not await self._reconnect(api_handler, job, breaker, api_key):
+                    return False, message, stats
+            else:
+                delay = backoff_delay(attempt, job.get("retry_backoff", DEFAULT_BACKOFF_BASE))
+                self._log(firewall_ip, f"{firewall_ip}: {message} Retrying in {delay:.1f}s ({attempt + 1}/{retries}).")
+                if await self._sleep(delay):
+                    return False, message, stats
+            attempt += 1
+
+    async def _merge(self, job, firewall_ip, timestamp, sources, write_log, result):
+        targets = []
+        if job.get("merge"):
+            targets.append((os.path.join(job["save_dir"], f"{job['project_name']}_{timestamp}_{firewall_ip}_merged.pcapng"), False))
+        if job.get("merge_rolling"):
+            targets.append((os.path.join(job["save_dir"], f"{job['project_name']}_{firewall_ip}_merged.pcapng"), True))
+        for path, append in targets:
+            try:
+                packets = await self._call(merge_pcaps, sources, path, append, f"{firewall_ip} {timestamp}")
+                success, msg = True, f"Merged {packets} packets from {', '.join(name for name, _ in sources)} into {path}"
+            except Exception as e:
+                success, msg = False, f"Error merging captures into {path}: {e}"
+            log_entry = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {firewall_ip} MERGE: {msg}"
+            write_log(log_entry, file_type="merged", status="ok" if success else "error")
+            if not success:
+                result["errors"].append(log_entry)
+            elif self.retention is not None:
+                self.retention.add(path)
+            self._publish({"type": "merged", "firewall": firewall_ip, "success": success, "message": log_entry,
+                           "path": path if success else None})
+
+    async def _download(self, api_handler, fw_limit, job, ftype, save_path, delta_states=None, breaker=None):
+        """
+        Downloads one capture file, retrying network errors and busy responses with backoff and
+        reconnecting once the API key is rejected. Returns (success, message, path written or None, transfer stats dict).
+        """
+        firewall_ip = job["firewall"]
+        compression = job.get("compression")
+        retries = job.get("retries", DEFAULT_RETRIES)
+        breaker = breaker or CircuitBreaker(clock=self.now)
+        attempt = 0
+        while True:
+            # A fresh transform per attempt: nothing is committed until a download succeeds
+            extractor = DeltaExtractor(delta_states[ftype]) if delta_states else None
+            transform = IndexBuilder(index_path_for(save_path), inner=extractor) if job.get("index") else extractor
+            stats = {}
+            api_key = api_handler.api_key
+            delay = await fw_limit.acquire()
+            success = False
+            try:
+                if delay > 0 and await self._sleep(delay):
+                    msg = f"{ftype}.pcap not downloaded, stopped by user."
+                    stats["failure"] = FAILURE_ERROR
+                else:
+                    try:
+                        success, msg = await self._call(functools.partial(
+                            api_handler.download_filtered_pcap, f"{ftype}.pcap", save_path, transform,
+                            compression=compression, compression_level=job.get("compression_level"), stats=stats))
+                    except Exception as e:
+                        success, msg = False, f"Error downloading {ftype}.pcap: {e}"
+                        stats["failure"] = FAILURE_TRANSIENT if is_transient_error(e) else FAILURE_ERROR
+            finally:
+                change = await fw_limit.release(stats.get("ttfb_seconds") if success else None,
+                                                not success and stats.get("failure") == FAILURE_TRANSIENT)
+            if change:
+                self._report_limits(firewall_ip, fw_limit, change)
+            if success:
+                breaker.record_success()
+                if extractor is not None and extractor.mismatch:
+                    # The skipped records are lost from this stream; with the state reset the next export is stored in full
+                    extractor.commit()
+                    self._log(firewall_ip, f"{firewall_ip}: {ftype}.pcap does not continue the previous snapshot, downloading it again in full.")
+                    continue
+                break
+            failure = stats.get("failure", FAILURE_ERROR)
+            if failure == FAILURE_MISSING:
+                # The firewall answered; there is just no such capture yet
+                breaker.record_success()
+                return False, msg, None, stats
+            if failure == FAILURE_AUTH and attempt < retries:
+                if not await self._reconnect(api_handler, job, breaker, api_key):
+                    return False, msg, None, stats
+                attempt += 1
+                continue
+            if failure != FAILURE_TRANSIENT:
+                return False, msg, None, stats
+            breaker.record_failure()
+            if attempt >= retries or breaker.is_open:
+                if attempt:
+                    msg = f"{msg} (gave up after {attempt + 1} attempts)"
+                return False, msg, None, stats
+            delay = backoff_delay(attempt, job.get("retry_backoff", DEFAULT_BACKOFF_BASE))
+            self._log(firewall_ip, f"{firewall_ip}: {ftype}.pcap failed, retrying in {delay:.1f}s ({attempt + 1}/{retries}).")
+            if await self._sleep(delay):
+                return False, msg, None, stats
+            attempt += 1
+        if compression and compression != "none" and stats.get("bytes_stored"):
+            ratio = stats["bytes_written"] / stats["bytes_stored"]
+            rate = stats["bytes_received"] / stats["seconds"] / 1e6 if stats["seconds"] else 0
+            msg = f"{msg} ({compression} {ratio:.1f}x, {rate:.1f} MB/s)"
+        if extractor is None:
+            return True, msg, save_path, stats
+        extractor.commit()
+        if extractor.new_records == 0:
+            return True, f"No new packets in {ftype}.pcap since the previous snapshot, skipped.", None, stats
+        msg = f"{msg} ({extractor.new_records} new packets)"
+        return True, msg, save_path, stats
@@ -0,0 +1,137 @@
+# This file holds the shared download path helpers: large reused read buffers, atomic file
+# finalization and bounded reads of error responses.
+import os
+
+from compression import open_output
+
+# Bytes read from the socket per iteration. One buffer of this size is reused for the whole download.
+READ_BUFFER_SIZE = 1024 * 1024
+# Longest error response body kept for messages; the rest is not read
+ERROR_BODY_LIMIT = 64 * 1024
+# Downloads are written to <path>.part and renamed to <path> once complete
+PART_SUFFIX = ".part"
+
+FSYNC_NONE = "none"  # leave flushing to the OS (fastest; a power loss can lose recent files)
+FSYNC_FILE = "file"  # fsync every file before it is renamed into place
+FSYNC_FULL = "full"  # also fsync the directory after the rename, so the new name is durable too
+FSYNC_POLICIES = [FSYNC_NONE, FSYNC_FILE, FSYNC_FULL]
+
+DEFAULT_WRITE_OPTIONS = {"buffer_size": READ_BUFFER_SIZE, "fsync": FSYNC_NONE, "preallocate": False}
+
+
+def iter_body(response, buffer_size=READ_BUFFER_SIZE):
+    """
+    Yields the body of a streamed requests response as memoryviews into one reused buffer.
+
+    Each view is only valid until the next one is requested: consumers must write or copy it
+    (pcap_stream parsers copy what they keep) rather than hold on to it.
+    """
+    raw = response.raw
+    raw.decode_content = True
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        n = raw.readinto(buffer)
+        if not n:
+            return
+        yield view[:n]
+
+
+def read_error_body(response, limit=ERROR_BODY_LIMIT):
+    """
+    Returns at most limit bytes of a streamed (error) response as text, and closes the response.
+    """
+    try:
+        data = response.raw.read(limit, decode_content=True) or b""
+    except Exception:
+        data = b""
+    finally:
+        response.close()
+    text = data.decode(response.encoding or "utf-8", "replace")
+    if len(data) >= limit:
+        text += " [truncated]"
+    return text
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(path):
+    # Directories cannot be opened for fsync on Windows; there the rename is as durable as it gets
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AtomicWriter:
+    """
+    File-like writer for one download.
+
+    Data goes to path + PART_SUFFIX (compressed through compression.open_output when requested);
+    commit() finishes the file, applies the fsync policy and renames it to path, so a file under
+    its final name is always complete. abort() removes the partial file. preallocate reserves
+    that many bytes up front (uncompressed output only, where posix_fallocate exists) to reduce
+    fragmentation of large captures; the file is trimmed to the written size on commit.
+    """
+
+    def __init__(self, path, compression=None, compression_level=None, fsync=FSYNC_NONE, preallocate=None):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.fsync = fsync
+        self.bytes_in = 0
+        self._file = open_output(self.part_path, compression, compression_level)
+        self._preallocated = False
+        if preallocate and not hasattr(self._file, "bytes_out") and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, preallocate)
+                self._preallocated = True
+            except OSError:
+                pass
+
+    @property
+    def bytes_out(self):
+        return getattr(self._file, "bytes_out", self.bytes_in)
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        return self._file.write(data)
+
+    def commit(self):
+        if self._preallocated:
+            self._file.truncate(self.bytes_in)
+        self._file.close()
+        if self.fsync != FSYNC_NONE:
+            _fsync_path(self.part_path)
+        os.replace(self.part_path, self.path)
+        if self.fsync == FSYNC_FULL:
+            _fsync_directory(self.path)
+
+    def abort(self):
+        try:
+            if hasattr(self._file, "abort"):
+                self._file.abort()
+            else:
+                self._file.close()
+        finally:
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -0,0 +1,147 @@
+# This file pushes packet capture control commands (filter, start, stop, clear) to many firewalls at the same instant.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api_handler import PaloAltoAPI, DEFAULT_TIMEOUT, FAILURE_AUTH, capture_filter_string
+from key_cache import KeyCache
+
+ACTION_FILTER = "filter"
+ACTION_START = "start"
+ACTION_STOP = "stop"
+ACTION_CLEAR = "clear"
+FLEET_ACTIONS = [ACTION_FILTER, ACTION_START, ACTION_STOP, ACTION_CLEAR]
+
+# Longest time a worker waits for the others at the start line. If one is late the rest go anyway,
+# unsynchronized, rather than not at all.
+BARRIER_TIMEOUT = 5.0
+
+
+class FleetController:
+    """
+    Arms and disarms packet captures on a group of firewalls together.
+
+    connect() logs in to every firewall in parallel, which also leaves one warm keep-alive
+    connection per firewall. run() gives every firewall its own worker thread; the workers wait on
+    a barrier and all send their command the moment the last one is ready, so the capture windows
+    of an HA pair or of every firewall along a path line up to within network latency instead of
+    the sum of all round trips. The XML status of every response is checked. A rejected API key is
+    regenerated and the command resent once (that firewall is then no longer in step).
+
+    Each result records the round trip and the firewall's offset: when its command is estimated
+    to have been applied (halfway through the round trip) relative to the earliest firewall.
+    """
+
+    def __init__(self, firewalls, username, password, timeout=DEFAULT_TIMEOUT, key_cache=None):
+        self.key_cache = key_cache or KeyCache()
+        self.apis = {fw: PaloAltoAPI(fw, username, password, pool_size=1, timeout=timeout, key_cache=self.key_cache)
+                     for fw in firewalls}
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.apis), 1), thread_name_prefix="fleet")
+        self._lock = threading.Lock()  # one fleet action at a time
+
+    def connect(self):
+        """
+        Connects to every firewall that has no API key yet, in parallel. Returns a list of (firewall, success, message).
+        """
+        with self._lock:
+            pending = [fw for fw, api in self.apis.items() if not api.api_key]
+            futures = [(fw, self._executor.submit(self.apis[fw].connect)) for fw in pending]
+            return [(fw, *future.result()) for fw, future in futures]
+
+    def run(self, action, filters=None):
+        """
+        Sends action (one of FLEET_ACTIONS) to every connected firewall at once.
+
+        ACTION_START first sets filters (a dict as for PaloAltoAPI.start_packet_capture) on every
+        firewall, then starts the capture in step only on those where that succeeded.
+        Returns one result dict per firewall with keys firewall, success, message, seconds (round
+        trip), offset (see the class docstring) and, on failure, failure (FAILURE_* kind).
+        """
+        if action not in FLEET_ACTIONS:
+            raise ValueError(f"Unknown fleet action {action!r}")
+        filters = filters or {}
+        with self._lock:
+            results = {fw: {"firewall": fw, "success": False, "message": "Not connected to firewall."}
+                       for fw, api in self.apis.items() if not api.api_key}
+            ready = [fw for fw in self.apis if fw not in results]
+            if action == ACTION_START and capture_filter_string(filters):
+                for result in self._run_step(ready, ACTION_FILTER, filters):
+                    if not result["success"]:
+                        results[result["firewall"]] = result
+                ready = [fw for fw in ready if fw not in results]
+            for result in self._run_step(ready, action, filters):
+                results[result["firewall"]] = result
+            return [results[fw] for fw in self.apis]
+
+    def _run_step(self, firewalls, action, filters):
+        if not firewalls:
+            return []
+        barrier = threading.Barrier(len(firewalls))
+        futures = [self._executor.submit(self._send, self.apis[fw], action, filters, barrier) for fw in firewalls]
+        results = [future.result() for future in futures]
+        applied = [r["applied_at"] for r in results if "applied_at" in r]
+        for result in results:
+            if "applied_at" in result:
+                result["offset"] = result.pop("applied_at") - min(applied)
+        return results
+
+    def _send(self, api, action, filters, barrier):
+        try:
+            barrier.wait(BARRIER_TIMEOUT)
+        except threading.BrokenBarrierError:
+            pass
+        stats = {}
+        success, message = self._command(api, action, filters, stats)
+        if not success and stats.get("failure") == FAILURE_AUTH:
+            api.invalidate_key(api.api_key)
+            if api.connect()[0]:
+                stats = {}
+                success, message = self._command(api, action, filters, stats)
+        result = {"firewall": api.hostname, "success": success, "message": message}
+        if "sent_at" in stats:
+            result["seconds"] = stats["seconds"]
+            result["applied_at"] = stats["sent_at"] + stats["seconds"] / 2
+        if not success:
+            result["failure"] = stats.get("failure")
+        return result
+
+    def _command(self, api, action, filters, stats):
+        if action == ACTION_FILTER:
+            return api.set_capture_filter(filters, stats)
+        if action == ACTION_START:
+            # The filter was already set in its own step, so that only the start itself is timed
+            return api.start_packet_capture("", {}, stats)
+        if action == ACTION_STOP:
+            return api.stop_packet_capture("", stats)
+        return api.clear_packet_capture("", stats)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for api in self.apis.values():
+            api.close()
+
+
+def skew(results):
+    """
+    Returns the largest offset between firewalls that ran a fleet action, in seconds, or None.
+    """
+    offsets = [r["offset"] for r in results if r["success"] and "offset" in r]
+    return max(offsets) if offsets else None
+
+
+def summarize(action, results):
+    """
+    Returns log lines describing a FleetController.run() result: one per firewall and a total.
+    """
+    lines = []
+    for r in results:
+        if r["success"] and "offset" in r:
+            lines.append(f"{r['firewall']}: {action} OK in {r['seconds'] * 1000:.0f} ms (+{r['offset'] * 1000:.0f} ms)")
+        else:
+            lines.append(f"{r['firewall']}: {r['message']}")
+    succeeded = sum(1 for r in results if r["success"])
+    total = f"Capture {action}: {succeeded}/{len(results)} firewalls"
+    spread = skew(results)
+    if spread is not None and succeeded > 1:
+        total += f", skew {spread * 1000:.0f} ms"
+    lines.append(total)
+    return lines
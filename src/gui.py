@@ -1,16 +1,52 @@
 # This file will contain the GUI code for the application. 
 
 import customtkinter
-from api_handler import PaloAltoAPI
+from api_handler import DEFAULT_POOL_SIZE
+from compression import COMPRESSION_MODES, check_compression
+from scheduler import FleetScheduler, OVERRUN_POLICIES
+from log_sink import LogSink, LOG_FORMATS
+from key_cache import KeyCache, check_key_cache
+from traffic_summary import TrafficSummary, check_traffic_summary, format_summary
+from live_stream import LIVE_FIFO, check_live
+from fleet_control import FleetController, ACTION_START, ACTION_STOP, ACTION_CLEAR, summarize
 import json
 import os
+import queue
 import threading
 import time
+from collections import deque
 from datetime import datetime
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 SETTINGS_FILE = os.path.join(os.path.dirname(__file__), '..', 'settings.json')
+KEY_CACHE_FILE = os.path.join(os.path.dirname(__file__), '..', 'api_keys.json')
+
+# UI refresh: worker events are drained and rendered in batches every UI_TICK_MS
+UI_TICK_MS = 100
+MAX_EVENTS_PER_TICK = 5000
+# Ring buffer sizes of the Advanced Log and Errors views
+LOG_MAX_LINES = 2000
+ERROR_MAX_LINES = 200
+# Modules only needed once a download or capture command starts (asyncio and requests). They are
+# not imported at startup, so the window appears sooner; after the first frame a background thread
+# imports them, so the first click does not wait for them either.
+DEFERRED_MODULES = ["download_engine", "requests"]
+
+def _preload_modules():
+    """
+    Imports DEFERRED_MODULES. Failures are left for the code that needs the module to report.
+    """
+    import importlib
+    _disable_tls_warnings()
+    for name in DEFERRED_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+def _disable_tls_warnings():
+    # Firewalls mostly have self-signed certificates, which the API calls do not verify
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 class App(customtkinter.CTk):
     def __init__(self):
@@ -75,6 +111,49 @@ class App(customtkinter.CTk):
         self.pass_label.grid(row=3, column=0, padx=20, pady=5, sticky="w")
         self.pass_entry = customtkinter.CTkEntry(self.main_frame, show="*")
         self.pass_entry.grid(row=3, column=1, padx=20, pady=5, sticky="ew")
+        self.pool_size_label = customtkinter.CTkLabel(self.main_frame, text="Connections per Firewall:")
+        self.pool_size_label.grid(row=4, column=0, padx=20, pady=5, sticky="w")
+        self.pool_size_entry = customtkinter.CTkEntry(self.main_frame, placeholder_text=f"e.g. {DEFAULT_POOL_SIZE}")
+        self.pool_size_entry.grid(row=4, column=1, padx=20, pady=5, sticky="ew")
+
+        # --- DOWNLOAD OPTIONS ---
+        self.options_label = customtkinter.CTkLabel(self.main_frame, text="Download Options:")
+        self.options_label.grid(row=5, column=0, padx=20, pady=5, sticky="w")
+        self.delta_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Only save packets new since the previous download")
+        self.delta_checkbox.grid(row=5, column=1, padx=20, pady=5, sticky="w")
+        self.merge_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Merge rx/tx/drp into one pcapng per download")
+        self.merge_checkbox.grid(row=6, column=1, padx=20, pady=5, sticky="w")
+        self.merge_rolling_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Append every download to one pcapng per firewall")
+        self.merge_rolling_checkbox.grid(row=7, column=1, padx=20, pady=5, sticky="w")
+        self.index_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Write a packet index next to every pcap (for queries)")
+        self.index_checkbox.grid(row=8, column=1, padx=20, pady=5, sticky="w")
+        self.compression_label = customtkinter.CTkLabel(self.main_frame, text="Compression:")
+        self.compression_label.grid(row=9, column=0, padx=20, pady=5, sticky="w")
+        self.compression_menu = customtkinter.CTkOptionMenu(self.main_frame, values=COMPRESSION_MODES)
+        self.compression_menu.set("none")
+        self.compression_menu.grid(row=9, column=1, padx=20, pady=5, sticky="w")
+
+        # --- SCHEDULING OPTIONS ---
+        self.stagger_label = customtkinter.CTkLabel(self.main_frame, text="Spread Firewall Start Over (sec):")
+        self.stagger_label.grid(row=10, column=0, padx=20, pady=5, sticky="w")
+        self.stagger_entry = customtkinter.CTkEntry(self.main_frame, placeholder_text="blank = spread over the interval")
+        self.stagger_entry.grid(row=10, column=1, padx=20, pady=5, sticky="ew")
+        self.jitter_label = customtkinter.CTkLabel(self.main_frame, text="Random Jitter (sec):")
+        self.jitter_label.grid(row=11, column=0, padx=20, pady=5, sticky="w")
+        self.jitter_entry = customtkinter.CTkEntry(self.main_frame, placeholder_text="e.g. 0")
+        self.jitter_entry.grid(row=11, column=1, padx=20, pady=5, sticky="ew")
+        self.overrun_label = customtkinter.CTkLabel(self.main_frame, text="If a Download Runs Late:")
+        self.overrun_label.grid(row=12, column=0, padx=20, pady=5, sticky="w")
+        self.overrun_menu = customtkinter.CTkOptionMenu(self.main_frame, values=OVERRUN_POLICIES)
+        self.overrun_menu.set(OVERRUN_POLICIES[0])
+        self.overrun_menu.grid(row=12, column=1, padx=20, pady=5, sticky="w")
+        self.log_format_label = customtkinter.CTkLabel(self.main_frame, text="Download Log Format:")
+        self.log_format_label.grid(row=13, column=0, padx=20, pady=5, sticky="w")
+        self.log_format_menu = customtkinter.CTkOptionMenu(self.main_frame, values=LOG_FORMATS)
+        self.log_format_menu.set(LOG_FORMATS[0])
+        self.log_format_menu.grid(row=13, column=1, padx=20, pady=5, sticky="w")
+        self.key_cache_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Remember API keys between runs (encrypted with the password)")
+        self.key_cache_checkbox.grid(row=14, column=1, padx=20, pady=5, sticky="w")
 
         # --- NEW CONTINUOUS DOWNLOAD CONTROLS ---
         self.project_name_label = customtkinter.CTkLabel(self.main_frame, text="Project Name:")
@@ -127,19 +206,68 @@ class App(customtkinter.CTk):
         self.protocol_entry = customtkinter.CTkEntry(self.main_frame, placeholder_text="e.g. TCP")
         self.max_packets_entry = customtkinter.CTkEntry(self.main_frame, placeholder_text="e.g. 10000")
 
+        # --- CAPTURE CONTROL (all firewalls at once, see fleet_control.FleetController) ---
+        self.capture_label = customtkinter.CTkLabel(self.main_frame, text="Capture Filter:")
+        self.capture_label.grid(row=23, column=0, padx=20, pady=5, sticky="w")
+        filter_fields = [("Source IP:", self.src_ip_entry), ("Destination IP:", self.dest_ip_entry),
+                         ("Source Port:", self.src_port_entry), ("Destination Port:", self.dest_port_entry),
+                         ("Protocol:", self.protocol_entry)]
+        for row, (text, entry) in enumerate(filter_fields, start=24):
+            customtkinter.CTkLabel(self.main_frame, text=text).grid(row=row, column=0, padx=(40, 20), pady=5, sticky="w")
+            entry.grid(row=row, column=1, padx=20, pady=5, sticky="ew")
+        self.start_capture_button = customtkinter.CTkButton(self.main_frame, text="Start Capture", command=self.start_capture_event)
+        self.start_capture_button.grid(row=29, column=0, padx=20, pady=15, sticky="ew")
+        self.stop_capture_button = customtkinter.CTkButton(self.main_frame, text="Stop Capture", command=self.stop_capture_event)
+        self.stop_capture_button.grid(row=29, column=1, padx=20, pady=15, sticky="ew")
+        self.clear_capture_button = customtkinter.CTkButton(self.main_frame, text="Clear Capture", command=self.clear_capture_event)
+        self.clear_capture_button.grid(row=29, column=2, padx=10, pady=15, sticky="ew")
+        self.rotate_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Rotate while downloading: stop, download, clear and restart the capture every interval")
+        self.rotate_checkbox.grid(row=30, column=0, columnspan=3, padx=20, pady=5, sticky="w")
+        self.traffic_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Analyze every download: packet rates, top talkers and ports in the Summary tab (needs numpy)")
+        self.traffic_checkbox.grid(row=31, column=0, columnspan=3, padx=20, pady=5, sticky="w")
+        self.live_checkbox = customtkinter.CTkCheckBox(self.main_frame, text="Stream new packets live to a named pipe per firewall in the save folder (e.g. wireshark -k -i <pipe>)")
+        self.live_checkbox.grid(row=32, column=0, columnspan=3, padx=20, pady=5, sticky="w")
+
         # --- LOGGING TABS ---
         self.log_tabview = customtkinter.CTkTabview(self.main_frame, width=700, height=180)
         self.log_tabview.grid(row=102, column=0, columnspan=5, padx=10, pady=(10, 0), sticky="ew")
         self.summary_tab = self.log_tabview.add("Summary")
         self.advanced_tab = self.log_tabview.add("Advanced Log")
+        self.errors_tab = self.log_tabview.add("Errors")
+        self.schedule_tab = self.log_tabview.add("Schedule")
         self.summary_textbox = customtkinter.CTkTextbox(self.summary_tab, width=680, height=160, state="disabled")
         self.summary_textbox.pack(fill="both", expand=True, padx=5, pady=5)
         self.advanced_textbox = customtkinter.CTkTextbox(self.advanced_tab, width=680, height=160, state="disabled")
         self.advanced_textbox.pack(fill="both", expand=True, padx=5, pady=5)
+        self.errors_textbox = customtkinter.CTkTextbox(self.errors_tab, width=680, height=160, state="disabled")
+        self.errors_textbox.pack(fill="both", expand=True, padx=5, pady=5)
+        self.schedule_textbox = customtkinter.CTkTextbox(self.schedule_tab, width=680, height=160, state="disabled")
+        self.schedule_textbox.pack(fill="both", expand=True, padx=5, pady=5)
         self._downloaded_count = 0
-        self._downloaded_errors = []
+        self._downloaded_errors = deque(maxlen=ERROR_MAX_LINES)
+        self._error_count = 0
         self._downloaded_total = 0
         self._downloaded_expected = 0
+        self._connection_stats = {}
+        self._transfer_totals = {}
+        self._traffic_summary = None
+        self._engine = None
+        self._metrics = None
+        self._key_cache = None
+        self._fleet = None
+        self._fleet_key = None
+        self._ui_queue = queue.SimpleQueue()
+        self._textbox_lines = {}
+        self._summary_dirty = False
+        self._summary_final = False
+        self._progress_value = None
+        self._progress_text = None
+
+        # About-text at the bottom of the app, below the status log
+        self.about_label = customtkinter.CTkLabel(self.main_frame, text="Palo Alto PCAP Downloader | Modern GUI | Developed by YourName 2024", font=customtkinter.CTkFont(size=12), text_color="#555")
+        self.about_label.grid(row=200, column=0, columnspan=5, padx=10, pady=(10, 10), sticky="ew")
+        self.after(UI_TICK_MS, self._ui_tick)
+        self.after_idle(self._start_preload)
 
         # Set default values
         self.api_handler = None
@@ -162,6 +290,21 @@ class App(customtkinter.CTk):
         import tkinter.messagebox
         tkinter.messagebox.showinfo("About", "Palo Alto PCAP Downloader\nModern GUI\nDeveloped by YourName\n2024")
 
+    def _get_key_cache(self):
+        """
+        Returns the API key cache shared by all connections of this window, backed by KEY_CACHE_FILE if enabled.
+        """
+        path = None
+        if self.key_cache_checkbox.get():
+            error = check_key_cache()
+            if error:
+                self.log_message(f"Warning: {error} API keys are only kept until the program exits.")
+            else:
+                path = KEY_CACHE_FILE
+        if self._key_cache is None or self._key_cache.path != path:
+            self._key_cache = KeyCache(path)
+        return self._key_cache
+
     def load_settings(self):
         try:
             with open(SETTINGS_FILE, 'r') as f:
@@ -179,51 +322,73 @@ class App(customtkinter.CTk):
         except Exception as e:
             self.log_message(f"Warning: Could not save settings: {e}")
 
-    def start_capture_event(self):
-        self.log_message("Start Capture button clicked!")
-        
-        firewall_ip = self.ip_entry.get()
+    # --- CAPTURE CONTROL ---
+    def _start_preload(self):
+        threading.Thread(target=_preload_modules, name="preload", daemon=True).start()
+
+    # Start/Stop/Clear Capture act on every firewall in the IP field at once, from a background
+    # thread; results come back through the UI queue.
+    def _get_fleet(self, firewall_ips, username, password):
+        """
+        Returns the FleetController for these firewalls and credentials, reusing the previous one (and its connections) if unchanged.
+        """
+        key = (tuple(firewall_ips), username, password)
+        if self._fleet is not None and self._fleet_key != key:
+            self._fleet.close()
+            self._fleet = None
+        if self._fleet is None:
+            self._fleet = FleetController(firewall_ips, username, password, key_cache=self._get_key_cache())
+            self._fleet_key = key
+        return self._fleet
+
+    def _run_capture_action(self, action):
+        firewall_ips = [ip.strip() for ip in self.ip_entry.get().split(',') if ip.strip()]
         username = self.user_entry.get()
         password = self.pass_entry.get()
-
-        if not all([firewall_ip, username, password]):
+        if not all([firewall_ips, username, password]):
             self.log_message("Error: Please fill in all firewall connection details.")
             return
-
-        self.log_message(f"Attempting to connect to {firewall_ip}...")
-        
-        self.api_handler = PaloAltoAPI(firewall_ip, username, password)
-        success, message = self.api_handler.connect()
-        
-        self.log_message(message)
-
-        if not success:
-            return
-
-        # Save last used IP and username
-        self.save_settings(firewall_ip, username)
-
-        # Collect filter options
-        stage_name = self.stage_name_entry.get()
         filters = {
-            "src_ip": self.src_ip_entry.get(),
-            "dest_ip": self.dest_ip_entry.get(),
-            "src_port": self.src_port_entry.get(),
-            "dest_port": self.dest_port_entry.get(),
-            "protocol": self.protocol_entry.get(),
-            "max_packets": self.max_packets_entry.get(),
+            "src_ip": self.src_ip_entry.get().strip(),
+            "dest_ip": self.dest_ip_entry.get().strip(),
+            "src_port": self.src_port_entry.get().strip(),
+            "dest_port": self.dest_port_entry.get().strip(),
+            "protocol": self.protocol_entry.get().strip(),
+            "max_packets": self.max_packets_entry.get().strip(),
         }
-        success, message = self.api_handler.start_packet_capture(stage_name, filters)
-        self.log_message(message)
+        # Widgets are only read on the Tk thread
+        ip_text = self.ip_entry.get()
+        fleet = self._get_fleet(firewall_ips, username, password)
+        # The single-firewall download_capture_event works on the first firewall
+        self.api_handler = fleet.apis[firewall_ips[0]]
+        for button in (self.start_capture_button, self.stop_capture_button, self.clear_capture_button):
+            button.configure(state="disabled")
+        self.log_message(f"Capture {action} on {len(firewall_ips)} firewall(s)...")
+
+        def worker():
+            try:
+                _disable_tls_warnings()
+                for firewall, success, message in fleet.connect():
+                    self.log_message(f"{firewall}: {message}")
+                if action == ACTION_START:
+                    self.save_settings(ip_text, username)
+                for line in summarize(action, fleet.run(action, filters)):
+                    self.log_message(line)
+            except Exception as e:
+                self.log_message(f"Error: Capture {action} failed: {e}")
+            finally:
+                self._ui_queue.put({"type": "capture_done"})
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def start_capture_event(self):
+        self._run_capture_action(ACTION_START)
 
     def stop_capture_event(self):
-        self.log_message("Stop Capture button clicked!")
-        if not self.api_handler:
-            self.log_message("Error: Not connected to firewall.")
-            return
-        stage_name = self.stage_name_entry.get()
-        success, message = self.api_handler.stop_packet_capture(stage_name)
-        self.log_message(message)
+        self._run_capture_action(ACTION_STOP)
+
+    def clear_capture_event(self):
+        self._run_capture_action(ACTION_CLEAR)
 
     def download_capture_event(self):
         self.log_message("Download Capture button clicked!")
@@ -237,12 +402,8 @@ class App(customtkinter.CTk):
         self.log_message(message)
 
     def log_message(self, message):
-        # Log to advanced log tab
-        if hasattr(self, 'advanced_textbox'):
-            self.advanced_textbox.configure(state="normal")
-            self.advanced_textbox.insert("end", message + "\n")
-            self.advanced_textbox.configure(state="disabled")
-            self.advanced_textbox.see("end")
+        # Log to advanced log tab (rendered by the UI tick, safe to call from any thread)
+        self._ui_queue.put({"type": "log", "message": message})
 
     def browse_save_dir(self):
         import tkinter.filedialog
@@ -254,19 +415,28 @@ class App(customtkinter.CTk):
     def start_continuous_download(self):
         # Reset download counters for a fresh run
         self._downloaded_count = 0
-        self._downloaded_errors = []
+        self._downloaded_errors.clear()
+        self._error_count = 0
         self._downloaded_expected = 0
+        self._connection_stats = {}
+        self._transfer_totals = {}
+        self._traffic_summary = None
+        self._summary_dirty = True
+        self._summary_final = False
         self.log_message("Starting continuous download...")
         self.start_dl_button.configure(state="disabled")
         self.stop_dl_button.configure(state="normal")
-        self._stop_download = threading.Event()
-        self.progress_bar.set(0)
         # Gather settings
         firewall_ips = [ip.strip() for ip in self.ip_entry.get().split(',') if ip.strip()]
         username = self.user_entry.get()
         password = self.pass_entry.get()
         project_name = self.project_name_entry.get().strip() or "Project"
         save_dir = self.save_dir_entry.get().strip() or os.getcwd()
+        if not firewall_ips:
+            self.log_message("Error: No firewall IPs given.")
+            self.start_dl_button.configure(state="normal")
+            self.stop_dl_button.configure(state="disabled")
+            return
         try:
             count = int(self.count_entry.get())
         except Exception:
@@ -274,6 +444,32 @@ class App(customtkinter.CTk):
             self.start_dl_button.configure(state="normal")
             self.stop_dl_button.configure(state="disabled")
             return
+        try:
+            pool_size = int(self.pool_size_entry.get() or DEFAULT_POOL_SIZE)
+            if pool_size < 1:
+                raise ValueError
+        except Exception:
+            self.log_message("Error: Connections per firewall must be a positive number.")
+            self.start_dl_button.configure(state="normal")
+            self.stop_dl_button.configure(state="disabled")
+            return
+        compression = self.compression_menu.get()
+        error = check_compression(compression)
+        if error:
+            self.log_message(f"Error: {error}")
+            self.start_dl_button.configure(state="normal")
+            self.stop_dl_button.configure(state="disabled")
+            return
+        try:
+            stagger = float(self.stagger_entry.get()) if self.stagger_entry.get().strip() else None
+            jitter = float(self.jitter_entry.get() or 0)
+            if (stagger is not None and stagger < 0) or jitter < 0:
+                raise ValueError
+        except Exception:
+            self.log_message("Error: Start spread and jitter must be non-negative numbers of seconds.")
+            self.start_dl_button.configure(state="normal")
+            self.stop_dl_button.configure(state="disabled")
+            return
         minutes = int(self.minutes_slider.get())
         seconds = int(self.seconds_slider.get())
         interval = minutes * 60 + seconds
@@ -282,121 +478,224 @@ class App(customtkinter.CTk):
             self.start_dl_button.configure(state="normal")
             self.stop_dl_button.configure(state="disabled")
             return
-        # Start a thread for each firewall
-        self._firewall_threads = []
-        for fw_ip in firewall_ips:
-            t = threading.Thread(target=self._continuous_download_loop_multi_fw, args=(fw_ip, username, password, project_name, save_dir, count, interval), daemon=True)
-            t.start()
-            self._firewall_threads.append(t)
+        rotate = bool(self.rotate_checkbox.get())
+        if rotate and self.delta_checkbox.get():
+            self.log_message("Error: Rotation already downloads only new packets, turn off the delta option.")
+            self.start_dl_button.configure(state="normal")
+            self.stop_dl_button.configure(state="disabled")
+            return
+        live = bool(self.live_checkbox.get())
+        if live:
+            error = check_live(LIVE_FIFO)
+            if error:
+                self.log_message(f"Error: {error}")
+                self.start_dl_button.configure(state="normal")
+                self.stop_dl_button.configure(state="disabled")
+                return
+        traffic_summary = None
+        if self.traffic_checkbox.get():
+            error = check_traffic_summary()
+            if error:
+                self.log_message(f"Error: {error}")
+                self.start_dl_button.configure(state="normal")
+                self.stop_dl_button.configure(state="disabled")
+                return
+            traffic_summary = TrafficSummary(save_dir, project_name)
+        # Submit one job per firewall to a shared download engine
+        from download_engine import DownloadEngine, file_types_for
+        _disable_tls_warnings()
+        self._engine = DownloadEngine(scheduler=FleetScheduler(stagger, jitter, self.overrun_menu.get()),
+                                      log_sink=LogSink(self.log_format_menu.get()), key_cache=self._get_key_cache(),
+                                      traffic_summary=traffic_summary)
+        self._metrics = self._engine.metrics
+        # Events carry their engine, so late events of a replaced engine can be told apart
+        self._engine.subscribe(lambda event, engine=self._engine: self._ui_queue.put(dict(event, engine=engine)))
+        # "finished" is held back until every firewall has been submitted
+        with self._engine.submitting():
+            for fw_ip in firewall_ips:
+                self._downloaded_expected += count * len(file_types_for({"rotate": rotate}))
+                self._engine.submit({
+                    "firewall": fw_ip,
+                    "username": username,
+                    "password": password,
+                    "project_name": project_name,
+                    "save_dir": save_dir,
+                    "count": count,
+                    "interval": interval,
+                    "pool_size": pool_size,
+                    "delta": bool(self.delta_checkbox.get()),
+                    "merge": bool(self.merge_checkbox.get()),
+                    "merge_rolling": bool(self.merge_rolling_checkbox.get()),
+                    "index": bool(self.index_checkbox.get()),
+                    "rotate": rotate,
+                    "compression": compression,
+                    "live_dir": save_dir if live else None,
+                })
+        self.after(0, self._tick_schedule)
 
     def stop_continuous_download(self):
-        self.log_message("Stopping continuous download...")
-        if hasattr(self, '_stop_download'):
-            self._stop_download.set()
-        self.start_dl_button.configure(state="normal")
+        # Start stays disabled until the engine's "finished" event: downloads in flight still write to the project
+        self.log_message("Stopping continuous download after the downloads in progress...")
         self.stop_dl_button.configure(state="disabled")
+        if getattr(self, '_engine', None):
+            self._engine.stop()
+        else:
+            self.start_dl_button.configure(state="normal")
 
-    def _write_log(self, log_file, message):
-        try:
-            with open(log_file, "a", encoding="utf-8") as f:
-                f.write(message + "\n")
-        except Exception as e:
-            self.log_message(f"Warning: Could not write to log file: {e}")
-
-    # Make the progress bar green and update smoothly
-    def _smooth_progress_bar(self, duration, stop_event):
-        steps = int(duration * 20)  # 20 updates per second
-        for j in range(steps):
-            if stop_event.is_set():
-                break
-            self.progress_bar.set((j + 1) / steps)
-            time.sleep(1 / 20)
-        self.progress_bar.set(0)
-
-    def _continuous_download_loop_multi_fw(self, firewall_ip, username, password, project_name, save_dir, count, interval):
-        self._downloaded_expected += count * 3  # 3 files per download per firewall
-        local_count = 0
-        local_errors = []
-        api_handler = PaloAltoAPI(firewall_ip, username, password)
-        self.log_message(f"Connecting to {firewall_ip}...")
-        success, message = api_handler.connect()
-        self.log_message(f"{firewall_ip}: {message}")
-        if not success:
-            local_errors.append(f"{firewall_ip}: {message}")
-            self._downloaded_errors.append(f"{firewall_ip}: {message}")
-            self._update_summary()
-            return
-        log_file = os.path.join(save_dir, f"{project_name}_{firewall_ip}_download.log")
-        for i in range(count):
-            if self._stop_download.is_set():
-                self.log_message(f"{firewall_ip}: Download stopped by user.")
-                self._write_log(log_file, "Download stopped by user.")
-                break
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filenames = {ftype: os.path.join(save_dir, f"{project_name}_{timestamp}_{firewall_ip}_{ftype}.pcap") for ftype in ["rx", "tx", "drp"]}
-            threads = []
-            results = {}
-            def download_file(ftype):
-                fw = getattr(api_handler, 'fw', None)
-                if not api_handler or fw is None:
-                    results[ftype] = (False, "Not connected to firewall.")
-                    return
-                api_key = fw.api_key
-                hostname = api_handler.hostname
-                fname = f"{ftype}.pcap"
-                save_path = filenames[ftype]
-                from api_handler import download_filtered_pcap
-                success, msg = download_filtered_pcap(hostname, api_key, fname, save_path)
-                results[ftype] = (success, msg)
-            for ftype in ["rx", "tx", "drp"]:
-                t = threading.Thread(target=download_file, args=(ftype,))
-                threads.append(t)
-                t.start()
-            for t in threads:
-                t.join()
-            for ftype in ["rx", "tx", "drp"]:
-                success, msg = results.get(ftype, (False, "No result."))
-                log_entry = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {firewall_ip} {ftype.upper()}: {msg}"
-                self.log_message(log_entry)
-                self._write_log(log_file, log_entry)
-                if success:
-                    self._downloaded_count += 1
-                    local_count += 1
+    # Schedule tab lists each firewall's next download time, refreshed once a second
+    def _tick_schedule(self):
+        engine = getattr(self, '_engine', None)
+        lines = []
+        if engine is not None:
+            now = engine.now()
+            for firewall, (_, deadline) in sorted(engine.next_run.items(), key=lambda item: item[1][1]):
+                if deadline > now:
+                    wall_clock = datetime.fromtimestamp(time.time() + deadline - now).strftime('%H:%M:%S')
+                    line = f"{firewall}: next download in {deadline - now:.0f} s (at {wall_clock})"
                 else:
-                    self._downloaded_errors.append(log_entry)
-                    local_errors.append(log_entry)
-                self._update_summary()
-            if i < count - 1:
-                stop_event = self._stop_download
-                t = threading.Thread(target=self._smooth_progress_bar, args=(interval, stop_event))
-                t.start()
-                t.join()
-        self.log_message(f"{firewall_ip}: Continuous download finished.")
-        self._write_log(log_file, "Continuous download finished.")
-        self.start_dl_button.configure(state="normal")
-        self.stop_dl_button.configure(state="disabled")
-        self._update_summary(final=True)
+                    line = f"{firewall}: downloading"
+                limiter = engine.limiters.get(firewall)
+                if limiter is not None:
+                    line += f" - limit {limiter.describe()}"
+                lines.append(line)
+        self.schedule_textbox.configure(state="normal")
+        self.schedule_textbox.delete("1.0", "end")
+        self.schedule_textbox.insert("end", "\n".join(lines) or "No downloads scheduled.")
+        self.schedule_textbox.configure(state="disabled")
+        if engine is not None:
+            self.after(1000, self._tick_schedule)
+
+    # --- UI UPDATE QUEUE ---
+    # Worker threads never touch widgets: they put events on self._ui_queue, which this tick drains
+    # on the Tk thread in batches, rendering each widget at most once per tick.
+    def _ui_tick(self):
+        new_log_lines = []
+        new_errors = []
+        for _ in range(MAX_EVENTS_PER_TICK):
+            try:
+                event = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._handle_event(event, new_log_lines, new_errors)
+        if new_log_lines:
+            self._append_lines(self.advanced_textbox, new_log_lines, LOG_MAX_LINES)
+        if new_errors:
+            self._append_lines(self.errors_textbox, new_errors, ERROR_MAX_LINES)
+        if self._summary_dirty:
+            self._update_summary(final=self._summary_final)
+        self._update_progress()
+        self.after(UI_TICK_MS, self._ui_tick)
+
+    def _handle_event(self, event, new_log_lines, new_errors):
+        kind = event["type"]
+        if "message" in event:
+            new_log_lines.append(event["message"])
+        failed = kind in ("connect", "file", "merged", "rotation") and not event["success"]
+        if failed:
+            self._error_count += 1
+            self._downloaded_errors.append(event["message"])
+            new_errors.append(event["message"])
+            self._summary_dirty = True
+        if kind == "file" and event["success"]:
+            self._downloaded_count += 1
+            for key, value in (event.get("stats") or {}).items():
+                self._transfer_totals[key] = self._transfer_totals.get(key, 0) + value
+            self._summary_dirty = True
+        elif kind == "traffic":
+            self._traffic_summary = event["summary"]
+            self._summary_dirty = True
+        elif kind == "firewall_done":
+            if event["stats"]:
+                self._connection_stats[event["firewall"]] = event["stats"]
+        elif kind == "capture_done":
+            for button in (self.start_capture_button, self.stop_capture_button, self.clear_capture_button):
+                button.configure(state="normal")
+        elif kind == "finished":
+            if event["engine"] is not self._engine:
+                return
+            engine, self._engine = self._engine, None
+            self.stop_dl_button.configure(state="disabled")
+            self._summary_dirty = True
+            self._summary_final = True
+            # shutdown() joins the engine's threads and worker processes, so it must not run on the Tk thread
+            threading.Thread(target=self._shutdown_engine, args=(engine,), daemon=True).start()
+        elif kind == "engine_closed":
+            if self._engine is None:
+                self.start_dl_button.configure(state="normal")
+
+    def _shutdown_engine(self, engine):
+        try:
+            engine.shutdown()
+        finally:
+            self._ui_queue.put({"type": "engine_closed", "engine": engine})
+
+    def _append_lines(self, textbox, lines, max_lines):
+        """
+        Appends lines to a textbox used as a ring buffer of at most max_lines lines.
+        """
+        lines = lines[-max_lines:]
+        textbox.configure(state="normal")
+        textbox.insert("end", "\n".join(lines) + "\n")
+        count = self._textbox_lines.get(textbox, 0) + len(lines)
+        if count > max_lines:
+            textbox.delete("1.0", f"{count - max_lines + 1}.0")
+            count = max_lines
+        self._textbox_lines[textbox] = count
+        textbox.configure(state="disabled")
+        textbox.see("end")
+
+    # One progress display for the whole fleet: time until the next scheduled download
+    def _update_progress(self):
+        engine = self._engine
+        text = "Time until next download:"
+        value = 0
+        if engine is not None:
+            now = engine.now()
+            waits = [w for w in engine.next_run.values() if w[1] > now]
+            if waits:
+                started, deadline = min(waits, key=lambda w: w[1])
+                duration = deadline - started
+                value = min((now - started) / duration, 1) if duration > 0 else 1
+                text = f"Next download in {deadline - now:.0f} s:"
+        if value != self._progress_value:
+            self.progress_bar.set(value)
+            self._progress_value = value
+        if text != self._progress_text:
+            self.progress_label.configure(text=text)
+            self._progress_text = text
 
     def _update_summary(self, final=False):
-        if not hasattr(self, 'summary_textbox'):
-            return
+        self._summary_dirty = False
         self.summary_textbox.configure(state="normal")
         self.summary_textbox.delete("1.0", "end")
-        self.summary_textbox.insert("end", f"Files downloaded so far: {self._downloaded_count} / {self._downloaded_expected}\n")
-        if self._downloaded_errors:
-            self.summary_textbox.insert("end", f"Errors so far: {len(self._downloaded_errors)}\n")
+        lines = [f"Files downloaded so far: {self._downloaded_count} / {self._downloaded_expected}"]
+        if self._error_count:
+            lines.append(f"Errors so far: {self._error_count} (see the Errors tab)")
+        totals = self._transfer_totals
+        if totals.get("seconds"):
+            lines.append(f"Download throughput: {totals['bytes_received'] / totals['seconds'] / 1e6:.1f} MB/s")
+        if totals.get("bytes_stored") and totals["bytes_stored"] != totals["bytes_written"]:
+            lines.append(f"Compression: {totals['bytes_written'] / totals['bytes_stored']:.1f}x "
+                         f"({totals['bytes_written'] / 1e6:.1f} MB -> {totals['bytes_stored'] / 1e6:.1f} MB)")
+        latency = self._metrics.latency_summary() if self._metrics else []
+        if latency:
+            lines.append("Latency: " + "; ".join(latency))
+        if self._traffic_summary:
+            lines.extend(format_summary(self._traffic_summary))
         if final:
-            self.summary_textbox.insert("end", "\n--- SUMMARY ---\n")
-            self.summary_textbox.insert("end", f"Total files downloaded: {self._downloaded_count}\n")
+            lines.append("\n--- SUMMARY ---")
+            lines.append(f"Total files downloaded: {self._downloaded_count}")
+            if self._connection_stats:
+                total_requests = sum(s['requests'] for s in self._connection_stats.values())
+                total_reused = sum(s['connections_reused'] for s in self._connection_stats.values())
+                lines.append(f"HTTP requests: {total_requests}, connections reused: {total_reused}")
             if self._downloaded_errors:
-                self.summary_textbox.insert("end", "Errors encountered:\n")
-                for err in self._downloaded_errors:
-                    self.summary_textbox.insert("end", err + "\n")
+                lines.append("Errors encountered:")
+                if self._error_count > len(self._downloaded_errors):
+                    lines.append(f"({self._error_count - len(self._downloaded_errors)} earlier errors not shown)")
+                lines.extend(self._downloaded_errors)
             else:
-                self.summary_textbox.insert("end", "No errors encountered.\n")
+                lines.append("No errors encountered.")
+        self.summary_textbox.insert("end", "\n".join(lines) + "\n")
         self.summary_textbox.configure(state="disabled")
         self.summary_textbox.see("end")
-
-        # Move about-text to the bottom of the app, below the status log
-        self.about_label = customtkinter.CTkLabel(self.main_frame, text="Palo Alto PCAP Downloader | Modern GUI | Developed by YourName 2024", font=customtkinter.CTkFont(size=12), text_color="#555")
-        self.about_label.grid(row=200, column=0, columnspan=5, padx=10, pady=(10, 10), sticky="ew") 
\ No newline at end of file
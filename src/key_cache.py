@@ -0,0 +1,141 @@
+# This file caches firewall API keys in memory and, optionally, in an encrypted file reused across runs.
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+
+KEY_CACHE_VERSION = 1
+SALT_SIZE = 16
+
+
+def check_key_cache():
+    """
+    Returns None if encrypted key cache files can be used, or an error message.
+    """
+    try:
+        import cryptography  # noqa: F401
+    except ImportError:
+        return "An encrypted API key cache file requires the cryptography package (pip install cryptography)."
+    return None
+
+
+def _fernet(password, salt):
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    key = Scrypt(salt=salt, length=32, n=2 ** 14, r=8, p=1).derive(password.encode("utf-8"))
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+class KeyCache:
+    """
+    Thread-safe map of (hostname, username) to API key.
+
+    Keys always live in memory for the lifetime of the process, together with a keyed digest of the
+    password they were generated with, so a different password never gets them. With a path, they are also stored
+    in a JSON file so later runs skip key generation. Each key in the file is encrypted with a
+    Fernet key derived (scrypt) from the password it was generated with: the file is useless
+    without the firewall password, and a changed password simply reads as a cache miss. The file
+    is written atomically with owner-only permissions.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._keys = {}  # (hostname, username) -> (API key, password digest)
+        self._secret = os.urandom(SALT_SIZE)  # keys the in-memory password digests
+        self._lock = threading.Lock()
+        self._ciphers = {}  # password -> Fernet, so one scrypt derivation serves a whole fleet
+        self._salt = None
+        self._entries = {}  # "username@hostname" -> encrypted token from the file
+        if path:
+            self._load()
+
+    def __repr__(self):
+        return f"KeyCache(path={self.path!r}, entries={len(self._keys)})"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == KEY_CACHE_VERSION:
+                self._salt = base64.b64decode(data["salt"])
+                self._entries = dict(data.get("entries", {}))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            # A corrupt cache is discarded; keys are regenerated and the file rewritten
+            self._entries = {}
+        if self._salt is None:
+            self._salt = os.urandom(SALT_SIZE)
+
+    def _cipher(self, password):
+        cipher = self._ciphers.get(password)
+        if cipher is None:
+            cipher = self._ciphers[password] = _fernet(password, self._salt)
+        return cipher
+
+    def _digest(self, password):
+        return hashlib.blake2b(password.encode("utf-8"), key=self._secret, digest_size=32).digest()
+
+    def get(self, hostname, username, password):
+        """
+        Returns the cached API key or None. A key cached with a different password is a miss.
+        """
+        digest = self._digest(password)
+        with self._lock:
+            cached = self._keys.get((hostname, username))
+            if cached is not None and hmac.compare_digest(cached[1], digest):
+                return cached[0]
+            if not self.path:
+                return None
+            token = self._entries.get(f"{username}@{hostname}")
+            if token is None:
+                return None
+            try:
+                key = self._cipher(password).decrypt(token.encode("ascii")).decode("utf-8")
+            except Exception:
+                return None
+            self._keys[(hostname, username)] = (key, digest)
+            return key
+
+    def put(self, hostname, username, password, key):
+        """
+        Stores a key. Returns an error message if the cache file could not be written, else None.
+        """
+        digest = self._digest(password)
+        with self._lock:
+            self._keys[(hostname, username)] = (key, digest)
+            if not self.path:
+                return None
+            self._entries[f"{username}@{hostname}"] = self._cipher(password).encrypt(key.encode("utf-8")).decode("ascii")
+            return self._save()
+
+    def discard(self, hostname, username, key=None):
+        """
+        Forgets a key (only if it still equals key, when given), e.g. after the firewall rejected it.
+        """
+        with self._lock:
+            cached = self._keys.get((hostname, username))
+            if key is not None and cached is not None and cached[0] != key:
+                return None
+            self._keys.pop((hostname, username), None)
+            if self.path and self._entries.pop(f"{username}@{hostname}", None) is not None:
+                return self._save()
+            return None
+
+    def _save(self):
+        data = {
+            "version": KEY_CACHE_VERSION,
+            "salt": base64.b64encode(self._salt).decode("ascii"),
+            "entries": self._entries,
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            return f"Warning: Could not write API key cache {self.path}: {e}"
+        return None
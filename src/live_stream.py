@@ -0,0 +1,349 @@
+# This file streams newly captured packets to live consumers (Wireshark, Zeek, tcpdump) through a named pipe or unix socket.
+import collections
+import errno
+import os
+import selectors
+import socket
+import stat
+import threading
+
+from pcap_stream import DeltaExtractor, PcapStreamParser, parse_global_header
+
+LIVE_FIFO = "fifo"      # named pipe: one reader at a time, e.g. wireshark -k -i <path>
+LIVE_SOCKET = "socket"  # unix socket: any number of readers, e.g. socat - UNIX-CONNECT:<path> | zeek -r -
+LIVE_MODES = [LIVE_FIFO, LIVE_SOCKET]
+LIVE_SUFFIXES = {LIVE_FIFO: ".pcap", LIVE_SOCKET: ".pcap.sock"}
+
+DEFAULT_LIVE_INTERVAL = 1.0
+# Bytes queued per consumer; while a consumer is this far behind, new packets are dropped for it alone
+DEFAULT_CONSUMER_BUFFER = 16 * 1024 * 1024
+WRITE_CHUNK = 256 * 1024
+FIFO_RETRY = 0.5  # seconds between checks for a reader on the named pipe
+
+
+def check_live(mode):
+    """
+    Returns None if live streaming in mode can be used on this platform, or an error message.
+    """
+    if mode not in LIVE_MODES:
+        return f"Unknown live mode {mode!r} (choose from {', '.join(LIVE_MODES)})."
+    if mode == LIVE_FIFO and not hasattr(os, "mkfifo"):
+        return "Named pipes are not available on this platform."
+    if mode == LIVE_SOCKET and not hasattr(socket, "AF_UNIX"):
+        return "Unix sockets are not available on this platform."
+    return None
+
+
+def live_path_for(live_dir, project_name, firewall, mode=LIVE_FIFO):
+    return os.path.join(live_dir, f"{project_name}_{firewall}_live{LIVE_SUFFIXES[mode]}")
+
+
+class LiveExtractor:
+    """
+    Download transform for one live poll of a capture file: keeps the records that are new since
+    the previous poll (see pcap_stream.DeltaExtractor) in records and stores nothing. With
+    emit=False the poll only takes the baseline, so a stream starts with the packets captured
+    after it was opened rather than the whole capture so far.
+    """
+
+    def __init__(self, state, emit=True):
+        self.delta = DeltaExtractor(state)
+        self.emit = emit
+        self.records = []
+        self._parser = PcapStreamParser()
+
+    @property
+    def header(self):
+        return self.delta.parser.header
+
+    @property
+    def mismatch(self):
+        return self.delta.mismatch
+
+    def feed(self, chunk):
+        data = self.delta.feed(chunk)
+        if data and self.emit:
+            self.records.extend(record for _, record in self._parser.feed(data))
+        return b""
+
+    def finish(self):
+        self.delta.finish()
+        return b""
+
+    def commit(self):
+        self.delta.commit()
+
+    def timestamp(self, record):
+        return self.delta.parser.record_timestamp(record)
+
+
+class _Consumer:
+    def __init__(self, name, fd=None, sock=None):
+        self.name = name
+        self.fd = fd
+        self.sock = sock
+        self.queue = collections.deque()
+        self.pending = b""  # rest of a partially written chunk
+        self.buffered = 0
+        self.dropped = 0
+        self.dropping = False
+
+    def fileno(self):
+        return self.sock.fileno() if self.sock is not None else self.fd
+
+    def send(self, data):
+        return self.sock.send(data) if self.sock is not None else os.write(self.fd, data)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        else:
+            os.close(self.fd)
+
+
+class LiveStream:
+    """
+    One live pcap stream at path: a named pipe (mode LIVE_FIFO) or a unix socket (LIVE_SOCKET).
+
+    Every consumer first gets the pcap global header, then the records passed to push() from the
+    moment it connected. Consumers are served by one background thread with non-blocking writes;
+    push() only appends to each consumer's queue, so a slow or stalled reader never blocks the
+    downloader. A queue holds at most max_buffer bytes: beyond that whole records are dropped for
+    that consumer (the stream stays valid pcap) and the drops are logged. A reader that goes away
+    is dropped; the next one to open the pipe or connect gets a fresh header.
+
+    The first header pushed defines the stream; records pushed with a header of a different byte
+    order, time resolution or link type are dropped. The pipe or socket is created with mode
+    0600 (captures are sensitive) and removed by close(). Stale pipes and sockets at path are
+    replaced, any other file there is an error.
+    """
+
+    def __init__(self, path, mode=LIVE_FIFO, max_buffer=DEFAULT_CONSUMER_BUFFER, on_log=None):
+        error = check_live(mode)
+        if error:
+            raise ValueError(error)
+        self.path = path
+        self.mode = mode
+        self.max_buffer = max_buffer
+        self.on_log = on_log
+        self.header = None
+        self.packets = 0     # records pushed
+        self.mismatched = 0  # records dropped for all consumers because of a different global header
+        self._format = None
+        self._consumers = []
+        self._connected = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._remove_stale()
+        self._selector = selectors.DefaultSelector()
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, None)
+        self._server = None
+        if mode == LIVE_FIFO:
+            os.mkfifo(path, 0o600)
+        else:
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(path)
+            os.chmod(path, 0o600)
+            self._server.listen()
+            self._server.setblocking(False)
+            self._selector.register(self._server, selectors.EVENT_READ, "accept")
+        self._thread = threading.Thread(target=self._run, name="pcap-live", daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"LiveStream(path={self.path!r}, mode={self.mode!r}, consumers={len(self._consumers)})"
+
+    @property
+    def consumers(self):
+        return len(self._consumers)
+
+    def _remove_stale(self):
+        try:
+            st = os.lstat(self.path)
+        except FileNotFoundError:
+            return
+        if not (stat.S_ISFIFO(st.st_mode) or stat.S_ISSOCK(st.st_mode)):
+            raise ValueError(f"{self.path} exists and is not a named pipe or socket")
+        os.remove(self.path)
+
+    # --- DOWNLOADER SIDE ---
+    def push(self, header, records):
+        """
+        Queues complete pcap records (each with its 16-byte record header) for every consumer. Never blocks on consumers.
+        """
+        wake = bool(records)
+        with self._lock:
+            if self._closed:
+                return
+            if self._format is None:
+                self.header = bytes(header)
+                self._format = parse_global_header(header)[:3]
+                for consumer in self._consumers:
+                    self._enqueue(consumer, self.header, force=True)
+                wake = wake or bool(self._consumers)
+            elif parse_global_header(header)[:3] != self._format:
+                if records and not self.mismatched:
+                    self._log("Capture file format differs from the stream's pcap header, dropping its packets.")
+                self.mismatched += len(records)
+                return
+            for consumer in self._consumers:
+                for record in records:
+                    self._enqueue(consumer, record)
+            self.packets += len(records)
+        if wake:
+            self._wake()
+
+    def _enqueue(self, consumer, data, force=False):
+        if not force and consumer.buffered + len(data) > self.max_buffer:
+            consumer.dropped += 1
+            if not consumer.dropping:
+                consumer.dropping = True
+                self._log(f"{consumer.name} is not keeping up, dropping packets for it.")
+            return
+        consumer.queue.append(data)
+        consumer.buffered += len(data)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    # --- CONSUMER SIDE (background thread) ---
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                consumers = list(self._consumers)
+                for consumer in consumers:
+                    events = selectors.EVENT_READ
+                    if consumer.pending or consumer.queue:
+                        events |= selectors.EVENT_WRITE
+                    self._selector.modify(consumer.fileno(), events, consumer)
+            waiting = self.mode == LIVE_FIFO and not consumers
+            for key, mask in self._selector.select(FIFO_RETRY if waiting else None):
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_read, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.data == "accept":
+                    self._accept()
+                elif key.data in self._consumers:
+                    consumer = key.data
+                    if mask & selectors.EVENT_READ and not self._alive(consumer):
+                        self._drop(consumer)
+                    elif mask & selectors.EVENT_WRITE and not self._flush(consumer):
+                        self._drop(consumer)
+            if waiting:
+                self._open_fifo()
+
+    def _open_fifo(self):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            # ENXIO: nobody has the pipe open for reading yet
+            if e.errno != errno.ENXIO:
+                self._log(f"Could not open {self.path}: {e}")
+            return
+        self._add(_Consumer("Reader", fd=fd))
+
+    def _accept(self):
+        try:
+            sock, _ = self._server.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        self._add(_Consumer(f"Consumer {self._connected + 1}", sock=sock))
+
+    def _add(self, consumer):
+        with self._lock:
+            self._connected += 1
+            if self.header is not None:
+                self._enqueue(consumer, self.header, force=True)
+            self._consumers.append(consumer)
+            self._selector.register(consumer.fileno(), selectors.EVENT_READ, consumer)
+        self._log(f"{consumer.name} connected to {self.path}.")
+
+    def _alive(self, consumer):
+        """
+        Handles a readable consumer: returns False if it has gone away.
+        """
+        if consumer.sock is None:
+            # A pipe's write end only becomes "readable" with an error: the reader closed it
+            return False
+        try:
+            # Consumers are not expected to send anything; whatever they send is discarded
+            return bool(consumer.sock.recv(4096))
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _flush(self, consumer):
+        """
+        Writes queued data until the consumer would block. Returns False if it has gone away.
+        """
+        while True:
+            if not consumer.pending:
+                with self._lock:
+                    if not consumer.queue:
+                        if consumer.dropping:
+                            consumer.dropping = False
+                            self._log(f"{consumer.name} caught up ({consumer.dropped} packets dropped so far).")
+                        return True
+                    parts = []
+                    size = 0
+                    while consumer.queue and size < WRITE_CHUNK:
+                        part = consumer.queue.popleft()
+                        parts.append(part)
+                        size += len(part)
+                    consumer.buffered -= size
+                consumer.pending = memoryview(b"".join(parts))
+            try:
+                written = consumer.send(consumer.pending)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            consumer.pending = consumer.pending[written:]
+
+    def _drop(self, consumer):
+        with self._lock:
+            self._consumers.remove(consumer)
+            self._selector.unregister(consumer.fileno())
+        consumer.close()
+        dropped = f" ({consumer.dropped} packets dropped for it)" if consumer.dropped else ""
+        self._log(f"{consumer.name} disconnected from {self.path}{dropped}.")
+
+    def _log(self, message):
+        if self.on_log is not None:
+            self.on_log(f"Live stream: {message}")
+
+    def close(self):
+        """
+        Disconnects all consumers and removes the pipe or socket. Safe to call more than once.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake()
+        self._thread.join()
+        for consumer in self._consumers:
+            consumer.close()
+        self._consumers = []
+        if self._server is not None:
+            self._server.close()
+        self._selector.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,135 @@
+# This file writes the per-firewall download logs from a background thread with batched flushes.
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+
+LOG_FORMATS = ["text", "json"]
+
+# Flush a file once this many bytes are buffered for it, or after FLUSH_INTERVAL seconds
+DEFAULT_FLUSH_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+_STOP = object()
+
+
+def log_path_for(base_path, fmt):
+    """
+    Returns the log file name for a format: JSON lines logs use .jsonl instead of .log.
+    """
+    if fmt == "json" and base_path.endswith(".log"):
+        return base_path[:-len(".log")] + ".jsonl"
+    return base_path
+
+
+class LogSink:
+    """
+    Background writer for download logs.
+
+    write() only enqueues. A single thread keeps one open handle per log file, collects lines and
+    writes/flushes each file when its buffer passes flush_bytes or every flush_interval seconds.
+    close() (also registered with atexit) flushes everything and closes the handles.
+
+    In "text" format each entry is the plain message line. In "json" format each entry is one
+    JSON object per line with timestamp, firewall, file_type, bytes, duration, status and message.
+    """
+
+    def __init__(self, fmt="text", flush_bytes=DEFAULT_FLUSH_BYTES, flush_interval=DEFAULT_FLUSH_INTERVAL, on_error=None):
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format {fmt!r}")
+        self.format = fmt
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._buffers = {}
+        self._sizes = {}
+        self._failed = set()
+        self._thread = threading.Thread(target=self._run, name="pcap-log-sink", daemon=True)
+        self._closed = False
+        self._thread.start()
+        atexit.register(self.close)
+
+    def path_for(self, base_path):
+        return log_path_for(base_path, self.format)
+
+    def write(self, log_file, message, firewall=None, file_type=None, size=None, duration=None, status=None):
+        """
+        Queues a log entry for log_file (a .log path; the JSON format writes to the matching .jsonl).
+        """
+        if self._closed:
+            return
+        if self.format == "json":
+            line = json.dumps({
+                "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+                "firewall": firewall,
+                "file_type": file_type,
+                "bytes": size,
+                "duration": round(duration, 3) if duration is not None else None,
+                "status": status,
+                "message": message,
+            })
+        else:
+            line = message
+        self._queue.put((self.path_for(log_file), line + "\n"))
+
+    def close(self):
+        """
+        Flushes all pending entries and closes every log file. Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                path, line = item
+                self._buffers.setdefault(path, []).append(line)
+                self._sizes[path] = self._sizes.get(path, 0) + len(line)
+                if self._sizes[path] >= self.flush_bytes:
+                    self._flush(path)
+            if time.monotonic() >= next_flush:
+                for path in list(self._buffers):
+                    self._flush(path)
+                next_flush = time.monotonic() + self.flush_interval
+        # Drain anything queued before the stop marker arrived
+        for path in list(self._buffers):
+            self._flush(path)
+        for f in self._files.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        self._files.clear()
+
+    def _flush(self, path):
+        lines = self._buffers.pop(path, None)
+        self._sizes.pop(path, None)
+        if not lines:
+            return
+        try:
+            f = self._files.get(path)
+            if f is None:
+                f = self._files[path] = open(path, "a", encoding="utf-8")
+            f.write("".join(lines))
+            f.flush()
+            self._failed.discard(path)
+        except Exception as e:
+            # Report each failing file once until it recovers
+            if path not in self._failed and self.on_error:
+                self._failed.add(path)
+                self.on_error(f"Warning: Could not write to log file: {e}")
@@ -1,6 +1,18 @@
 # This is the main entry point for the application. 
-from gui import App
+# With command line arguments it runs headless (see cli.py); without, it opens the GUI.
+# "query" searches downloaded captures through their sidecar indexes (see pcap_index.py).
+import sys
 
 if __name__ == "__main__":
+    # Lets a frozen (PyInstaller) executable act as a traffic summary worker process
+    import multiprocessing
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        from pcap_index import main
+        sys.exit(main(sys.argv[2:]))
+    if len(sys.argv) > 1:
+        from cli import main
+        sys.exit(main(sys.argv[1:]))
+    from gui import App
     app = App()
-    app.mainloop() 
\ No newline at end of file
+    app.mainloop()
@@ -0,0 +1,263 @@
+# This file aggregates per-phase download timings into latency histograms and exports them for monitoring.
+import bisect
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Phases of one export, as stored in the stats dict filled by api_handler.download_filtered_pcap:
+#   ttfb     - request sent until response headers arrive (includes TCP/TLS setup on a new connection
+#              and the firewall's export latency)
+#   transfer - time spent waiting on the network for the response body
+#   write    - time spent in stream transforms and writing/compressing to disk
+#   total    - the whole export
+DOWNLOAD_PHASES = {"ttfb": "ttfb_seconds", "transfer": "transfer_seconds", "write": "write_seconds", "total": "seconds"}
+
+DEFAULT_EXPORT_INTERVAL = 10.0
+
+METRIC_PREFIX = "pcap_downloader"
+
+
+class Histogram:
+    """
+    Per-bucket counts plus sum and count; exported with cumulative buckets like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding quantile q (None if empty, inf past the last bucket).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def to_dict(self):
+        buckets = {str(b): n for b, n in zip(self.buckets, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": buckets,
+            "p50": _json_bound(self.quantile(0.5)),
+            "p99": _json_bound(self.quantile(0.99)),
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of download metrics, labelled by firewall and file type.
+
+    The download engine feeds it connect timings and the per-file stats dicts. export() writes a
+    Prometheus textfile (for node_exporter's textfile collector) and/or a JSON file; maybe_export()
+    does so at most every export_interval seconds. Files are replaced atomically so a scraper
+    never reads a half-written file.
+    """
+
+    def __init__(self, textfile_path=None, json_path=None, export_interval=DEFAULT_EXPORT_INTERVAL):
+        self.textfile_path = textfile_path
+        self.json_path = json_path
+        self.export_interval = export_interval
+        self._lock = threading.Lock()
+        self._connect = {}    # firewall -> Histogram
+        self._cycles = {}     # firewall -> Histogram
+        self._gaps = {}       # firewall -> Histogram of capture gaps in rotation mode
+        self._phases = {}     # (firewall, file type, phase) -> Histogram
+        self._counters = {}   # (name, firewall, file type, status) -> value
+        self._last_export = None
+
+    def observe_connect(self, firewall, seconds, success):
+        with self._lock:
+            self._connect.setdefault(firewall, Histogram()).observe(seconds)
+            self._add("connects_total", firewall, "", "ok" if success else "error", 1)
+
+    def observe_cycle(self, firewall, seconds):
+        with self._lock:
+            self._cycles.setdefault(firewall, Histogram()).observe(seconds)
+
+    def observe_gap(self, firewall, seconds):
+        with self._lock:
+            self._gaps.setdefault(firewall, Histogram()).observe(seconds)
+
+    def observe_download(self, firewall, file_type, stats, success):
+        with self._lock:
+            self._add("downloads_total", firewall, file_type, "ok" if success else "error", 1)
+            for phase, key in DOWNLOAD_PHASES.items():
+                if stats.get(key) is not None:
+                    self._phases.setdefault((firewall, file_type, phase), Histogram()).observe(stats[key])
+            for key in ("bytes_received", "bytes_stored"):
+                if stats.get(key):
+                    self._add(key + "_total", firewall, file_type, "", stats[key])
+
+    def _add(self, name, firewall, file_type, status, value):
+        key = (name, firewall, file_type, status)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def quantiles(self, phase, qs=(0.5, 0.99)):
+        """
+        Returns the fleet-wide quantiles of one download phase (or "connect", "cycle" or "gap") as a tuple, or None if no data.
+        """
+        with self._lock:
+            if phase == "connect":
+                sources = list(self._connect.values())
+            elif phase == "cycle":
+                sources = list(self._cycles.values())
+            elif phase == "gap":
+                sources = list(self._gaps.values())
+            else:
+                sources = [h for (_, _, p), h in self._phases.items() if p == phase]
+            merged = Histogram()
+            for h in sources:
+                merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                merged.count += h.count
+                merged.sum += h.sum
+        if not merged.count:
+            return None
+        return tuple(merged.quantile(q) for q in qs)
+
+    def latency_summary(self):
+        """
+        Returns human-readable lines with fleet-wide p50/p99 per phase, for the GUI and CLI summaries.
+        """
+        lines = []
+        for phase in ("connect", "ttfb", "transfer", "write", "cycle", "gap"):
+            result = self.quantiles(phase)
+            if result:
+                p50, p99 = (_format_bound(q) for q in result)
+                lines.append(f"{phase} p50 {p50}, p99 {p99}")
+        return lines
+
+    # --- EXPORT ---
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            name = f"{METRIC_PREFIX}_connect_seconds"
+            lines.append(f"# HELP {name} Time to log in to a firewall (API key generation or key cache lookup).")
+            lines.append(f"# TYPE {name} histogram")
+            for firewall, h in sorted(self._connect.items()):
+                lines.extend(_histogram_lines(name, {"firewall": firewall}, h))
+            name = f"{METRIC_PREFIX}_cycle_seconds"
+            lines.append(f"# HELP {name} Time to download all capture files of one cycle.")
+            lines.append(f"# TYPE {name} histogram")
+            for firewall, h in sorted(self._cycles.items()):
+                lines.extend(_histogram_lines(name, {"firewall": firewall}, h))
+            if self._gaps:
+                name = f"{METRIC_PREFIX}_capture_gap_seconds"
+                lines.append(f"# HELP {name} Time a rotated capture was stopped, from stop to restart.")
+                lines.append(f"# TYPE {name} histogram")
+                for firewall, h in sorted(self._gaps.items()):
+                    lines.extend(_histogram_lines(name, {"firewall": firewall}, h))
+            for phase in DOWNLOAD_PHASES:
+                name = f"{METRIC_PREFIX}_download_{phase}_seconds"
+                lines.append(f"# HELP {name} Per-file export time, {phase} phase.")
+                lines.append(f"# TYPE {name} histogram")
+                for (firewall, file_type, p), h in sorted(self._phases.items()):
+                    if p == phase:
+                        lines.extend(_histogram_lines(name, {"firewall": firewall, "file_type": file_type}, h))
+            for counter in sorted({key[0] for key in self._counters}):
+                name = f"{METRIC_PREFIX}_{counter}"
+                lines.append(f"# TYPE {name} counter")
+                for (c, firewall, file_type, status), value in sorted(self._counters.items()):
+                    if c != counter:
+                        continue
+                    labels = {"firewall": firewall}
+                    if file_type:
+                        labels["file_type"] = file_type
+                    if status:
+                        labels["status"] = status
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        with self._lock:
+            firewalls = {}
+            for firewall, h in self._connect.items():
+                firewalls.setdefault(firewall, {"connect": None, "files": {}})["connect"] = h.to_dict()
+            for firewall, h in self._cycles.items():
+                firewalls.setdefault(firewall, {"connect": None, "files": {}})["cycle"] = h.to_dict()
+            for firewall, h in self._gaps.items():
+                firewalls.setdefault(firewall, {"connect": None, "files": {}})["capture_gap"] = h.to_dict()
+            for (firewall, file_type, phase), h in self._phases.items():
+                fw = firewalls.setdefault(firewall, {"connect": None, "files": {}})
+                fw["files"].setdefault(file_type, {})[phase] = h.to_dict()
+            for (name, firewall, file_type, status), value in self._counters.items():
+                fw = firewalls.setdefault(firewall, {"connect": None, "files": {}})
+                target = fw["files"].setdefault(file_type, {}) if file_type else fw
+                target[f"{name}_{status}" if status else name] = value
+        return {"generated": time.time(), "firewalls": firewalls}
+
+    def export(self):
+        """
+        Writes the configured export files. Returns an error message or None.
+        """
+        self._last_export = time.monotonic()
+        try:
+            if self.textfile_path:
+                _write_atomic(self.textfile_path, self.to_prometheus())
+            if self.json_path:
+                _write_atomic(self.json_path, json.dumps(self.to_json(), indent=2))
+        except Exception as e:
+            return f"Warning: Could not write metrics: {e}"
+        return None
+
+    def maybe_export(self):
+        if not (self.textfile_path or self.json_path):
+            return None
+        if self._last_export is not None and time.monotonic() - self._last_export < self.export_interval:
+            return None
+        return self.export()
+
+
+def _format_bound(value):
+    if value == float("inf"):
+        return f"> {LATENCY_BUCKETS[-1]}s"
+    return f"<= {value}s"
+
+
+def _json_bound(value):
+    return "+Inf" if value == float("inf") else value
+
+
+def _labels(labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _histogram_lines(name, labels, h):
+    lines = []
+    cumulative = 0
+    for bound, n in zip(h.buckets + ("+Inf",), h.counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': str(bound)})} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labels)} {h.sum:.6f}")
+    lines.append(f"{name}_count{_labels(labels)} {h.count}")
+    return lines
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,255 @@
+# This file builds compact sidecar indexes (<capture>.pcap.idx) for downloaded pcaps, and queries them.
+#
+# Index layout (little-endian):
+#   header: magic b"PCAPIDX1", linktype (u32), flags (u32), reserved (u64)               24 bytes
+#   entry:  timestamp ns (u64), record offset (u64), record length (u32),
+#           source address (16 bytes), destination address (16 bytes),
+#           source port (u16), destination port (u16), IP protocol (u8), padding (3)   60 bytes
+# Entries are in file order. IPv4 addresses are stored as IPv4-mapped IPv6 addresses.
+import argparse
+import glob
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+
+from compression import COMPRESSION_SUFFIXES, open_capture
+from download_writer import PART_SUFFIX
+from pcap_stream import PcapStreamParser, packet_five_tuple, RECORD_HEADER_LEN
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"PCAPIDX1"
+INDEX_HEADER = struct.Struct('<8sIIQ')
+INDEX_ENTRY = struct.Struct('<QQI16s16sHHB3x')
+NO_ADDRESS = b"\x00" * 16
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+def index_path_for(pcap_path):
+    return pcap_path + INDEX_SUFFIX
+
+
+class IndexBuilder:
+    """
+    Stream transform that indexes a pcap while it is written, in the same pass as the download.
+
+    The bytes passed through are those stored on disk (after an optional inner transform such as
+    pcap_stream.DeltaExtractor), so index offsets point into the saved file; for compressed captures
+    they are offsets into the decompressed stream. The index file is only created if the pcap is;
+    it is written to a .part file that publish() renames into place once the pcap itself has been
+    renamed into place, so a failed download never leaves an index without its pcap.
+    """
+
+    def __init__(self, index_path, inner=None):
+        self.index_path = index_path
+        self.inner = inner
+        self.entries = 0
+        self.parser = PcapStreamParser()
+        self._file = None
+        self._finished = False
+
+    def feed(self, chunk):
+        data = self.inner.feed(chunk) if self.inner is not None else chunk
+        if data:
+            self._index(data)
+        return data
+
+    def finish(self):
+        data = self.inner.finish() if self.inner is not None else b""
+        if data:
+            self._index(data)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._finished = True
+        return data
+
+    def publish(self):
+        """
+        Renames the finished index into place. Called once the pcap has been stored under its final name.
+        """
+        if self._finished:
+            os.replace(self.index_path + PART_SUFFIX, self.index_path)
+            self._finished = False
+
+    def close(self):
+        # Only leaves a .part behind to remove if the download failed before publish()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif not self._finished:
+            return
+        self._finished = False
+        try:
+            os.remove(self.index_path + PART_SUFFIX)
+        except OSError:
+            pass
+
+    def _index(self, data):
+        records = self.parser.feed(data)
+        if self._file is None:
+            if self.parser.header is None:
+                return
+            self._file = open(self.index_path + PART_SUFFIX, 'wb', buffering=WRITE_BUFFER_SIZE)
+            self._file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.parser.linktype, int(self.parser.nanoseconds), 0))
+        linktype = self.parser.linktype
+        pack = INDEX_ENTRY.pack
+        out = []
+        for offset, record in records:
+            five_tuple = packet_five_tuple(linktype, memoryview(record)[RECORD_HEADER_LEN:].tobytes())
+            src, dst, sport, dport, proto = five_tuple or (NO_ADDRESS, NO_ADDRESS, 0, 0, 0)
+            out.append(pack(self.parser.record_timestamp(record), offset, len(record), src, dst, sport, dport, proto))
+        self.entries += len(out)
+        self._file.write(b"".join(out))
+
+
+# --- QUERY ---
+def _address(value):
+    address = ipaddress.ip_address(value)
+    if address.version == 4:
+        return ipaddress.IPv6Address("::ffff:" + str(address)).packed
+    return address.packed
+
+
+def _timestamp_ns(value):
+    """
+    Parses epoch seconds or an ISO date/time (local time) into nanoseconds.
+    """
+    try:
+        return int(float(value) * 1000000000)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp() * 1000000000)
+
+
+def query_index(index_path, host=None, port=None, proto=None, start_ns=None, end_ns=None):
+    """
+    Memory-maps one index and returns (linktype, list of (timestamp ns, record offset, record length)) of matching packets.
+    """
+    with open(index_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < INDEX_HEADER.size:
+            return None, []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, linktype, _, _ = INDEX_HEADER.unpack_from(mm, 0)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{index_path} is not a pcap index")
+            usable = INDEX_HEADER.size + (size - INDEX_HEADER.size) // INDEX_ENTRY.size * INDEX_ENTRY.size
+            matches = []
+            view = memoryview(mm)[INDEX_HEADER.size:usable]
+            try:
+                for ts, offset, length, src, dst, sport, dport, p in INDEX_ENTRY.iter_unpack(view):
+                    if start_ns is not None and ts < start_ns:
+                        continue
+                    if end_ns is not None and ts > end_ns:
+                        continue
+                    if host is not None and src != host and dst != host:
+                        continue
+                    if port is not None and sport != port and dport != port:
+                        continue
+                    if proto is not None and p != proto:
+                        continue
+                    matches.append((ts, offset, length))
+            finally:
+                view.release()
+    return linktype, matches
+
+
+def query_directory(directory, out_path, project_name=None, host=None, port=None, proto=None, start_ns=None, end_ns=None):
+    """
+    Queries every pcap index in a directory and writes the matching packets, in time order, to a new pcap.
+    Returns (packets written, list of warnings).
+    """
+    pattern = f"{glob.escape(project_name)}_*{INDEX_SUFFIX}" if project_name else f"*{INDEX_SUFFIX}"
+    host = _address(host) if host else None
+    warnings = []
+    selected = []
+    header = None
+    for index_path in sorted(glob.glob(os.path.join(glob.escape(directory), pattern))):
+        pcap_path = index_path[:-len(INDEX_SUFFIX)]
+        if not os.path.exists(pcap_path):
+            warnings.append(f"{index_path}: capture file is missing, skipped")
+            continue
+        _, matches = query_index(index_path, host, port, proto, start_ns, end_ns)
+        if not matches:
+            continue
+        with open_capture(pcap_path) as f:
+            file_header = f.read(24)
+        if header is None:
+            header = file_header
+        elif (file_header[:4], file_header[20:]) != (header[:4], header[20:]):
+            # Records are copied verbatim, so byte order, timestamp resolution and link type must match
+            warnings.append(f"{pcap_path}: pcap format or link type differs from the first match, skipped")
+            continue
+        selected.extend((ts, pcap_path, offset, length) for ts, offset, length in matches)
+    selected.sort()
+    if header is None:
+        return 0, warnings
+    # Compressed captures only seek forward, so their matches are read in file order up front
+    preloaded = {}
+    compressed = sorted({(pcap_path, offset, length) for _, pcap_path, offset, length in selected
+                         if pcap_path.endswith(tuple(s for s in COMPRESSION_SUFFIXES.values() if s))})
+    f = None
+    current = None
+    try:
+        for pcap_path, offset, length in compressed:
+            if pcap_path != current:
+                if f is not None:
+                    f.close()
+                f = open_capture(pcap_path)
+                current = pcap_path
+            f.seek(offset)
+            preloaded[(pcap_path, offset)] = f.read(length)
+    finally:
+        if f is not None:
+            f.close()
+    handles = {}
+    try:
+        with open(out_path, 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+            out.write(header)
+            for _, pcap_path, offset, length in selected:
+                record = preloaded.get((pcap_path, offset))
+                if record is None:
+                    f = handles.get(pcap_path)
+                    if f is None:
+                        f = handles[pcap_path] = open(pcap_path, 'rb')
+                    f.seek(offset)
+                    record = f.read(length)
+                out.write(record)
+    finally:
+        for f in handles.values():
+            f.close()
+    return len(selected), warnings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pcap-downloader query",
+        description="Extract packets from downloaded captures using their .idx sidecar indexes.",
+    )
+    parser.add_argument("directory", help="save directory of the project")
+    parser.add_argument("-o", "--output", required=True, help="pcap file to write matching packets to")
+    parser.add_argument("--project-name", dest="project_name", help="only search this project's files")
+    parser.add_argument("--host", help="IP address as source or destination")
+    parser.add_argument("--port", type=int, help="port as source or destination")
+    parser.add_argument("--proto", type=int, help="IP protocol number (6 TCP, 17 UDP)")
+    parser.add_argument("--start", help="start time, epoch seconds or ISO date/time, e.g. 2024-05-01T14:02")
+    parser.add_argument("--end", help="end time, epoch seconds or ISO date/time")
+    args = parser.parse_args(argv)
+    try:
+        start_ns = _timestamp_ns(args.start) if args.start else None
+        end_ns = _timestamp_ns(args.end) if args.end else None
+        packets, warnings = query_directory(args.directory, args.output, args.project_name, args.host,
+                                            args.port, args.proto, start_ns, end_ns)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    for warning in warnings:
+        print(f"Warning: {warning}", file=sys.stderr)
+    print(f"Wrote {packets} packets to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# This file merges the rx/tx/drp captures of one download interval into a single time-ordered pcapng file.
+import heapq
+import os
+import struct
+
+from compression import open_capture
+from download_writer import AtomicWriter
+from pcap_stream import GLOBAL_HEADER_LEN, RECORD_HEADER_LEN, PcapStreamParser
+
+BLOCK_SHB = 0x0A0D0D0A
+BLOCK_IDB = 0x00000001
+BLOCK_EPB = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+OPT_END = 0
+OPT_COMMENT = 1
+OPT_IF_NAME = 2
+OPT_IF_DESCRIPTION = 3
+OPT_IF_TSRESOL = 9
+OPT_SHB_USERAPPL = 4
+
+INTERFACE_DESCRIPTIONS = {
+    "rx": "Packets received by the firewall (filter-pcap rx stage)",
+    "tx": "Packets transmitted by the firewall (filter-pcap tx stage)",
+    "drp": "Packets dropped by the firewall (filter-pcap drp stage)",
+    "fw": "Packets at the firewall stage (filter-pcap fw stage)",
+}
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def _pad(length):
+    return (4 - length % 4) % 4
+
+
+def _option(code, value):
+    return struct.pack('<HH', code, len(value)) + value + b"\x00" * _pad(len(value))
+
+
+def _block(block_type, body):
+    length = 12 + len(body)
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+
+def section_header(comment=None):
+    options = _option(OPT_SHB_USERAPPL, b"Slurpas Palo Alto PCAP Downloader")
+    if comment:
+        options += _option(OPT_COMMENT, comment.encode("utf-8"))
+    options += _option(OPT_END, b"")
+    # Section length -1: unspecified, so sections can be appended without rewriting earlier ones
+    return _block(BLOCK_SHB, struct.pack('<IHHq', BYTE_ORDER_MAGIC, 1, 0, -1) + options)
+
+
+def interface_description(linktype, snaplen, name, description=None):
+    options = _option(OPT_IF_NAME, name.encode("utf-8"))
+    if description:
+        options += _option(OPT_IF_DESCRIPTION, description.encode("utf-8"))
+    # All timestamps are written with nanosecond resolution
+    options += _option(OPT_IF_TSRESOL, bytes([9]))
+    options += _option(OPT_END, b"")
+    return _block(BLOCK_IDB, struct.pack('<HHI', linktype, 0, snaplen) + options)
+
+
+def enhanced_packet(interface_id, timestamp_ns, caplen, origlen, data):
+    body = struct.pack('<IIIII', interface_id, timestamp_ns >> 32, timestamp_ns & 0xFFFFFFFF, caplen, origlen)
+    return _block(BLOCK_EPB, body + data + b"\x00" * _pad(caplen))
+
+
+class _Source:
+    """
+    One input pcap, read sequentially in fixed-size chunks.
+    """
+
+    def __init__(self, interface_id, name, path):
+        self.interface_id = interface_id
+        self.name = name
+        self.file = open_capture(path)
+        header = self.file.read(GLOBAL_HEADER_LEN)
+        self.parser = PcapStreamParser()
+        self.parser.feed(header)
+        if self.parser.header is None:
+            self.file.close()
+            raise ValueError(f"{path} is not a complete pcap file")
+        self.snaplen = struct.unpack(self.parser.endian + 'I', header[16:20])[0]
+
+    def records(self):
+        """
+        Yields (timestamp ns, interface id, record bytes) in file order.
+        """
+        parser = self.parser
+        interface_id = self.interface_id
+        while True:
+            chunk = self.file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            for _, record in parser.feed(chunk):
+                yield parser.record_timestamp(record), interface_id, record
+
+    def close(self):
+        self.file.close()
+
+
+def _write_merge(out, opened, comment):
+    """
+    Writes one pcapng section for the opened sources, in blocks of about WRITE_BUFFER_SIZE bytes. Returns the packet count.
+    """
+    out.write(section_header(comment))
+    for source in opened:
+        out.write(interface_description(source.parser.linktype, source.snaplen, source.name,
+                                        INTERFACE_DESCRIPTIONS.get(source.name)))
+    endian = {source.interface_id: source.parser.endian for source in opened}
+    packets = 0
+    pending = []
+    size = 0
+    for timestamp_ns, interface_id, record in heapq.merge(*(s.records() for s in opened), key=lambda r: r[0]):
+        caplen, origlen = struct.unpack_from(endian[interface_id] + 'II', record, 8)
+        block = enhanced_packet(interface_id, timestamp_ns, caplen, origlen, record[RECORD_HEADER_LEN:])
+        pending.append(block)
+        size += len(block)
+        packets += 1
+        if size >= WRITE_BUFFER_SIZE:
+            out.write(b"".join(pending))
+            pending = []
+            size = 0
+    out.write(b"".join(pending))
+    return packets
+
+
+def merge_pcaps(sources, out_path, append=False, comment=None):
+    """
+    Merges pcap files into one pcapng file ordered by packet timestamp.
+
+    sources is a list of (interface name, pcap path); inputs may be compressed. Each input becomes
+    its own pcapng interface named after it (e.g. rx/tx/drp). The merge is a k-way heap merge over record iterators, so
+    memory use does not depend on capture size. With append=True a new section is appended to
+    out_path, which is how a rolling per-firewall file grows across intervals.
+
+    A failed merge leaves out_path as it was: a new file is written through download_writer.AtomicWriter,
+    and an appended section is truncated away again.
+    Returns the number of packets written.
+    """
+    opened = []
+    try:
+        for interface_id, (name, path) in enumerate(sources):
+            opened.append(_Source(interface_id, name, path))
+        if not append:
+            with AtomicWriter(out_path) as out:
+                return _write_merge(out, opened, comment)
+        existed = os.path.exists(out_path)
+        size = os.path.getsize(out_path) if existed else 0
+        try:
+            with open(out_path, 'ab') as out:
+                return _write_merge(out, opened, comment)
+        except BaseException:
+            try:
+                if existed:
+                    os.truncate(out_path, size)
+                else:
+                    os.remove(out_path)
+            except OSError:
+                pass
+            raise
+    finally:
+        for source in opened:
+            source.close()
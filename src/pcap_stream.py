@@ -0,0 +1,267 @@
+# This file contains streaming helpers for the classic libpcap file format, used while pcaps are downloaded.
+import hashlib
+import struct
+
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+# Magic numbers as read with little-endian byte order
+MAGIC_USEC = 0xa1b2c3d4
+MAGIC_NSEC = 0xa1b23c4d
+MAGIC_USEC_SWAPPED = 0xd4c3b2a1
+MAGIC_NSEC_SWAPPED = 0x4d3cb2a1
+
+
+class PcapFormatError(Exception):
+    pass
+
+
+def parse_global_header(header):
+    """
+    Parses a 24-byte pcap global header. Returns (endian, nanosecond resolution, linktype, snaplen).
+    """
+    magic = struct.unpack('<I', header[:4])[0]
+    if magic in (MAGIC_USEC, MAGIC_NSEC):
+        endian = '<'
+    elif magic in (MAGIC_USEC_SWAPPED, MAGIC_NSEC_SWAPPED):
+        endian = '>'
+    else:
+        raise PcapFormatError(f"Not a pcap file (magic 0x{magic:08x})")
+    nanoseconds = magic in (MAGIC_NSEC, MAGIC_NSEC_SWAPPED)
+    snaplen, linktype = struct.unpack(endian + 'II', header[16:24])
+    return endian, nanoseconds, linktype, snaplen
+
+
+class PcapStreamParser:
+    """
+    Incrementally splits a pcap byte stream into the global header and complete records.
+
+    feed() accepts arbitrary chunks and returns a list of complete records as
+    (offset, record bytes including the 16-byte record header). Bytes of a trailing
+    partial record stay buffered until more data arrives.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.endian = None
+        self.nanoseconds = False
+        self.linktype = None
+        self.offset = 0  # stream offset of the first buffered byte
+        self._buffer = bytearray()
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        buf = self._buffer
+        pos = 0
+        if self.header is None:
+            if len(buf) < GLOBAL_HEADER_LEN:
+                return []
+            self.header = bytes(buf[:GLOBAL_HEADER_LEN])
+            self.endian, self.nanoseconds, self.linktype, _ = parse_global_header(self.header)
+            pos = GLOBAL_HEADER_LEN
+        records = []
+        length_fmt = self.endian + 'I'
+        end = len(buf)
+        while end - pos >= RECORD_HEADER_LEN:
+            caplen = struct.unpack_from(length_fmt, buf, pos + 8)[0]
+            record_end = pos + RECORD_HEADER_LEN + caplen
+            if record_end > end:
+                break
+            records.append((self.offset + pos, bytes(buf[pos:record_end])))
+            pos = record_end
+        if pos:
+            del buf[:pos]
+            self.offset += pos
+        return records
+
+    def record_timestamp(self, record):
+        """
+        Returns the timestamp of a record in nanoseconds.
+        """
+        seconds, fraction = struct.unpack_from(self.endian + 'II', record, 0)
+        return seconds * 1000000000 + (fraction if self.nanoseconds else fraction * 1000)
+
+
+# --- DELTA EXTRACTION ---
+class DeltaState:
+    """
+    Remembers where the previous snapshot of one firewall's capture file (e.g. rx.pcap) ended.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.length = 0  # bytes of complete records (incl. global header) in the previous snapshot
+        self.records = 0
+        self.head_digest = None  # digest of the global header and first record
+        self.digest = None  # digest of the whole previous snapshot
+
+
+class DeltaExtractor:
+    """
+    Filters a downloaded pcap snapshot down to the records that were not in the previous snapshot.
+
+    Filter-pcap exports are cumulative: each snapshot is the previous one plus new records. The
+    extractor hashes the stream as it arrives, skips everything up to where the previous snapshot
+    ended, and emits a global header plus only the new records. If the capture was cleared or
+    restarted (the first record differs) the whole snapshot is emitted again. A trailing partial
+    record is never emitted. Call commit() once the output has been stored successfully.
+
+    If the snapshot starts like the previous one but does not continue it (different records up to
+    where the previous one ended, or it is shorter), the skipped records cannot be recovered from
+    the stream: mismatch is set, nothing is emitted and commit() resets the state, so the caller
+    can download the snapshot again and have it emitted in full.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.parser = PcapStreamParser()
+        self.new_records = 0
+        self.mismatch = False
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._head_digest = None
+        self._length = 0
+        self._records = 0
+        self._incremental = state.head_digest is not None
+        self._header_written = False
+
+    def feed(self, chunk):
+        records = self.parser.feed(chunk)
+        if self.parser.header is None or self.mismatch:
+            return b""
+        if self._length == 0:
+            self._hash.update(self.parser.header)
+            self._length = GLOBAL_HEADER_LEN
+        out = []
+        for offset, record in records:
+            self._hash.update(record)
+            self._length += len(record)
+            self._records += 1
+            if self._records == 1:
+                self._head_digest = self._hash.digest()
+                if self._incremental and self._head_digest != self.state.head_digest:
+                    # The capture was cleared or restarted: store this snapshot in full
+                    self._incremental = False
+            if self._incremental and self._length <= self.state.length:
+                if self._length == self.state.length and self._hash.digest() != self.state.digest:
+                    return self._mismatch()
+                continue
+            if self._incremental and self._length - len(record) < self.state.length:
+                # This record straddles where the previous snapshot ended
+                return self._mismatch()
+            if not self._header_written:
+                out.append(self.parser.header)
+                self._header_written = True
+            out.append(record)
+            self.new_records += 1
+        return b"".join(out)
+
+    def finish(self):
+        if self._incremental and not self.mismatch and self._length < self.state.length:
+            self._mismatch()
+        return b""
+
+    def _mismatch(self):
+        # Only reached before anything was emitted: every earlier record was skipped as already stored
+        self.mismatch = True
+        self.new_records = 0
+        return b""
+
+    def commit(self):
+        """
+        Records this snapshot as the baseline for the next one, or resets the state after a mismatch.
+        """
+        if self.mismatch:
+            self.state.reset()
+            return
+        self.state.length = self._length
+        self.state.records = self._records
+        self.state.head_digest = self._head_digest
+        self.state.digest = self._hash.digest()
+
+
+# --- PACKET DECODING ---
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT_HEADER = 44
+IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+PROTO_SCTP = 132
+
+
+def _l3_offset(linktype, data):
+    """
+    Returns (ethertype, offset of the IP header) for a link-layer frame, or (None, None).
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 14
+        if len(data) < offset:
+            return None, None
+        ethertype = struct.unpack_from('!H', data, 12)[0]
+        while ethertype in ETHERTYPE_VLAN and len(data) >= offset + 4:
+            ethertype = struct.unpack_from('!H', data, offset + 2)[0]
+            offset += 4
+        return ethertype, offset
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None, None
+        return struct.unpack_from('!H', data, 14)[0], 16
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not data:
+            return None, None
+        version = data[0] >> 4
+        return (ETHERTYPE_IPV4 if version == 4 else ETHERTYPE_IPV6 if version == 6 else None), 0
+    return None, None
+
+
+def packet_five_tuple(linktype, data):
+    """
+    Decodes (source address, destination address, source port, destination port, IP protocol) from a
+    captured frame. Addresses are 16 bytes, IPv4 addresses are IPv4-mapped IPv6 addresses. Ports are 0
+    for protocols without ports and for non-first fragments. Returns None for non-IP frames.
+    """
+    ethertype, offset = _l3_offset(linktype, data)
+    if ethertype == ETHERTYPE_IPV4:
+        if len(data) < offset + 20:
+            return None
+        header_len = (data[offset] & 0x0F) * 4
+        fragment = struct.unpack_from('!H', data, offset + 6)[0] & 0x1FFF
+        proto = data[offset + 9]
+        src = IPV4_MAPPED_PREFIX + data[offset + 12:offset + 16]
+        dst = IPV4_MAPPED_PREFIX + data[offset + 16:offset + 20]
+        l4 = offset + header_len if not fragment else None
+    elif ethertype == ETHERTYPE_IPV6:
+        if len(data) < offset + 40:
+            return None
+        proto = data[offset + 6]
+        src = data[offset + 8:offset + 24]
+        dst = data[offset + 24:offset + 40]
+        l4 = offset + 40
+        while l4 is not None and len(data) >= l4 + 8:
+            if proto in IPV6_EXTENSION_HEADERS:
+                proto, length = data[l4], (data[l4 + 1] + 1) * 8
+                l4 += length
+            elif proto == IPV6_FRAGMENT_HEADER:
+                fragment = struct.unpack_from('!H', data, l4 + 2)[0] >> 3
+                proto = data[l4]
+                l4 = l4 + 8 if not fragment else None
+            else:
+                break
+    else:
+        return None
+    sport = dport = 0
+    if l4 is not None and proto in (PROTO_TCP, PROTO_UDP, PROTO_SCTP) and len(data) >= l4 + 4:
+        sport, dport = struct.unpack_from('!HH', data, l4)
+    return src, dst, sport, dport, proto
@@ -0,0 +1,158 @@
+# This file holds the adaptive per-firewall export limiter (token bucket plus AIMD concurrency) used by the download engine.
+import asyncio
+import time
+from collections import deque
+
+# A firewall counts as overloaded when its smoothed time to first byte exceeds this multiple of the
+# fastest recent export (and at least MIN_OVERLOAD_LATENCY seconds), or when exports fail with busy/timeout errors.
+DEFAULT_LATENCY_TOLERANCE = 2.0
+MIN_OVERLOAD_LATENCY = 0.5
+LATENCY_SAMPLES = 50       # recent time-to-first-byte samples the baseline is taken from
+LATENCY_SMOOTHING = 0.3    # weight of a new sample in the moving average
+
+BACKOFF_FACTOR = 0.5       # multiplicative decrease of concurrency and request rate
+MIN_RATE = 0.05            # exports per second a struggling firewall is never throttled below
+RATE_INCREASE = 1.1        # growth of the request rate per fast export
+RATE_WINDOW = 60.0         # seconds of history the current request rate is measured over
+UNLIMITED_RATE = 10.0      # without a configured maximum, the bucket is lifted once the rate recovers to this
+
+
+class TokenBucket:
+    """
+    Request rate limit: rate tokens per second, up to burst stored. rate None means unlimited.
+    """
+
+    def __init__(self, rate=None, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def reserve(self):
+        """
+        Takes a token and returns the seconds to wait before using it (0 if one was available).
+        Tokens can be reserved ahead, so concurrent callers are spaced 1/rate apart.
+        """
+        now = self.clock()
+        if self.rate is None:
+            self.updated = now
+            return 0.0
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AdaptiveLimiter:
+    """
+    Gate for the exports of one firewall, adapting to how well its management plane copes.
+
+    Exports need a concurrency slot and a token from a TokenBucket. After every export the limits
+    adapt (AIMD): while the firewall is fast, concurrency grows (doubling from 1 at first, then
+    by one slot per round of exports) up to max_concurrency and the request rate rises until it is
+    unlimited again (or reaches max_rate). When it is overloaded (see DEFAULT_LATENCY_TOLERANCE) both
+    are halved, at most once per hold period so one slow burst is not punished several times.
+    With adaptive=False the concurrency stays at max_concurrency and the rate at max_rate.
+    Must be used from one event loop.
+    """
+
+    def __init__(self, max_concurrency, max_rate=None, adaptive=True, latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+                 clock=time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.clock = clock
+        self.limit = 1.0 if adaptive else float(max_concurrency)
+        self.bucket = TokenBucket(max_rate, burst=max_concurrency, clock=clock)
+        self.in_flight = 0
+        self.latency = None
+        self._slow_start = adaptive
+        self._samples = deque(maxlen=LATENCY_SAMPLES)
+        self._starts = deque()
+        self._hold_until = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def concurrency(self):
+        return max(int(self.limit), 1)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def describe(self):
+        rate = "unlimited" if self.rate is None else f"{self.rate:.2f}/s"
+        text = f"{self.concurrency} concurrent export(s), rate {rate}"
+        if self.latency is not None:
+            text += f", latency {self.latency:.2f}s (baseline {min(self._samples):.2f}s)"
+        return text
+
+    async def acquire(self):
+        """
+        Waits for a concurrency slot. Returns the seconds the caller must still wait for the rate limit.
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+        now = self.clock()
+        self._starts.append(now)
+        while self._starts and self._starts[0] < now - RATE_WINDOW:
+            self._starts.popleft()
+        return self.bucket.reserve()
+
+    async def release(self, latency=None, overloaded=False):
+        """
+        Frees the slot of a finished export and adapts the limits to it: latency is its time to
+        first byte (None if unknown), overloaded is True for busy/timeout failures.
+        Returns a description of the new limits if they changed noticeably, else None.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            change = self._adapt(latency, overloaded) if self.adaptive else None
+            self._condition.notify_all()
+        return change
+
+    def _adapt(self, latency, overloaded):
+        if latency is not None:
+            self._samples.append(latency)
+            self.latency = latency if self.latency is None else (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * latency
+            threshold = max(min(self._samples) * self.latency_tolerance, MIN_OVERLOAD_LATENCY)
+            overloaded = overloaded or self.latency > threshold
+        elif not overloaded:
+            return None
+        before = (self.concurrency, self.rate)
+        now = self.clock()
+        if overloaded:
+            if now < self._hold_until:
+                return None
+            self._hold_until = now + max(2 * (self.latency or 0), 1.0)
+            self._slow_start = False
+            self.limit = max(self.limit * BACKOFF_FACTOR, 1.0)
+            self.bucket.rate = max((self.rate or self._current_rate()) * BACKOFF_FACTOR, MIN_RATE)
+            return f"Firewall overloaded, backing off to {self.describe()}."
+        if self._slow_start:
+            self.limit = min(self.limit * 2, self.max_concurrency)
+        else:
+            self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+        if self.rate is not None:
+            rate = self.rate * RATE_INCREASE
+            if self.max_rate is not None:
+                rate = min(rate, self.max_rate)
+            elif rate >= UNLIMITED_RATE:
+                rate = None
+            self.bucket.rate = rate
+        # The ramp-up of slow start after every job start is expected and not reported
+        if not self._slow_start and (self.concurrency != before[0] or (self.rate is None and before[1] is not None)):
+            return f"Firewall responsive, raising limits to {self.describe()}."
+        return None
+
+    def _current_rate(self):
+        """
+        Exports started per second over the last RATE_WINDOW seconds (at least MIN_RATE).
+        """
+        if len(self._starts) < 2:
+            return MIN_RATE
+        span = max(self._starts[-1] - self._starts[0], 1.0)
+        return max(len(self._starts) / span, MIN_RATE)
@@ -0,0 +1,283 @@
+# This file keeps a project's downloaded captures within a disk budget (total size, age and free space).
+import os
+import re
+import shutil
+import threading
+import time
+
+from compression import COMPRESSION_SUFFIXES, check_compression
+from download_writer import AtomicWriter, PART_SUFFIX, READ_BUFFER_SIZE
+from pcap_index import index_path_for
+
+DEFAULT_CHECK_INTERVAL = 30.0
+# The newest snapshot of a firewall is left alone for this many seconds after it was written (merges may read it)
+RECENT_SECONDS = 60.0
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+# <project>_<timestamp>_<firewall>_<rx|tx|drp|fw|merged>.pcap[ng][.gz|.zst][.idx], as written by the download engine.
+# Files of one download cycle share project, timestamp and firewall and form one snapshot.
+SNAPSHOT_FILE = re.compile(r"^(?P<project>.+)_(?P<timestamp>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})_(?P<firewall>.+)"
+                           r"_(?:rx|tx|drp|fw|merged)\.pcap(?:ng)?(?P<compression>\.gz|\.zst)?(?P<index>\.idx)?$")
+
+
+def parse_size(value):
+    """
+    Returns a byte count from an int or a string such as "500M" or "1.5G" (binary units). Raises ValueError.
+    """
+    if isinstance(value, int):
+        size = value
+    else:
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Invalid size {value!r} (e.g. 500M, 20G)")
+        size = int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+    if size < 0:
+        raise ValueError(f"Invalid size {value!r}")
+    return size
+
+
+def _format_size(size):
+    return f"{size / 1024 ** 2:.1f} MB"
+
+
+class RetentionManager:
+    """
+    Enforces a disk budget on one project's captures in save_dir.
+
+    The directory is scanned once at startup; after that the download engine reports every file it
+    writes through add(), so the index of files (size, age, snapshot) lives in memory and checks
+    never rescan the directory. Partial downloads (.part files) are never indexed or touched.
+
+    A background thread applies the budget every interval seconds, and at once when a new file
+    pushes the project over it: snapshots older than max_age seconds are deleted, then while the
+    project is larger than max_bytes or the disk has less than min_free bytes free the oldest
+    snapshots are compressed (if compress is "gzip" or "zstd") and, if that is not enough,
+    deleted. The newest snapshot of a firewall is not touched for RECENT_SECONDS, since merges may
+    still be reading it. If the budget still cannot be met, the manager is paused: allow() returns False
+    and the engine skips downloads until space is available again, instead of writing files that
+    would fail half way.
+
+    Only snapshot files count towards max_bytes; download logs and rolling merge files are not
+    pruned (but the free-space reserve still covers them).
+    """
+
+    def __init__(self, save_dir, project_name, max_bytes=None, max_age=None, min_free=0, compress=None,
+                 interval=DEFAULT_CHECK_INTERVAL, on_log=None, clock=time.time):
+        if compress not in (None, "none") and check_compression(compress):
+            raise ValueError(check_compression(compress))
+        self.save_dir = os.path.abspath(save_dir)
+        self.project_name = project_name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_free = min_free or 0
+        self.compress = compress if compress != "none" else None
+        self.interval = interval
+        self.on_log = on_log
+        self.clock = clock
+        self.paused = False
+        self._lock = threading.Lock()          # guards the index
+        self._enforce_lock = threading.Lock()  # one enforce() at a time
+        self._files = {}      # path -> (size, mtime, snapshot)
+        self._snapshots = {}  # (timestamp, firewall) -> set of paths
+        self._total = 0
+        self._wake = threading.Event()
+        self._closed = False
+        self._scan()
+        self._thread = threading.Thread(target=self._run, name="pcap-retention", daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"RetentionManager(save_dir={self.save_dir!r}, files={len(self._files)}, bytes={self._total})"
+
+    @property
+    def total_bytes(self):
+        return self._total
+
+    def _scan(self):
+        try:
+            entries = list(os.scandir(self.save_dir))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_file():
+                self._add(entry.path)
+
+    def add(self, *paths):
+        """
+        Records newly written files. Paths outside save_dir or not belonging to the project are ignored.
+        """
+        over = False
+        for path in paths:
+            if path and self._add(os.path.abspath(path)):
+                over = True
+        if over:
+            self._wake.set()
+
+    def _add(self, path):
+        """
+        Indexes one file. Returns True if it pushed the project over max_bytes.
+        """
+        name = os.path.basename(path)
+        if os.path.dirname(path) != self.save_dir or name.endswith(PART_SUFFIX):
+            return False
+        match = SNAPSHOT_FILE.match(name)
+        if not match or match.group("project") != self.project_name:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        snapshot = (match.group("timestamp"), match.group("firewall"))
+        with self._lock:
+            previous = self._files.get(path)
+            if previous is not None:
+                self._total -= previous[0]
+            self._files[path] = (st.st_size, st.st_mtime, snapshot)
+            self._snapshots.setdefault(snapshot, set()).add(path)
+            self._total += st.st_size
+            return bool(self.max_bytes) and self._total > self.max_bytes
+
+    def _remove(self, path):
+        with self._lock:
+            entry = self._files.pop(path, None)
+            if entry is None:
+                return
+            size, _, snapshot = entry
+            self._total -= size
+            paths = self._snapshots[snapshot]
+            paths.discard(path)
+            if not paths:
+                del self._snapshots[snapshot]
+
+    def free_bytes(self):
+        try:
+            return shutil.disk_usage(self.save_dir).free
+        except OSError:
+            return None
+
+    def over_budget(self):
+        """
+        Returns a description of the exceeded limit, or None.
+        """
+        if self.max_bytes and self._total > self.max_bytes:
+            return f"project uses {_format_size(self._total)} of {_format_size(self.max_bytes)}"
+        if self.min_free:
+            free = self.free_bytes()
+            if free is not None and free < self.min_free:
+                return f"{_format_size(free)} free, {_format_size(self.min_free)} reserved"
+        return None
+
+    def allow(self):
+        """
+        Returns True if there is room for another download cycle. Over budget, prunes first (this may block).
+        """
+        if self.paused or self.over_budget():
+            return self.enforce()
+        return True
+
+    def enforce(self):
+        """
+        Applies max_age, max_bytes and min_free once. Returns True if downloads may continue.
+        """
+        with self._enforce_lock:
+            with self._lock:
+                snapshots = sorted(self._snapshots)
+                newest = {}
+                for snapshot in snapshots:
+                    newest[snapshot[1]] = snapshot
+                mtimes = {s: max(self._files[p][1] for p in self._snapshots[s]) for s in snapshots}
+            now = self.clock()
+            candidates = [s for s in snapshots if newest[s[1]] != s or mtimes[s] < now - RECENT_SECONDS]
+            if self.max_age:
+                cutoff = now - self.max_age
+                for snapshot in [s for s in candidates if mtimes[s] < cutoff]:
+                    self._delete(snapshot, "older than the maximum age")
+                    candidates.remove(snapshot)
+            if self.compress:
+                for snapshot in candidates:
+                    if not self.over_budget():
+                        break
+                    self._compress(snapshot)
+            for snapshot in list(candidates):
+                if not self.over_budget():
+                    break
+                self._delete(snapshot, "over the disk budget")
+            reason = self.over_budget()
+            if reason and not self.paused:
+                self._log(f"Disk budget exhausted ({reason}), pausing downloads until space is available.")
+            elif not reason and self.paused:
+                self._log("Disk budget available again, resuming downloads.")
+            self.paused = reason is not None
+            return not self.paused
+
+    def _delete(self, snapshot, why):
+        with self._lock:
+            paths = sorted(self._snapshots.get(snapshot, ()))
+            size = sum(self._files[p][0] for p in paths)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self._log(f"Retention: could not delete {path}: {e}")
+                continue
+            self._remove(path)
+        timestamp, firewall = snapshot
+        self._log(f"Retention: deleted the {timestamp} snapshot of {firewall} ({len(paths)} files, {_format_size(size)}), {why}.")
+
+    def _compress(self, snapshot):
+        """
+        Compresses the uncompressed captures of a snapshot in place (x.pcap -> x.pcap.gz, keeping its index).
+        """
+        with self._lock:
+            matches = [(p, SNAPSHOT_FILE.match(os.path.basename(p))) for p in sorted(self._snapshots.get(snapshot, ()))]
+        paths = [p for p, match in matches if not match.group("compression") and not match.group("index")]
+        for path in paths:
+            target = path + COMPRESSION_SUFFIXES[self.compress]
+            try:
+                with open(path, 'rb') as src, AtomicWriter(target, self.compress) as dst:
+                    while True:
+                        block = src.read(READ_BUFFER_SIZE)
+                        if not block:
+                            break
+                        dst.write(block)
+                # Keep the original time, which max_age is measured from
+                st = os.stat(path)
+                os.utime(target, (st.st_atime, st.st_mtime))
+                # Index offsets refer to the decompressed stream, so the index stays valid under the new name
+                if os.path.exists(index_path_for(path)):
+                    os.replace(index_path_for(path), index_path_for(target))
+                    self._remove(index_path_for(path))
+                    self._add(index_path_for(target))
+                os.remove(path)
+            except OSError as e:
+                self._log(f"Retention: could not compress {path}: {e}")
+                continue
+            self._remove(path)
+            self._add(target)
+
+    def _log(self, message):
+        if self.on_log is not None:
+            self.on_log(message)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                self.enforce()
+            except Exception as e:
+                self._log(f"Retention: {e}")
+
+    def close(self):
+        """
+        Stops the background thread. Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
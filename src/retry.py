@@ -0,0 +1,90 @@
+# This file holds the retry backoff and the per-firewall circuit breaker used by the download engine.
+import random
+import time
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 30.0
+
+# Consecutive failures before a firewall's breaker opens, and the first cooldown before it is probed again
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+# Each failed probe doubles the cooldown, up to this many seconds
+MAX_BREAKER_COOLDOWN = 600.0
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF_BASE, cap=DEFAULT_BACKOFF_CAP):
+    """
+    Returns the delay before retry number attempt (0-based): exponential backoff with full jitter,
+    uniform between 0 and min(cap, base * 2 ** attempt), so retries from many firewalls spread out.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one firewall.
+
+    Closed: requests flow normally; consecutive failures are counted. After threshold failures the
+    breaker opens: downloads for the firewall are skipped without touching the network, so an
+    unreachable device does not hold worker slots meant for healthy ones. Once the cooldown has
+    passed the breaker goes half-open and lets one probe through. A successful probe closes it, a
+    failed probe reopens it with a doubled cooldown.
+    """
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, cooldown=DEFAULT_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        """
+        Returns True if a request may be sent; moves an open breaker to half-open once the cooldown has passed.
+        """
+        if self.state == BREAKER_OPEN:
+            if self.clock() < self.opened_at + self.cooldown:
+                return False
+            self.state = BREAKER_HALF_OPEN
+        return True
+
+    @property
+    def is_open(self):
+        return self.state == BREAKER_OPEN
+
+    @property
+    def half_open(self):
+        return self.state == BREAKER_HALF_OPEN
+
+    def retry_in(self):
+        """
+        Seconds until an open breaker lets the next probe through.
+        """
+        if self.state != BREAKER_OPEN:
+            return 0.0
+        return max(self.opened_at + self.cooldown - self.clock(), 0.0)
+
+    def record_success(self):
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        """
+        Counts a failure. Returns True if this failure opened the breaker.
+        """
+        self.failures += 1
+        if self.state == BREAKER_HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, MAX_BREAKER_COOLDOWN)
+        elif self.state == BREAKER_OPEN or self.failures < self.threshold:
+            return False
+        self.state = BREAKER_OPEN
+        self.opened_at = self.clock()
+        return True
@@ -0,0 +1,86 @@
+# This file schedules download cycles for the whole fleet on fixed, drift-free monotonic deadlines.
+import random
+import time
+
+OVERRUN_SKIP = "skip"
+OVERRUN_CATCH_UP = "catch-up"
+OVERRUN_POLICIES = [OVERRUN_SKIP, OVERRUN_CATCH_UP]
+
+
+def spread(slot):
+    """
+    Returns the start offset of a slot as a fraction of the stagger window (0, 1/2, 1/4, 3/4, 1/8, ...).
+
+    This van der Corput sequence spreads any number of firewalls evenly over the window without
+    knowing the fleet size up front, so firewalls can be added one by one.
+    """
+    fraction = 0.0
+    denominator = 1.0
+    while slot:
+        denominator *= 2
+        slot, bit = divmod(slot, 2)
+        fraction += bit / denominator
+    return fraction
+
+
+class FleetScheduler:
+    """
+    Computes the start deadline of every download cycle of every firewall.
+
+    Cycle k of a firewall starts at origin + k * interval (+ random jitter), where origin is the
+    fleet start time plus the firewall's stagger offset. Deadlines come from this fixed grid rather
+    than from the end of the previous cycle, so download time never shifts the cadence. When a
+    cycle overruns its successor's deadline, the "skip" policy drops the missed slots and waits for
+    the next slot on the grid, while "catch-up" starts the missed cycles back to back until the
+    firewall is on schedule again.
+    """
+
+    def __init__(self, stagger=None, jitter=0.0, overrun_policy=OVERRUN_SKIP, clock=time.monotonic):
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy {overrun_policy!r}")
+        self.stagger = stagger  # seconds to spread firewall start times over; None spreads over the interval
+        self.jitter = jitter
+        self.overrun_policy = overrun_policy
+        self.clock = clock
+        self.next_run = {}  # firewall -> (previous deadline or registration time, next deadline)
+        self._entries = {}
+        self._start = None
+
+    def add(self, firewall, interval):
+        """
+        Registers a firewall and returns the deadline of its first cycle.
+        """
+        now = self.clock()
+        if self._start is None:
+            self._start = now
+        window = interval if self.stagger is None else self.stagger
+        origin = self._start + window * spread(len(self._entries))
+        self._entries[firewall] = {"interval": interval, "origin": origin, "cycle": 0}
+        deadline = self._deadline(firewall)
+        self.next_run[firewall] = (now, deadline)
+        return deadline
+
+    def _deadline(self, firewall):
+        entry = self._entries[firewall]
+        jitter = random.uniform(0, self.jitter) if self.jitter else 0.0
+        return entry["origin"] + entry["cycle"] * entry["interval"] + jitter
+
+    def cycle_finished(self, firewall):
+        """
+        Advances a firewall to its next cycle. Returns (next deadline, number of skipped cycles).
+        """
+        entry = self._entries[firewall]
+        previous = self.next_run[firewall][1]
+        entry["cycle"] += 1
+        skipped = 0
+        if self.overrun_policy == OVERRUN_SKIP and entry["interval"] > 0:
+            now = self.clock()
+            while entry["origin"] + entry["cycle"] * entry["interval"] < now:
+                entry["cycle"] += 1
+                skipped += 1
+        deadline = self._deadline(firewall)
+        self.next_run[firewall] = (previous, deadline)
+        return deadline, skipped
+
+    def remove(self, firewall):
+        self.next_run.pop(firewall, None)
@@ -0,0 +1,432 @@
+# This file computes per-firewall traffic statistics (packets, bytes, rates, top talkers and ports) from downloaded captures.
+# The parsing runs in worker processes with NumPy (pip install numpy), which is imported there only.
+import importlib.util
+import ipaddress
+import json
+import multiprocessing
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from compression import open_capture
+from download_writer import AtomicWriter
+from pcap_stream import (GLOBAL_HEADER_LEN, RECORD_HEADER_LEN, parse_global_header, packet_five_tuple,
+                         LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6,
+                         ETHERTYPE_IPV4, ETHERTYPE_IPV6, ETHERTYPE_VLAN, IPV6_EXTENSION_HEADERS,
+                         IPV6_FRAGMENT_HEADER, PROTO_TCP, PROTO_UDP, PROTO_SCTP)
+
+DEFAULT_WORKERS = 2
+TOP_N = 10            # talkers and ports listed in the summary
+MAX_TRACKED = 1000    # talkers and ports kept per capture stage; beyond that the counts are approximate
+SUMMARY_SUFFIX = "_traffic_summary.json"
+# Packets per second are kept for this many seconds before the newest packet, so the peak rate of
+# firewalls and stages that captured at the same time can be combined; older peaks are kept as numbers
+PPS_WINDOW = 3600
+ANALYZE_CHUNK = 16 * 1024 * 1024  # bytes of a capture read and analyzed at a time
+
+PROTOCOL_NAMES = {1: "icmp", PROTO_TCP: "tcp", PROTO_UDP: "udp", 58: "icmpv6", PROTO_SCTP: "sctp"}
+PORT_PROTOCOLS = [PROTO_TCP, PROTO_UDP, PROTO_SCTP]
+# Packet bytes are read at fixed offsets past the checked length of each packet; padding the buffer
+# by more than the deepest such offset (IPv4 options and a port) keeps those reads inside the array
+PADDING = 128
+
+EMPTY_STATS = {"packets": 0, "bytes": 0, "first_ts": None, "last_ts": None, "peak_pps": 0,
+               "per_second": {}, "protocols": {}, "talkers": {}, "ports": {}}
+
+
+def check_traffic_summary():
+    """
+    Returns None if traffic summaries can be computed, or an error message.
+    """
+    # find_spec does not import numpy, which only the worker processes need
+    if importlib.util.find_spec("numpy") is None:
+        return "Traffic summaries require the numpy package (pip install numpy)."
+    return None
+
+
+def summary_path_for(save_dir, project_name):
+    return os.path.join(save_dir, project_name + SUMMARY_SUFFIX)
+
+
+# --- CAPTURE ANALYSIS (runs in the worker processes) ---
+def _record_offsets(data, endian):
+    """
+    Returns (offsets of the complete records at the start of data, end of the last one). Records
+    have variable length, so this walk is the one step that cannot be vectorized; it only reads the
+    4-byte caplen of each record header.
+    """
+    caplen = struct.Struct(endian + 'I')
+    offsets = []
+    pos = 0
+    end = len(data)
+    while end - pos >= RECORD_HEADER_LEN:
+        record_end = pos + RECORD_HEADER_LEN + caplen.unpack_from(data, pos + 8)[0]
+        if record_end > end:
+            break
+        offsets.append(pos)
+        pos = record_end
+    return offsets, pos
+
+
+def _u16(buf, index):
+    return (buf[index].astype('uint32') << 8) | buf[index + 1]
+
+
+def _decode(buf, packet, caplen, linktype):
+    """
+    Decodes all packets at once, with the rules of pcap_stream.packet_five_tuple (which the packet
+    index uses, so a capture is decoded the same way by both). Returns (ip, protocol, src, dst,
+    ported, sport, dport): ip marks IP packets, addresses are rows of 16 bytes (IPv4-mapped for
+    IPv4) and ported marks TCP/UDP/SCTP packets with ports. IPv6 packets with extension headers
+    are rare and are decoded one at a time by packet_five_tuple itself.
+    """
+    import numpy as np
+
+    n = len(packet)
+    if linktype == LINKTYPE_ETHERNET:
+        valid = caplen >= 14
+        offset = np.full(n, 14, dtype=np.int64)
+        ethertype = _u16(buf, packet + 12)
+        tagged = valid & np.isin(ethertype, ETHERTYPE_VLAN) & (caplen >= offset + 4)
+        while tagged.any():
+            ethertype = np.where(tagged, _u16(buf, packet + offset + 2), ethertype)
+            offset += tagged * 4
+            tagged = valid & np.isin(ethertype, ETHERTYPE_VLAN) & (caplen >= offset + 4)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        valid = caplen >= 16
+        offset = np.full(n, 16, dtype=np.int64)
+        ethertype = _u16(buf, packet + 14)
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        valid = caplen >= 1
+        offset = np.zeros(n, dtype=np.int64)
+        version = buf[packet] >> 4
+        ethertype = np.where(version == 4, ETHERTYPE_IPV4, np.where(version == 6, ETHERTYPE_IPV6, 0))
+    else:
+        valid = np.zeros(n, dtype=bool)
+        offset = np.zeros(n, dtype=np.int64)
+        ethertype = np.zeros(n, dtype=np.int64)
+    l3 = packet + offset
+    v4 = valid & (ethertype == ETHERTYPE_IPV4) & (caplen >= offset + 20)
+    v6 = valid & (ethertype == ETHERTYPE_IPV6) & (caplen >= offset + 40)
+    protocol = np.where(v4, buf[l3 + 9], buf[l3 + 6]).astype(np.int64)
+    extended = v6 & np.isin(protocol, list(IPV6_EXTENSION_HEADERS) + [IPV6_FRAGMENT_HEADER])
+    v6 &= ~extended
+
+    src = np.zeros((n, 16), dtype=np.uint8)
+    dst = np.zeros((n, 16), dtype=np.uint8)
+    columns = np.arange(16)
+    src[v6] = buf[l3[v6, None] + 8 + columns]
+    dst[v6] = buf[l3[v6, None] + 24 + columns]
+    src[v4, 10:12] = dst[v4, 10:12] = 0xff
+    src[v4, 12:] = buf[l3[v4, None] + 12 + columns[:4]]
+    dst[v4, 12:] = buf[l3[v4, None] + 16 + columns[:4]]
+
+    # Ports of IPv4 packets that are not a later fragment, and of IPv6 packets without extension headers
+    l4 = offset + np.where(v4, (buf[l3] & 0x0f).astype(np.int64) * 4, 40)
+    first_fragment = ~v4 | ((_u16(buf, l3 + 6) & 0x1fff) == 0)
+    ported = (v4 | v6) & first_fragment & np.isin(protocol, PORT_PROTOCOLS) & (caplen >= l4 + 4)
+    sport = np.where(ported, _u16(buf, packet + l4), 0).astype(np.int64)
+    dport = np.where(ported, _u16(buf, packet + l4 + 2), 0).astype(np.int64)
+
+    ip = v4 | v6
+    for i in np.flatnonzero(extended).tolist():
+        start = int(packet[i])
+        decoded = packet_five_tuple(linktype, bytes(buf[start:start + int(caplen[i])]))
+        if decoded is None:
+            continue
+        src[i] = np.frombuffer(decoded[0], dtype=np.uint8)
+        dst[i] = np.frombuffer(decoded[1], dtype=np.uint8)
+        sport[i], dport[i], protocol[i] = decoded[2], decoded[3], decoded[4]
+        ip[i] = True
+        # packet_five_tuple reports missing ports as 0
+        ported[i] = decoded[4] in PORT_PROTOCOLS and (decoded[2] or decoded[3])
+    return ip, protocol, src, dst, ported, sport, dport
+
+
+def _format_address(raw):
+    address = ipaddress.IPv6Address(bytes(raw))
+    return str(address.ipv4_mapped or address)
+
+
+def _top(counts, limit=MAX_TRACKED):
+    return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit])
+
+
+def analyze_capture(path):
+    """
+    Returns the traffic statistics of one (possibly compressed) pcap file as a dict with packets,
+    bytes (original lengths), first_ts/last_ts (epoch seconds, None if empty), peak_pps (most packets
+    in one second), per_second (epoch second -> packets, last PPS_WINDOW seconds), protocols
+    (name -> packets), talkers (address -> bytes sent plus received) and ports (e.g. "tcp/443" ->
+    packets, by the lower of the two ports, usually the service).
+
+    The file is read in blocks of ANALYZE_CHUNK bytes, so memory does not grow with the capture;
+    the complete records of each block are analyzed (see _analyze_records) and the results merged.
+    Raises OSError or pcap_stream.PcapFormatError.
+    """
+    stats = merge_stats(None, EMPTY_STATS)
+    with open_capture(path) as f:
+        header = f.read(GLOBAL_HEADER_LEN)
+        if len(header) < GLOBAL_HEADER_LEN:
+            return stats
+        endian, nanoseconds, linktype, _ = parse_global_header(header)
+        data = b""
+        while True:
+            chunk = f.read(ANALYZE_CHUNK)
+            if not chunk:
+                break
+            data = data + chunk if data else chunk
+            offsets, end = _record_offsets(data, endian)
+            if offsets:
+                stats = merge_stats(stats, _analyze_records(data, offsets, endian, nanoseconds, linktype))
+            data = data[end:]
+    return stats
+
+
+def _analyze_records(data, offsets, endian, nanoseconds, linktype):
+    """
+    Returns the analyze_capture statistics of the records at offsets in data. Record headers and the
+    IP and TCP/UDP/SCTP fields of all packets (see _decode) are gathered into NumPy arrays and
+    aggregated with vectorized operations.
+    """
+    import numpy as np
+
+    stats = merge_stats(None, EMPTY_STATS)
+    offsets = np.array(offsets, dtype=np.int64)
+    n = len(offsets)
+    buf = np.frombuffer(data + bytes(PADDING), dtype=np.uint8)
+
+    # Record headers: ts_sec, ts_usec/nsec, caplen, original length
+    header = buf[offsets[:, None] + np.arange(RECORD_HEADER_LEN)].view(endian + 'u4')
+    ts_sec = header[:, 0].astype(np.int64)
+    ts = ts_sec + header[:, 1] / (1e9 if nanoseconds else 1e6)
+    caplen = header[:, 2].astype(np.int64)
+    length = header[:, 3].astype(np.int64)
+    stats["packets"] = n
+    stats["bytes"] = int(length.sum())
+    stats["first_ts"] = float(ts.min())
+    stats["last_ts"] = float(ts.max())
+    # merge_stats keeps the last PPS_WINDOW seconds of these
+    seconds, counts = np.unique(ts_sec, return_counts=True)
+    stats["peak_pps"] = int(counts.max())
+    stats["per_second"] = dict(zip(seconds.tolist(), counts.tolist()))
+
+    ip, protocol, src, dst, ported, sport, dport = _decode(buf, offsets + RECORD_HEADER_LEN, caplen, linktype)
+    protocols = {"non-ip": int(n - ip.sum())} if not ip.all() else {}
+    values, counts = np.unique(protocol[ip], return_counts=True)
+    for value, count in zip(values.tolist(), counts.tolist()):
+        protocols[PROTOCOL_NAMES.get(value, f"ip-proto-{value}")] = count
+    stats["protocols"] = protocols
+
+    if ip.any():
+        endpoints = np.concatenate([src[ip], dst[ip]])
+        weights = np.concatenate([length[ip], length[ip]])
+        # Group equal addresses by sorting on two 64-bit halves (np.unique on 16-byte rows is far slower)
+        high = endpoints[:, :8].copy().view('>u8').ravel()
+        low = endpoints[:, 8:].copy().view('>u8').ravel()
+        order = np.lexsort((low, high))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (high[order][1:] != high[order][:-1]) | (low[order][1:] != low[order][:-1])
+        totals = np.bincount(np.cumsum(first) - 1, weights=weights[order])
+        addresses = endpoints[order[first]]
+        top = np.argsort(totals)[::-1][:MAX_TRACKED]
+        stats["talkers"] = {_format_address(addresses[i]): int(totals[i]) for i in top}
+
+    # Ports by the lower of the two, usually the service
+    if ported.any():
+        service = np.minimum(sport[ported], dport[ported])
+        keys, counts = np.unique(protocol[ported] * 65536 + service, return_counts=True)
+        order = np.argsort(counts)[::-1][:MAX_TRACKED]
+        stats["ports"] = {f"{PROTOCOL_NAMES[int(keys[i]) >> 16]}/{int(keys[i]) & 0xffff}": int(counts[i]) for i in order}
+    return stats
+
+
+# --- AGGREGATION ---
+def merge_stats(total, stats):
+    """
+    Returns the statistics of total and stats combined (analyze_capture dicts). Neither is modified.
+    """
+    if total is None:
+        return {**stats, **{key: dict(stats[key]) for key in ("per_second", "protocols", "talkers", "ports")}}
+    merged = {
+        "packets": total["packets"] + stats["packets"],
+        "bytes": total["bytes"] + stats["bytes"],
+        "first_ts": min((t for t in (total["first_ts"], stats["first_ts"]) if t is not None), default=None),
+        "last_ts": max((t for t in (total["last_ts"], stats["last_ts"]) if t is not None), default=None),
+    }
+    for key in ("per_second", "protocols", "talkers", "ports"):
+        counts = dict(total[key])
+        for name, value in stats[key].items():
+            counts[name] = counts.get(name, 0) + value
+        merged[key] = _top(counts) if len(counts) > MAX_TRACKED and key != "per_second" else counts
+    per_second = merged["per_second"]
+    if per_second:
+        newest = max(per_second)
+        merged["per_second"] = {second: n for second, n in per_second.items() if second > newest - PPS_WINDOW}
+    # Seconds in both are summed above, so the combined peak can exceed either one's
+    merged["peak_pps"] = max(total["peak_pps"], stats["peak_pps"], max(per_second.values(), default=0))
+    return merged
+
+
+def describe_stats(stats, top=TOP_N):
+    """
+    Returns statistics in the form saved to the summary file: counts, average and peak packets per
+    second, first/last packet time and the top talkers and ports.
+    """
+    span = (stats["last_ts"] - stats["first_ts"]) if stats["first_ts"] is not None else 0
+    return {
+        "packets": stats["packets"],
+        "bytes": stats["bytes"],
+        "first_packet": datetime.fromtimestamp(stats["first_ts"]).isoformat(timespec="seconds") if stats["first_ts"] is not None else None,
+        "last_packet": datetime.fromtimestamp(stats["last_ts"]).isoformat(timespec="seconds") if stats["last_ts"] is not None else None,
+        "pps": round(stats["packets"] / span, 2) if span > 0 else float(stats["packets"]),
+        "peak_pps": stats["peak_pps"],
+        "protocols": stats["protocols"],
+        "top_talkers": list(_top(stats["talkers"], top).items()),
+        "top_ports": list(_top(stats["ports"], top).items()),
+    }
+
+
+def format_summary(summary, top=3):
+    """
+    Returns display lines for a TrafficSummary.snapshot(): a project total and one line per firewall.
+    """
+    total = summary["total"]
+    lines = [f"Traffic ({summary['files_analyzed']} files analyzed): {total['packets']} packets, "
+             f"{total['bytes'] / 1e6:.1f} MB, {total['pps']:.0f} pkt/s average, {total['peak_pps']} pkt/s peak"]
+    for firewall, stages in sorted(summary["firewalls"].items()):
+        counts = ", ".join(f"{stage} {stats['packets']}" for stage, stats in stages.items() if stage != "total")
+        fw_total = stages["total"]
+        line = f"{firewall}: {counts} packets, peak {fw_total['peak_pps']} pkt/s"
+        if fw_total["top_talkers"]:
+            line += "; top talkers " + ", ".join(f"{a} ({b / 1e6:.1f} MB)" for a, b in fw_total["top_talkers"][:top])
+        if fw_total["top_ports"]:
+            line += "; top ports " + ", ".join(f"{p} ({c})" for p, c in fw_total["top_ports"][:top])
+        lines.append(line)
+    return lines
+
+
+class TrafficSummary:
+    """
+    Running traffic summary of one project, fed with every capture the download engine saves.
+
+    add() hands a file to a process pool (workers processes, spawned so they do not inherit the
+    engine's threads); analyze_capture() runs there and the result is merged into the statistics of
+    that firewall and capture stage (rx, tx, drp, fw). Files downloaded with delta or rotation
+    hold only new packets and are accumulated; full snapshots of a growing capture replace the
+    previous one instead, so packets are never counted twice, and a snapshot whose analysis finishes
+    after that of a newer one is ignored. After every file the summary is saved atomically as
+    <project>_traffic_summary.json in save_dir and on_update gets snapshot(). on_update and on_log
+    are called from a thread of the process pool.
+
+    pcap records carry no drop reason, so the drp stage shows what was dropped (talkers, ports,
+    protocols), not why; the firewall's global counters (show counter global filter delta yes
+    packet-filter yes) have the reasons.
+    """
+
+    def __init__(self, save_dir, project_name, workers=DEFAULT_WORKERS, on_update=None, on_log=None):
+        error = check_traffic_summary()
+        if error:
+            raise ValueError(error)
+        self.path = summary_path_for(save_dir, project_name)
+        self.project_name = project_name
+        self.on_update = on_update
+        self.on_log = on_log
+        self.files_analyzed = 0
+        self._stages = {}  # (firewall, stage) -> merged analyze_capture statistics
+        self._submitted = {}  # (firewall, stage) -> sequence number of the newest file queued
+        self._applied = {}  # (firewall, stage) -> sequence number of the full snapshot in _stages
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._closed = False
+
+    def __repr__(self):
+        return f"TrafficSummary(path={self.path!r}, files={self.files_analyzed})"
+
+    def add(self, firewall, stage, path, incremental=False):
+        """
+        Queues a saved capture for analysis. Returns immediately.
+        """
+        if self._closed:
+            return
+        key = (firewall, stage)
+        with self._lock:
+            sequence = self._submitted[key] = self._submitted.get(key, 0) + 1
+        try:
+            future = self._executor.submit(analyze_capture, path)
+        except RuntimeError as e:
+            # Also raised once a worker died (BrokenProcessPool)
+            self._log(f"Traffic summary: could not analyze {os.path.basename(path)}: {e}")
+            return
+        future.add_done_callback(lambda f: self._done(f, key, sequence, path, incremental))
+
+    def _done(self, future, key, sequence, path, incremental):
+        error = future.exception()
+        if error is not None:
+            self._log(f"Traffic summary: could not analyze {os.path.basename(path)}: {error}")
+            return
+        with self._lock:
+            if incremental:
+                self._stages[key] = merge_stats(self._stages.get(key), future.result())
+            elif sequence > self._applied.get(key, 0):
+                self._stages[key] = merge_stats(None, future.result())
+                self._applied[key] = sequence
+            else:
+                # Analyses finish out of order; a newer snapshot of this stage is already in place
+                return
+            self.files_analyzed += 1
+            summary = self._snapshot()
+            error = self._save(summary)
+        if error:
+            self._log(error)
+        if self.on_update is not None:
+            self.on_update(summary)
+
+    def snapshot(self):
+        """
+        Returns the summary as saved: project, updated, files_analyzed, total and per firewall a
+        total and one entry per capture stage (see describe_stats).
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        firewalls = {}
+        fw_totals = {}
+        total = None
+        for (firewall, stage), stats in sorted(self._stages.items()):
+            firewalls.setdefault(firewall, {})[stage] = describe_stats(stats)
+            fw_totals[firewall] = merge_stats(fw_totals.get(firewall), stats)
+            total = merge_stats(total, stats)
+        for firewall, stats in fw_totals.items():
+            firewalls[firewall]["total"] = describe_stats(stats)
+        return {
+            "project": self.project_name,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "files_analyzed": self.files_analyzed,
+            "total": describe_stats(total or EMPTY_STATS),
+            "firewalls": firewalls,
+        }
+
+    def _save(self, summary):
+        try:
+            with AtomicWriter(self.path) as f:
+                f.write(json.dumps(summary, indent=2).encode("utf-8"))
+        except OSError as e:
+            return f"Traffic summary: could not write {self.path}: {e}"
+        return None
+
+    def _log(self, message):
+        if self.on_log is not None:
+            self.on_log(message)
+
+    def close(self):
+        """
+        Waits for queued analyses and stops the worker processes. Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,5 @@
+# This file makes the flat modules in src/ importable from the tests, the way src/main.py imports them.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
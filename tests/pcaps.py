@@ -0,0 +1,44 @@
+# This file builds small synthetic pcap files for the tests.
+import socket
+import struct
+
+LINKTYPE_ETHERNET = 1
+
+
+def global_header(linktype=LINKTYPE_ETHERNET, nanoseconds=False, endian='<', snaplen=65535):
+    magic = 0xa1b23c4d if nanoseconds else 0xa1b2c3d4
+    return struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, snaplen, linktype)
+
+
+def ethernet_ipv4(src, dst, sport, dport, proto=6, payload=b"x" * 20):
+    """
+    Returns an Ethernet frame with an IPv4 header and a TCP (proto 6) or UDP (proto 17) header.
+    """
+    if proto == 6:
+        l4 = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 0x50, 0x18, 1000, 0, 0)
+    else:
+        l4 = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(l4) + len(payload), 0, 0, 64, proto, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return b"\x00" * 12 + b"\x08\x00" + ip + l4 + payload
+
+
+def record(seconds, fraction, data, endian='<', origlen=None):
+    """
+    Returns a pcap record: fraction is microseconds (or nanoseconds in a nanosecond file).
+    """
+    return struct.pack(endian + 'IIII', seconds, fraction, len(data), len(data) if origlen is None else origlen) + data
+
+
+def packet(i, src="10.0.0.1", dst="10.0.0.2", dport=443):
+    """
+    Returns the i-th record of a simple capture: one TCP packet per second from port 1000 + i.
+    """
+    return record(1700000000 + i, i, ethernet_ipv4(src, dst, 1000 + i, dport))
+
+
+def write_pcap(path, records, header=None):
+    with open(path, 'wb') as f:
+        f.write(header or global_header())
+        f.write(b"".join(records))
+    return path
@@ -0,0 +1,18 @@
+from key_cache import KeyCache
+
+
+def test_in_memory_key_requires_the_same_password():
+    cache = KeyCache()
+    cache.put("fw1", "admin", "secret", "KEY1")
+    assert cache.get("fw1", "admin", "secret") == "KEY1"
+    assert cache.get("fw1", "admin", "wrong") is None
+    assert cache.get("fw1", "other", "secret") is None
+
+
+def test_discard_only_drops_the_given_key():
+    cache = KeyCache()
+    cache.put("fw1", "admin", "secret", "KEY2")
+    cache.discard("fw1", "admin", "KEY1")
+    assert cache.get("fw1", "admin", "secret") == "KEY2"
+    cache.discard("fw1", "admin", "KEY2")
+    assert cache.get("fw1", "admin", "secret") is None
@@ -0,0 +1,112 @@
+import os
+
+from pcap_index import IndexBuilder, INDEX_HEADER, INDEX_MAGIC, index_path_for, query_directory, query_index, _address
+from pcap_stream import DeltaExtractor, DeltaState, GLOBAL_HEADER_LEN
+from download_writer import PART_SUFFIX
+from pcaps import global_header, packet, write_pcap
+
+RECORDS = [packet(0, dst="10.0.0.2"), packet(1, dst="10.0.0.3", dport=53), packet(2, dst="10.0.0.2"),
+           packet(3, src="10.0.0.9", dst="10.0.0.2", dport=22)]
+
+
+def download(pcap_path, data, inner=None, chunk_size=11):
+    """
+    Runs data through an IndexBuilder the way a download does: stores what it passes through, then publishes the index.
+    """
+    builder = IndexBuilder(index_path_for(str(pcap_path)), inner)
+    with open(pcap_path, 'wb') as f:
+        for i in range(0, len(data), chunk_size):
+            f.write(builder.feed(data[i:i + chunk_size]))
+        f.write(builder.finish())
+    builder.publish()
+    builder.close()
+    return builder
+
+
+def stored_records(pcap_path, matches):
+    with open(pcap_path, 'rb') as f:
+        data = f.read()
+    return [data[offset:offset + length] for _, offset, length in matches]
+
+
+def test_index_round_trip(tmp_path):
+    pcap = tmp_path / "p_fw_rx.pcap"
+    builder = download(pcap, global_header() + b"".join(RECORDS))
+    assert builder.entries == 4
+    with open(index_path_for(str(pcap)), 'rb') as f:
+        assert INDEX_HEADER.unpack(f.read(INDEX_HEADER.size)) == (INDEX_MAGIC, 1, 0, 0)
+    linktype, matches = query_index(index_path_for(str(pcap)))
+    assert linktype == 1
+    assert stored_records(pcap, matches) == RECORDS
+    assert matches[0][:2] == (1700000000 * 10 ** 9, GLOBAL_HEADER_LEN)
+
+
+def test_query_index_filters(tmp_path):
+    pcap = tmp_path / "p_fw_rx.pcap"
+    download(pcap, global_header() + b"".join(RECORDS))
+    index = index_path_for(str(pcap))
+    assert stored_records(pcap, query_index(index, host=_address("10.0.0.3"))[1]) == RECORDS[1:2]
+    assert stored_records(pcap, query_index(index, host=_address("10.0.0.9"))[1]) == RECORDS[3:4]
+    assert stored_records(pcap, query_index(index, port=443)[1]) == [RECORDS[0], RECORDS[2]]
+    assert stored_records(pcap, query_index(index, port=1001)[1]) == RECORDS[1:2]
+    assert query_index(index, proto=17)[1] == []
+    assert len(query_index(index, proto=6)[1]) == 4
+    start, end = 1700000001 * 10 ** 9, 1700000002 * 10 ** 9 + 2000
+    assert stored_records(pcap, query_index(index, start_ns=start, end_ns=end)[1]) == RECORDS[1:3]
+
+
+def test_offsets_point_into_the_delta_file(tmp_path):
+    state = DeltaState()
+    # The download commits the delta state once the pcap is stored
+    download(tmp_path / "p_fw_rx_1.pcap", global_header() + b"".join(RECORDS[:2]), DeltaExtractor(state)).inner.commit()
+    extractor = DeltaExtractor(state)
+    pcap = tmp_path / "p_fw_rx_2.pcap"
+    download(pcap, global_header() + b"".join(RECORDS), extractor)
+    extractor.commit()
+    _, matches = query_index(index_path_for(str(pcap)))
+    assert matches[0][1] == GLOBAL_HEADER_LEN
+    assert stored_records(pcap, matches) == RECORDS[2:]
+
+
+def test_index_is_only_published_with_its_pcap(tmp_path):
+    index = index_path_for(str(tmp_path / "p_fw_rx.pcap"))
+    builder = IndexBuilder(index)
+    builder.feed(global_header() + b"".join(RECORDS))
+    builder.finish()
+    assert not os.path.exists(index)
+    assert os.path.exists(index + PART_SUFFIX)
+    # A download that fails after finish() but before the pcap is renamed leaves nothing behind
+    builder.close()
+    assert not os.path.exists(index + PART_SUFFIX)
+    assert not os.path.exists(index)
+
+
+def test_failed_download_removes_partial_index(tmp_path):
+    index = index_path_for(str(tmp_path / "p_fw_rx.pcap"))
+    builder = IndexBuilder(index)
+    builder.feed(global_header() + RECORDS[0])
+    builder.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_query_directory_merges_in_time_order(tmp_path):
+    download(tmp_path / "p_fw_rx.pcap", global_header() + RECORDS[0] + RECORDS[2])
+    download(tmp_path / "p_fw_tx.pcap", global_header() + RECORDS[1] + RECORDS[3])
+    download(tmp_path / "other_fw_rx.pcap", global_header() + RECORDS[0])
+    out = tmp_path / "out.pcap"
+    packets, warnings = query_directory(str(tmp_path), str(out), project_name="p", proto=6)
+    assert (packets, warnings) == (4, [])
+    with open(out, 'rb') as f:
+        assert f.read() == global_header() + b"".join(RECORDS)
+
+
+def test_query_directory_skips_index_without_pcap(tmp_path):
+    download(tmp_path / "p_fw_rx.pcap", global_header() + RECORDS[0])
+    download(tmp_path / "p_fw_tx.pcap", global_header() + RECORDS[1])
+    os.remove(tmp_path / "p_fw_tx.pcap")
+    out = tmp_path / "out.pcap"
+    packets, warnings = query_directory(str(tmp_path), str(out), project_name="p")
+    assert packets == 1
+    assert len(warnings) == 1 and "missing" in warnings[0]
+    with open(out, 'rb') as f:
+        assert f.read() == global_header() + RECORDS[0]
@@ -0,0 +1,144 @@
+import gzip
+import os
+import struct
+
+import pytest
+
+from pcap_merge import (merge_pcaps, BLOCK_SHB, BLOCK_IDB, BLOCK_EPB, BYTE_ORDER_MAGIC, OPT_END, OPT_IF_NAME,
+                        OPT_IF_TSRESOL)
+from pcaps import ethernet_ipv4, global_header, record, write_pcap
+
+
+def read_blocks(path):
+    """
+    Returns the (block type, body) of every block in a pcapng file, checking each block's framing.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    blocks = []
+    pos = 0
+    while pos < len(data):
+        block_type, length = struct.unpack_from('<II', data, pos)
+        assert length % 4 == 0 and length >= 12
+        assert struct.unpack_from('<I', data, pos + length - 4)[0] == length
+        blocks.append((block_type, data[pos + 8:pos + length - 4]))
+        pos += length
+    assert pos == len(data)
+    return blocks
+
+
+def read_options(data):
+    options = {}
+    pos = 0
+    while pos < len(data):
+        code, length = struct.unpack_from('<HH', data, pos)
+        if code == OPT_END:
+            break
+        options[code] = data[pos + 4:pos + 4 + length]
+        pos += 4 + length + (4 - length % 4) % 4
+    return options
+
+
+def packets(blocks):
+    """
+    Returns (interface id, timestamp ns, caplen, origlen, data) of every enhanced packet block.
+    """
+    result = []
+    for block_type, body in blocks:
+        if block_type == BLOCK_EPB:
+            interface_id, high, low, caplen, origlen = struct.unpack_from('<IIIII', body, 0)
+            result.append((interface_id, (high << 32) | low, caplen, origlen, body[20:20 + caplen]))
+    return result
+
+
+def frame(n, size=20):
+    return ethernet_ipv4("10.0.0.1", "10.0.0.2", 1000 + n, 443, payload=b"p" * size)
+
+
+def test_merge_orders_packets_by_time(tmp_path):
+    rx = write_pcap(tmp_path / "rx.pcap", [record(100, 0, frame(1)), record(102, 0, frame(4)), record(104, 0, frame(7))])
+    tx = write_pcap(tmp_path / "tx.pcap", [record(101, 0, frame(2)), record(101, 500000, frame(3)), record(105, 0, frame(8))])
+    drp = write_pcap(tmp_path / "drp.pcap", [record(103, 0, frame(5)), record(103, 1, frame(6))])
+    out = tmp_path / "merged.pcapng"
+    assert merge_pcaps([("rx", str(rx)), ("tx", str(tx)), ("drp", str(drp))], str(out)) == 8
+    merged = packets(read_blocks(out))
+    assert [ts for _, ts, _, _, _ in merged] == sorted(ts for _, ts, _, _, _ in merged)
+    assert [data for _, _, _, _, data in merged] == [frame(n) for n in range(1, 9)]
+    assert [interface for interface, _, _, _, _ in merged] == [0, 1, 1, 0, 2, 2, 0, 1]
+    # Microseconds are converted to the nanosecond resolution of the output
+    assert merged[2][1] == 101 * 10 ** 9 + 500000 * 1000
+    assert merged[5][1] == 103 * 10 ** 9 + 1000
+
+
+def test_merge_block_layout(tmp_path):
+    rx = write_pcap(tmp_path / "rx.pcap", [record(100, 0, frame(1, size=21), origlen=1500)])
+    tx = write_pcap(tmp_path / "tx.pcap", [record(101, 7, frame(2))], header=global_header(linktype=101, nanoseconds=True))
+    out = tmp_path / "merged.pcapng"
+    merge_pcaps([("rx", str(rx)), ("tx", str(tx))], str(out), comment="interval 1")
+    blocks = read_blocks(out)
+    assert [block_type for block_type, _ in blocks] == [BLOCK_SHB, BLOCK_IDB, BLOCK_IDB, BLOCK_EPB, BLOCK_EPB]
+    magic, major, minor, section_length = struct.unpack_from('<IHHq', blocks[0][1], 0)
+    assert (magic, major, minor, section_length) == (BYTE_ORDER_MAGIC, 1, 0, -1)
+    for (_, body), (linktype, name) in zip(blocks[1:3], [(1, b"rx"), (101, b"tx")]):
+        assert struct.unpack_from('<HHI', body, 0) == (linktype, 0, 65535)
+        options = read_options(body[8:])
+        assert options[OPT_IF_NAME] == name
+        assert options[OPT_IF_TSRESOL] == bytes([9])
+    (_, _, caplen, origlen, data), (_, ts, _, _, _) = packets(blocks)
+    # Packet data is padded to 4 bytes inside the block, caplen and origlen are kept
+    assert (caplen, origlen, data) == (len(frame(1, size=21)), 1500, frame(1, size=21))
+    assert ts == 101 * 10 ** 9 + 7
+
+
+def test_merge_append_adds_a_section(tmp_path):
+    rx = write_pcap(tmp_path / "rx.pcap", [record(100, 0, frame(1))])
+    out = tmp_path / "rolling.pcapng"
+    merge_pcaps([("rx", str(rx))], str(out))
+    merge_pcaps([("rx", str(rx))], str(out), append=True)
+    assert [block_type for block_type, _ in read_blocks(out)] == [BLOCK_SHB, BLOCK_IDB, BLOCK_EPB] * 2
+
+
+def test_merge_reads_compressed_inputs(tmp_path):
+    plain = write_pcap(tmp_path / "rx.pcap", [record(100, 0, frame(1)), record(102, 0, frame(3))])
+    with open(plain, 'rb') as f, gzip.open(tmp_path / "rx.pcap.gz", 'wb') as out:
+        out.write(f.read())
+    os.remove(plain)
+    tx = write_pcap(tmp_path / "tx.pcap", [record(101, 0, frame(2))])
+    out = tmp_path / "merged.pcapng"
+    assert merge_pcaps([("rx", str(tmp_path / "rx.pcap.gz")), ("tx", str(tx))], str(out)) == 3
+    assert [data for _, _, _, _, data in packets(read_blocks(out))] == [frame(1), frame(2), frame(3)]
+
+
+def failing_source(tmp_path):
+    """
+    Returns a gzip capture that is cut off partway, so reading its records fails during the merge.
+    """
+    records = [record(100 + i, 0, ethernet_ipv4("10.0.0.1", "10.0.0.2", 1000, 443, payload=os.urandom(1000)))
+               for i in range(50)]
+    data = gzip.compress(global_header() + b"".join(records))
+    path = tmp_path / "drp.pcap.gz"
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    return str(path)
+
+
+def test_failed_merge_leaves_no_output(tmp_path):
+    rx = write_pcap(tmp_path / "rx.pcap", [record(100, 0, frame(1))])
+    out = tmp_path / "merged.pcapng"
+    with pytest.raises(EOFError):
+        merge_pcaps([("rx", str(rx)), ("drp", failing_source(tmp_path))], str(out))
+    assert sorted(os.listdir(tmp_path)) == ["drp.pcap.gz", "rx.pcap"]
+
+
+def test_failed_append_leaves_rolling_file_unchanged(tmp_path):
+    rx = write_pcap(tmp_path / "rx.pcap", [record(100, 0, frame(1))])
+    out = tmp_path / "rolling.pcapng"
+    merge_pcaps([("rx", str(rx))], str(out), append=True)
+    with open(out, 'rb') as f:
+        before = f.read()
+    with pytest.raises(EOFError):
+        merge_pcaps([("rx", str(rx)), ("drp", failing_source(tmp_path))], str(out), append=True)
+    with open(out, 'rb') as f:
+        assert f.read() == before
+    merge_pcaps([("rx", str(rx))], str(out), append=True)
+    assert [block_type for block_type, _ in read_blocks(out)] == [BLOCK_SHB, BLOCK_IDB, BLOCK_EPB] * 2
@@ -0,0 +1,169 @@
+import struct
+
+import pytest
+
+from pcap_stream import (DeltaExtractor, DeltaState, PcapFormatError, PcapStreamParser, GLOBAL_HEADER_LEN,
+                         parse_global_header, packet_five_tuple, IPV4_MAPPED_PREFIX)
+from pcaps import ethernet_ipv4, global_header, packet, record
+
+RECORDS = [packet(i) for i in range(10)]
+
+
+def snapshot(records):
+    return global_header() + b"".join(records)
+
+
+def extract(state, data, chunk_size=7, commit=True):
+    """
+    Feeds data to a DeltaExtractor in small chunks. Returns (extractor, output).
+    """
+    extractor = DeltaExtractor(state)
+    out = b"".join(extractor.feed(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size))
+    out += extractor.finish()
+    if commit:
+        extractor.commit()
+    return extractor, out
+
+
+# --- PARSER ---
+def test_parse_global_header():
+    assert parse_global_header(global_header()) == ('<', False, 1, 65535)
+    assert parse_global_header(global_header(linktype=101, nanoseconds=True, endian='>')) == ('>', True, 101, 65535)
+    with pytest.raises(PcapFormatError):
+        parse_global_header(b"\x00" * GLOBAL_HEADER_LEN)
+
+
+def test_parser_splits_records_across_chunks():
+    data = snapshot(RECORDS[:3])
+    parser = PcapStreamParser()
+    records = []
+    for i in range(0, len(data), 5):
+        records.extend(parser.feed(data[i:i + 5]))
+    assert parser.header == global_header()
+    assert [r for _, r in records] == RECORDS[:3]
+    assert records[0][0] == GLOBAL_HEADER_LEN
+    assert records[1][0] == GLOBAL_HEADER_LEN + len(RECORDS[0])
+
+
+def test_parser_keeps_partial_record_buffered():
+    parser = PcapStreamParser()
+    assert [r for _, r in parser.feed(snapshot(RECORDS[:2]) + RECORDS[2][:10])] == RECORDS[:2]
+    assert [r for _, r in parser.feed(RECORDS[2][10:])] == [RECORDS[2]]
+
+
+def test_record_timestamp_resolution():
+    parser = PcapStreamParser()
+    parser.feed(global_header())
+    assert parser.record_timestamp(record(10, 5, b"")) == 10 * 10 ** 9 + 5000
+    parser = PcapStreamParser()
+    parser.feed(global_header(nanoseconds=True))
+    assert parser.record_timestamp(record(10, 5, b"")) == 10 * 10 ** 9 + 5
+
+
+# --- DELTA EXTRACTION ---
+def test_first_snapshot_is_stored_in_full():
+    state = DeltaState()
+    extractor, out = extract(state, snapshot(RECORDS[:3]))
+    assert out == snapshot(RECORDS[:3])
+    assert extractor.new_records == 3
+    assert state.records == 3
+    assert state.length == len(snapshot(RECORDS[:3]))
+
+
+def test_unchanged_snapshot_emits_nothing():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:3]))
+    extractor, out = extract(state, snapshot(RECORDS[:3]))
+    assert out == b""
+    assert extractor.new_records == 0
+    assert not extractor.mismatch
+
+
+def test_appended_records_only():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:3]))
+    extractor, out = extract(state, snapshot(RECORDS[:7]))
+    assert out == snapshot(RECORDS[3:7])
+    assert extractor.new_records == 4
+    extractor, out = extract(state, snapshot(RECORDS[:8]))
+    assert out == snapshot(RECORDS[7:8])
+
+
+def test_trailing_partial_record_is_held_back():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:3]))
+    _, out = extract(state, snapshot(RECORDS[:5]) + RECORDS[5][:10])
+    assert out == snapshot(RECORDS[3:5])
+    # The partial record is new in the next snapshot, once complete
+    _, out = extract(state, snapshot(RECORDS[:6]))
+    assert out == snapshot(RECORDS[5:6])
+
+
+def test_cleared_capture_is_stored_in_full():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:5]))
+    extractor, out = extract(state, snapshot(RECORDS[5:7]))
+    assert out == snapshot(RECORDS[5:7])
+    assert extractor.new_records == 2
+    assert not extractor.mismatch
+    _, out = extract(state, snapshot(RECORDS[5:8]))
+    assert out == snapshot(RECORDS[7:8])
+
+
+def assert_mismatch_then_full(state, changed):
+    extractor, out = extract(state, snapshot(changed))
+    assert extractor.mismatch
+    assert out == b""
+    assert extractor.new_records == 0
+    assert state.head_digest is None
+    # With the state reset, downloading the snapshot again stores it in full
+    extractor, out = extract(state, snapshot(changed))
+    assert out == snapshot(changed)
+    assert not extractor.mismatch
+
+
+def test_changed_records_are_a_mismatch():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:4]))
+    # Same first record and length up to where the previous snapshot ended, different content
+    changed = RECORDS[:1] + [packet(1, dst="10.9.9.9")] + RECORDS[2:6]
+    assert_mismatch_then_full(state, changed)
+
+
+def test_record_straddling_the_previous_end_is_a_mismatch():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:4]))
+    longer = record(1700000003, 3, ethernet_ipv4("10.0.0.1", "10.0.0.2", 1003, 443, payload=b"y" * 40))
+    assert_mismatch_then_full(state, RECORDS[:3] + [longer] + RECORDS[4:5])
+
+
+def test_shorter_snapshot_is_a_mismatch():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:5]))
+    extractor, out = extract(state, snapshot(RECORDS[:3]))
+    assert extractor.mismatch
+    assert out == b""
+    assert state.head_digest is None
+
+
+def test_uncommitted_snapshot_keeps_the_baseline():
+    state = DeltaState()
+    extract(state, snapshot(RECORDS[:3]))
+    extract(state, snapshot(RECORDS[:6]), commit=False)
+    _, out = extract(state, snapshot(RECORDS[:6]))
+    assert out == snapshot(RECORDS[3:6])
+
+
+# --- PACKET DECODING ---
+def test_packet_five_tuple_ipv4_tcp():
+    src, dst, sport, dport, proto = packet_five_tuple(1, ethernet_ipv4("10.0.0.1", "10.0.0.2", 1234, 443))
+    assert src == IPV4_MAPPED_PREFIX + bytes([10, 0, 0, 1])
+    assert dst == IPV4_MAPPED_PREFIX + bytes([10, 0, 0, 2])
+    assert (sport, dport, proto) == (1234, 443, 6)
+
+
+def test_packet_five_tuple_vlan_tags_and_non_ip():
+    frame = ethernet_ipv4("10.0.0.1", "10.0.0.2", 53, 5353, proto=17)
+    tagged = frame[:12] + struct.pack('!HH', 0x8100, 7) + struct.pack('!HH', 0x8100, 8) + frame[12:]
+    assert packet_five_tuple(1, tagged)[2:] == (53, 5353, 17)
+    assert packet_five_tuple(1, b"\x00" * 12 + b"\x08\x06" + b"\x00" * 28) is None